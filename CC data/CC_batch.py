@@ -0,0 +1,215 @@
+#Batch version of BP3_CC_prep.ipynb. Preps BP3+ inputs for every SSP/period
+#scenario in one run: the FWI cutoffs, node days, sheet geometry and the
+#baseline weather are read once, the adjustment factors for all scenarios come
+#from one scan of the FWI store (a sheet x scenario array) and are smoothed
+#together (see spatial_smooth.py), and the ign/SED dists and thresholded
+#weather are written for all scenarios at once. A manifest of what was written
+#goes in OUT_DIR. Run on the office desktop, see BP3_CC_prep.ipynb for the
+#drive setup.
+
+import pandas as pd
+import geopandas as gpd
+import numpy as np
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from fwi_store import scan_csvs, ingest, exceedance, write_thresholded
+from spatial_smooth import load_graph, smooth
+
+#Inputs shared by all scenarios
+FWI_CF_FP="C:\\Users\\GiovanniCorti\\Documents\\shp_files\\FWI_cf.shp"
+ND_LSM_FP="C:\\Users\\GiovanniCorti\\Documents\\node_days_lsm.csv"
+NTS_FP="C:\\Users\\GiovanniCorti\\Documents\\shp_files\\nts_snrc_250k.shp"
+BP_GLOB="Y:\\client-data\\demo_projects\\climate85\\Working_data\\BP3+Outputs\\2010-2020\\BP_[0-9]*.tif"
+FWI_CSV_DIR="G:\\fwi_cdelta"
+FWI_STORE_DIR="G:\\fwi_store"
+#Cached sheet neighbour graphs, see spatial_smooth.py
+GRAPH_DIR="C:\\Users\\GiovanniCorti\\Documents\\graph_cache"
+#Sheet folders with the baseline ign/SED dists, also where the scenario files go
+OUT_DIR="Z:\\BP3Inputs"
+
+ssp_ls=['ssp126','ssp245','ssp585']
+period_ls=[[2020,2040],[2040,2060],[2060,2080],[2080,2100]]
+#Years and fire season days (1 April to 1 Nov) in the baseline weather
+n_years=11
+fs_days=214
+
+
+def scen_name(ssp,period):
+    #e.g. 'ssp1262040_2060', as used in the weather and dist file names
+    return ssp+str(period[0])+'_'+str(period[1])
+
+def load_baseline(fwi_cf_fp=FWI_CF_FP,nd_fp=ND_LSM_FP,nts_fp=NTS_FP,bp_glob=BP_GLOB):
+    """
+    Reads the inputs shared by every scenario.
+
+    Returns
+    -------
+    base : dict
+        'NTS_ls' (sheets in the final BP output map), 'FWI_cf' and 'n_samples'
+        (Series indexed by NTS code) and 'nts' (GeoDataFrame of the sheets,
+        same order as NTS_ls).
+    """
+    NTS_ls=[fp[-8:-4] for fp in sorted(glob.glob(bp_glob))]
+    nts=gpd.read_file(nts_fp)
+    nts=nts[nts['NTS_SNRC'].isin(NTS_ls)].reset_index(drop=True)
+    NTS_ls=list(nts['NTS_SNRC'])
+    FWI_cf_df=gpd.read_file(fwi_cf_fp)
+    FWI_cf=pd.Series(FWI_cf_df['FWI_cf'].values,index=FWI_cf_df['NTS_SNRC']).reindex(NTS_ls)
+    nd_lsm_df=pd.read_csv(nd_fp)
+    n_samples=pd.Series(nd_lsm_df['node_days'].values,index=nd_lsm_df['NTS_SNRC'])*n_years*fs_days
+    return {'NTS_ls':NTS_ls,'FWI_cf':FWI_cf,'n_samples':n_samples,'nts':nts}
+
+def adj_factors(base,scen_ls,store_dir=FWI_STORE_DIR):
+    """
+    Change in the fraction of days above the FWI cutoff, scenario over the
+    land/sea masked baseline, for every sheet and scenario from one scan of
+    the FWI store. Sheets with no land nodes (i.e., just a few small islands)
+    have no weather data and are nan.
+
+    Returns
+    -------
+    af : DataFrame
+        Index is NTS code, one column per scenario.
+    """
+    FWI_cf=base['FWI_cf'].dropna()
+    pabv=exceedance(store_dir,FWI_cf,denom=base['n_samples'],scenarios=['lsm']+scen_ls)
+    pabv=pabv.reindex(index=base['NTS_ls'],columns=['lsm']+scen_ls)
+    af=pabv[scen_ls].astype(np.float32).div(pabv['lsm'].astype(np.float32),axis=0)
+    return af
+
+def _two_point(avg):
+    #Values and percentages of a two value dist with the given average
+    vals=[np.floor(avg),np.floor(avg)+1]
+    rf=[100*np.round(1-avg%1,2),100*np.round(avg%1,2)]
+    return np.int8(vals),np.int8(rf)
+
+def _rewrite_sheet(NTS_code,af_row,out_dir):
+    #Reads the sheet's baseline ign/SED dists once and writes the adjusted dists
+    #for every scenario
+    sheet_dir=os.path.join(out_dir,NTS_code)
+    ign_df=pd.read_csv(os.path.join(sheet_dir,"ign_dist_"+NTS_code+".csv"))
+    sed_df=pd.read_csv(os.path.join(sheet_dir,"sed_dist_"+NTS_code+".csv"))
+    ign_avg=np.sum(ign_df["ign_per_it"]*ign_df['pct']/100)
+    sed_avg=np.sum(sed_df["sp_ev_days"]*sed_df['pct']/100)
+
+    fp_ls=[]
+    for scen,af in af_row.items():
+        if np.isnan(af):
+            continue
+        cc_ign_avg=ign_avg*af
+        cc_sed_avg=sed_avg*af
+        vals,rf=_two_point(cc_ign_avg)
+        cc_ign_df=pd.DataFrame({'ign_per_it':vals,'pct':rf})
+        vals,rf=_two_point(cc_sed_avg)
+        cc_SED_df=pd.DataFrame({'sp_ev_days':vals,'pct':rf})
+        if cc_sed_avg<1:
+            cc_SED_df=pd.DataFrame({'sp_ev_days':np.int8([1]),'pct':np.int8([100])})
+
+        ign_fp=os.path.join(sheet_dir,"ign_dist_"+NTS_code+"_"+scen+".csv")
+        sed_fp=os.path.join(sheet_dir,"sed_dist_"+NTS_code+"_"+scen+".csv")
+        cc_ign_df.to_csv(ign_fp,index=False)
+        cc_SED_df.to_csv(sed_fp,index=False)
+        fp_ls+=[ign_fp,sed_fp]
+    return fp_ls
+
+def rewrite_dists(af_sm,out_dir=OUT_DIR,n_threads=8):
+    """
+    Writes the adjusted ign and SED dists for every sheet and scenario. Sheets
+    are done at the same time, each reads its baseline dists once.
+
+    Parameters
+    ----------
+    af_sm : DataFrame
+        Smoothed adjustment factors, index is NTS code and one column per
+        scenario. Scenarios where a sheet is nan are skipped.
+    out_dir : string, optional
+        Folder with a sub folder per sheet. The default is OUT_DIR.
+    n_threads : integer, optional
+        Number of sheets written at the same time. The default is 8.
+
+    Returns
+    -------
+    fp_dict : dict
+        NTS code -> list of files written.
+    """
+    with ThreadPoolExecutor(max_workers=n_threads) as ex:
+        futs={NTS_code:ex.submit(_rewrite_sheet,NTS_code,row,out_dir) for NTS_code,row in af_sm.iterrows()}
+    fp_dict={}
+    for NTS_code,fut in futs.items():
+        try:
+            fp_dict[NTS_code]=fut.result()
+        except Exception as e:
+            print(NTS_code,e)
+            fp_dict[NTS_code]=None
+    return fp_dict
+
+def run_batch(scen_ls=None,out_dir=OUT_DIR,store_dir=FWI_STORE_DIR,csv_dir=FWI_CSV_DIR,n_threads=8):
+    """
+    Preps the BP3+ inputs for a set of climate scenarios in one go.
+
+    Parameters
+    ----------
+    scen_ls : list of string, optional
+        Scenario names (see scen_name). The default is None, every SSP/period
+        in ssp_ls and period_ls.
+    out_dir : string, optional
+        Sheet folders for the outputs. The default is OUT_DIR.
+    store_dir : string, optional
+        FWI store (see fwi_store.py). The default is FWI_STORE_DIR.
+    csv_dir : string, optional
+        Folder with the baseline and scenario weather csvs. The default is
+        FWI_CSV_DIR.
+    n_threads : integer, optional
+        Number of files read/written at the same time. The default is 8.
+
+    Returns
+    -------
+    manifest : dict
+        Also written to out_dir/cc_manifest.json.
+    """
+    if scen_ls==None:
+        scen_ls=[scen_name(ssp,period) for ssp in ssp_ls for period in period_ls]
+    t0=time.time()
+    base=load_baseline()
+
+    #Only weather csvs that are new or have changed are read
+    csv_ls=scan_csvs(csv_dir,prefix="fwi_era_lsm_NTS_SNRC_",baseline='lsm')
+    csv_ls+=[c for c in scan_csvs(csv_dir) if c[1] in scen_ls]
+    ingest(csv_ls,store_dir,n_threads=n_threads)
+
+    af=adj_factors(base,scen_ls,store_dir)
+    #nanmean of each sheet with the sheets it touches, all scenarios at once
+    W=load_graph(base['nts'],'touches',GRAPH_DIR)
+    af_sm=smooth(W,af,include_self=True)
+    af.to_csv(os.path.join(out_dir,"cc_adj_fact.csv"))
+    af_sm.to_csv(os.path.join(out_dir,"cc_adj_fact_sm.csv"))
+
+    fp_dict=rewrite_dists(af_sm,out_dir,n_threads=n_threads)
+    FWI_cf=base['FWI_cf'].dropna()
+    wx_dict={}
+    for scen in scen_ls:
+        print("Writing weather for "+scen)
+        wx_dict[scen]=len(write_thresholded(store_dir,FWI_cf,os.path.join(out_dir,"{0}","fwi_cf_era_NTS_SNRC_{0}_{1}.csv"),
+                                            scenario=scen,n_threads=n_threads))
+
+    manifest={'scenarios':scen_ls,'n_sheets':len(base['NTS_ls']),
+              'failed':sorted(k for k,v in fp_dict.items() if v==None),
+              'no_weather':sorted(af.index[af.isna().all(axis=1)]),
+              'n_dist_files':sum(len(v) for v in fp_dict.values() if v!=None),
+              'n_weather_files':wx_dict,
+              'af_sm_mean':{scen:float(af_sm[scen].mean()) for scen in scen_ls},
+              'run_time':time.time()-t0}
+    tmp_fp=os.path.join(out_dir,'cc_manifest.json.tmp')
+    with open(tmp_fp,'w') as f:
+        json.dump(manifest,f,indent=1)
+    os.replace(tmp_fp,os.path.join(out_dir,'cc_manifest.json'))
+    return manifest
+
+
+if __name__ == "__main__":
+    run_batch()
@@ -0,0 +1,201 @@
+#Period climatologies (day-of-year means over a range of years) for the yearly
+#CanDCS ensemble files from PCIC_Download.py. Each yearly file is read once per
+#SSP/var into a cumulative sum store, C[k] = sum of the first k years, kept on
+#disk as a memory-mapped .npy. The mean over any range of years is then
+#(C[k1]-C[k0])/(k1-k0), two slices of the store, so new period windows don't
+#mean re-reading the yearly files. Used by CMIP_deltas.ipynb.
+#Each row of the store is a float32 365x510x1068 cube (~0.8 GB), so a full store
+#of 2015-2100 would be ~70 GB per SSP/var. Pass the period windows to build_store
+#and only the sums at the window edges are kept (2 rows per window at most).
+
+import xarray as xr
+import numpy as np
+import json
+import os
+import multiprocessing as mp
+
+#Folder, file suffix and variable name in the yearly files, plus the name used
+#for the period files, for each climate var
+var_dict={'pr':('pr','_mean.nc','pr','pr_day'),
+          'tasmax':('tasmax','_mean.nc','tasmax','tmax_day'),
+          'wet_days':('wet_days','_tot.nc','pr','wet_days')}
+
+
+def _cuts(years,windows):
+    #Years at which the cumulative sum is stored. Row k holds the sum of the
+    #years before cuts[k]
+    if windows==None:
+        return list(years)+[years[-1]+1]
+    cuts=sorted(set([sy for sy,ey in windows]+[ey+1 for sy,ey in windows]))
+    assert cuts[0]>=years[0] and cuts[-1]<=years[-1]+1, "windows must be inside years"
+    return cuts
+
+def build_store(in_dir,years,store_fp,suffix='_mean.nc',var='pr',windows=None):
+    """
+    Builds the cumulative sum store for one SSP/var. Years are read in order
+    and the running sum is kept in float64 before being written as float32.
+    With windows, only the years they cover are read and only the sums at
+    the window edges are stored, so the store only gives means over those
+    windows (or unions of adjacent ones).
+
+    Parameters
+    ----------
+    in_dir : string
+        Folder with the yearly files, e.g. 'D:\\CanDCSensemble\\ssp126\\pr'.
+    years : list of integer
+        Consecutive years to include.
+    store_fp : string
+        Output .npy file. A .json with the years and coords is written next
+        to it.
+    suffix : string, optional
+        Yearly file suffix. The default is '_mean.nc'.
+    var : string, optional
+        Variable name in the yearly files. The default is 'pr'.
+    windows : list of tuple, optional
+        (first year, last year) of each period needed. The default is None,
+        which stores the sums for every year.
+
+    Returns
+    -------
+    """
+    years=list(years)
+    assert years==list(range(years[0],years[-1]+1)), "years must be consecutive"
+    cuts=_cuts(years,windows)
+    years=list(range(cuts[0],cuts[-1]))
+    first=xr.open_dataset(os.path.join(in_dir,str(years[0])+suffix))
+    shape=first[var].shape
+    meta={'years':years,'cuts':cuts,'var':var,'lat':first['lat'].values.tolist(),
+          'lon':first['lon'].values.tolist()}
+    first.close()
+
+    os.makedirs(os.path.dirname(store_fp),exist_ok=True)
+    tmp_fp=store_fp+'.tmp.npy'
+    cum=np.lib.format.open_memmap(tmp_fp,mode='w+',dtype=np.float32,shape=(len(cuts),)+shape)
+    cum[0]=0
+    run=np.zeros(shape,dtype=np.float64)
+    for year in years:
+        print('Adding',in_dir,year)
+        with xr.open_dataset(os.path.join(in_dir,str(year)+suffix)) as ds:
+            run+=ds[var].values
+        if year+1 in cuts:
+            cum[cuts.index(year+1)]=run
+    cum.flush()
+    del cum
+    os.replace(tmp_fp,store_fp)
+    with open(os.path.splitext(store_fp)[0]+'.json','w') as f:
+        json.dump(meta,f)
+
+def open_store(store_fp):
+    """
+    Opens a store read-only.
+
+    Returns
+    -------
+    cum : numpy.memmap
+        Cumulative sums, shape (cuts, 365, lat, lon).
+    meta : dict
+        'years', 'cuts', 'var', 'lat' and 'lon'.
+    """
+    with open(os.path.splitext(store_fp)[0]+'.json') as f:
+        meta=json.load(f)
+    #Stores from before windows were added have a row for every year
+    meta.setdefault('cuts',_cuts(meta['years'],None))
+    return np.load(store_fp,mmap_mode='r'),meta
+
+def period_sum(store_fp,sy,ey):
+    """
+    Sum over years sy to ey (inclusive) for each day of the year. sy and
+    ey+1 must be edges of the windows the store was built with.
+
+    Returns
+    -------
+    tot : numpy array
+        Shape (365, lat, lon), float64.
+    meta : dict
+    """
+    cum,meta=open_store(store_fp)
+    if sy not in meta['cuts'] or ey+1 not in meta['cuts']:
+        raise ValueError(str(sy)+"-"+str(ey)+" isn't a window of "+store_fp+", rebuild it with this window")
+    k0=meta['cuts'].index(sy)
+    k1=meta['cuts'].index(ey+1)
+    return cum[k1].astype(np.float64)-cum[k0],meta
+
+def _to_da(arr,meta):
+    #Period mean with doy 1-365 as time, as CMIP_deltas expects
+    return xr.DataArray(arr.astype(np.float32),dims=('time','lat','lon'),name=meta['var'],
+                        coords={'time':np.arange(1,366),'lat':meta['lat'],'lon':meta['lon']})
+
+def period_mean(store_fp,sy,ey):
+    """
+    Day-of-year mean over years sy to ey (inclusive).
+
+    Returns
+    -------
+    avg : xarray.DataArray
+        Dims (time, lat, lon), time is doy 1 to 365.
+    """
+    tot,meta=period_sum(store_fp,sy,ey)
+    return _to_da(tot/(ey-sy+1),meta)
+
+def bline_mean(hist_store_fp,ssp_store_fps,hist_years=(2010,2014),ssp_years=(2015,2020)):
+    """
+    Baseline mean where the historical runs stop partway through. Years from
+    the historical store are used as is and the remaining years are the
+    average of the SSP scenarios (e.g. 2010-2014 historical plus 2015-2020
+    averaged over ssp126, ssp245 and ssp585, as in CMIP_deltas).
+
+    Parameters
+    ----------
+    hist_store_fp : string
+        Historical store.
+    ssp_store_fps : list of string
+        Store for each SSP.
+    hist_years : tuple, optional
+        First and last historical year. The default is (2010,2014).
+    ssp_years : tuple, optional
+        First and last SSP year. The default is (2015,2020).
+
+    Returns
+    -------
+    avg : xarray.DataArray
+    """
+    tot,meta=period_sum(hist_store_fp,*hist_years)
+    ssp_tot=sum(period_sum(fp,*ssp_years)[0] for fp in ssp_store_fps)
+    tot+=ssp_tot/len(ssp_store_fps)
+    n_years=(hist_years[1]-hist_years[0]+1)+(ssp_years[1]-ssp_years[0]+1)
+    return _to_da(tot/n_years,meta)
+
+def _build_job(args):
+    build_store(*args)
+    return args[2]
+
+def build_stores(job_ls,mem_budget_gb=16,cube_gb=1.6):
+    """
+    Builds several stores at the same time, with as many running at once as
+    fit in the memory budget. Each build holds one float64 running sum plus
+    one yearly cube.
+
+    Parameters
+    ----------
+    job_ls : list of tuple
+        build_store arguments (in_dir, years, store_fp, suffix, var,
+        windows).
+    mem_budget_gb : float, optional
+        Memory available for the builds. The default is 16.
+    cube_gb : float, optional
+        Size of one float64 365x510x1068 cube. The default is 1.6.
+
+    Returns
+    -------
+    store_fps : list of string
+    """
+    n_workers=int(max(1,min(len(job_ls),mem_budget_gb//(1.5*cube_gb))))
+    if n_workers==1:
+        return [_build_job(job) for job in job_ls]
+    with mp.Pool(n_workers) as pool:
+        return pool.map(_build_job,job_ls)
+
+def store_fp(ens_dir,ssp,clim_var):
+    #Where the store for an SSP/var lives
+    return os.path.join(ens_dir,'cumsum',ssp+'_'+clim_var+'.npy')
+
@@ -0,0 +1,133 @@
+#Streaming aggregation of the 11 model ensemble for one year. Models are read a
+#block of rows at a time and folded into running stats (wet-day counts as uint8,
+#Welford mean/M2 in float32), so peak RAM is a few blocks rather than several
+#full 365x510x1068 cubes. Wet days, mean and std are all written in one pass as
+#compressed, chunked NetCDF4, with the units, names and CRS of the source files.
+#Used by PCIC_Download.py.
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import os
+from PCIC_fetch import open_year
+
+
+#Attributes that describe how values are stored rather than what they are. These
+#are set by netCDF4 from the output dtype/fill, or don't apply to the outputs
+_SKIP_ATTRS=['_FillValue','missing_value','scale_factor','add_offset','coordinates',
+             'cell_methods','valid_min','valid_max','valid_range']
+
+def _attrs(attrs):
+    return {k:v for k,v in attrs.items() if k not in _SKIP_ATTRS}
+
+def _create_nc(fp,var,dtype,time_ls,src,chunks,fill=None,attrs=None):
+    #Empty compressed NetCDF4 file with the same layout as the yearly files. The
+    #lat/lon attributes and the grid mapping (CRS) variable are copied from src
+    tmp_fp=fp+'.tmp'
+    nc=netCDF4.Dataset(tmp_fp,'w',format='NETCDF4')
+    nc.createDimension('time',len(time_ls))
+    nc.createDimension('lat',len(src['lat']))
+    nc.createDimension('lon',len(src['lon']))
+    t=nc.createVariable('time','f8',('time',))
+    t.units='hours since 1950-01-01 00:00:00'
+    t.calendar='standard'
+    t[:]=(time_ls-np.datetime64('1950-01-01'))/np.timedelta64(1,'h')
+    for dim in ['lat','lon']:
+        v=nc.createVariable(dim,'f8',(dim,))
+        v.setncatts(_attrs(src[dim].attrs))
+        v[:]=src[dim].values
+    gm=src[var].attrs.get('grid_mapping')
+    if gm!=None and gm in src.variables:
+        nc.createVariable(gm,'i4').setncatts(_attrs(src[gm].attrs))
+    v=nc.createVariable(var,dtype,('time','lat','lon'),zlib=True,complevel=4,
+                        shuffle=True,chunksizes=chunks,fill_value=fill)
+    v.setncatts(_attrs(src[var].attrs) if attrs==None else attrs)
+    if gm!=None and gm in src.variables:
+        v.grid_mapping=gm
+    return nc,tmp_fp
+
+def aggregate_year(fp_ls,year,var,out_fps,block_rows=64,wet_thresh=1):
+    """
+    Aggregates one year of the model ensemble. Each model is read one block of
+    rows at a time, so only a block from one model plus the running stats
+    for that block are in memory. Mean and std keep the attributes (units,
+    long_name, grid_mapping) of the first model's variable, and its grid
+    mapping variable is copied over.
+
+    Parameters
+    ----------
+    fp_ls : list of tuple
+        (file path, model name, first year in file) for each model, as
+        downloaded by PCIC_fetch.download_all.
+    year : integer
+        Year to aggregate.
+    var : string
+        'pr' or 'tasmax'. Also used as the variable name in the outputs.
+    out_fps : dict
+        Output file paths for any of 'tot' (number of models with a wet day,
+        i.e. pr above wet_thresh), 'mean' and 'std'. Only the stats given here
+        are written.
+    block_rows : integer, optional
+        Rows (lat) per block. The default is 64.
+    wet_thresh : float, optional
+        Precip (mm) above which a day is wet. The default is 1.
+
+    Returns
+    -------
+    num_mod : integer
+        Number of models aggregated.
+    """
+    ds_ls=[open_year(fp,mod,year,y0) for fp,mod,y0 in fp_ls]
+    src=ds_ls[0]
+    ds_ls=[ds[var] for ds in ds_ls]
+    num_mod=len(ds_ls)
+    time_ls=ds_ls[0]['time'].values
+    nt,ny,nx=len(time_ls),len(src['lat']),len(src['lon'])
+    chunks=(nt,min(block_rows,ny),min(128,nx))
+
+    nc_dict={}
+    try:
+        for stat in out_fps:
+            os.makedirs(os.path.dirname(out_fps[stat]),exist_ok=True)
+            if stat=='tot':
+                attrs={'units':'1','long_name':'Number of models with '+var+' above '+str(wet_thresh)+' mm'}
+                nc_dict[stat]=_create_nc(out_fps[stat],var,'u1',time_ls,src,chunks,attrs=attrs)
+            else:
+                nc_dict[stat]=_create_nc(out_fps[stat],var,'f4',time_ls,src,chunks,fill=np.float32(np.nan))
+
+        for r0 in range(0,ny,block_rows):
+            r1=min(r0+block_rows,ny)
+            wet=np.zeros((nt,r1-r0,nx),dtype=np.uint8)
+            mean=np.zeros((nt,r1-r0,nx),dtype=np.float32)
+            M2=np.zeros((nt,r1-r0,nx),dtype=np.float32)
+            for k,da in enumerate(ds_ls):
+                x=da.isel(lat=slice(r0,r1)).values.astype(np.float32)
+                #NaN (ocean) compares False so is never a wet day. Note this
+                #fixes the old where(...<1,1).where(...>1,0) conversion, which
+                #left every wet-day count at 0
+                wet+=x>wet_thresh
+                #Welford update
+                delta=x-mean
+                mean+=delta/(k+1)
+                M2+=delta*(x-mean)
+            if 'tot' in nc_dict:
+                nc_dict['tot'][0][var][:,r0:r1,:]=wet
+            if 'mean' in nc_dict:
+                nc_dict['mean'][0][var][:,r0:r1,:]=mean
+            if 'std' in nc_dict:
+                #Population std over the models, as before
+                nc_dict['std'][0][var][:,r0:r1,:]=np.sqrt(M2/num_mod)
+    except:
+        for nc,tmp_fp in nc_dict.values():
+            nc.close()
+            os.remove(tmp_fp)
+        raise
+    finally:
+        for da in ds_ls:
+            da.close()
+
+    #Only put outputs in place once everything is written
+    for stat,(nc,tmp_fp) in nc_dict.items():
+        nc.close()
+        os.replace(tmp_fp,out_fps[stat])
+    return num_mod
@@ -0,0 +1,279 @@
+#Downloader for the CanDCS-M6 (downscaled CMIP6) data served by PCIC. Fetches
+#one OPeNDAP subset per model covering several years, with a bounded number of
+#downloads running at the same time, retries with exponential backoff and a
+#manifest so an interrupted run picks up where it left off. Files are written
+#under a temp name and renamed once complete, so a partial download is never
+#mistaken for a good one. Used by PCIC_Download.py. tests/mock_pcic.py is a
+#local stand-in for the PCIC server.
+
+import urllib.request
+import urllib.error
+import http.client
+import socket
+import xarray as xr
+import numpy as np
+import pandas as pd
+import calendar
+import json
+import os
+import ssl
+import threading
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BASE_URL="https://services.pacificclimate.org/data/downscaled_cmip6_multi/"
+
+#PCIC 12 models and versions. Note that we drop UKESM1-0-LL as it uses a 360 day year.
+mod_ls=["BCC-CSM2-MR","NorESM2-LM","MIROC-ES2L","MPI-ESM1-2-HR","MRI-ESM2-0","EC-Earth3-Veg","CMCC-ESM2","INM-CM5-0","FGOALS-g3","TaiESM1","IPSL-CM6A-LR"]
+vers_ls=["r1i1p1f1_gn","r1i1p1f1_gn","r1i1p1f2_gn","r1i1p1f1_gn","r1i1p1f1_gn","r1i1p1f1_gr","r1i1p1f1_gn","r1i1p1f1_gr1","r1i1p1f1_gn","r1i1p1f1_gn","r1i1p1f1_gr"]
+#Models on a gregorian calendar (i.e. leap days). The rest use a 365 day calendar
+greg_mod_ls=["MIROC-ES2L","MPI-ESM1-2-HR","MRI-ESM2-0","EC-Earth3-Veg","IPSL-CM6A-LR"]
+
+
+def time_index(mod,year,end=False):
+    """
+    Index along the time dimension of the PCIC files for the first (or last)
+    day of a year. The files start on 1950-01-01.
+
+    Parameters
+    ----------
+    mod : string
+        Model name.
+    year : integer
+    end : bool, optional
+        Return the index of Dec 31 instead of Jan 1. The default is False.
+
+    Returns
+    -------
+    idx : integer
+    """
+    if mod in greg_mod_ls:
+        date=str(year)+("-12-31" if end else "-01-01")
+        delta=int((np.datetime64(date)-np.datetime64('2000-01-01'))/np.timedelta64(1,'D'))
+        return 18262+delta
+    idx=365*(year-2000)+18250
+    return idx+364 if end else idx
+
+def build_url(var,mod,vers,ssp_url,t0,t1,base_url=BASE_URL):
+    #OPeNDAP subset of the full domain for time indices t0 to t1 (inclusive)
+    return (base_url+var+"_day_MBCn+PCIC-Blend_"+mod+"_historical+"+ssp_url+"_"+vers
+            +"_19500101-21001231.nc.nc?"+var+"["+str(t0)+":"+str(t1)+"][0:510][0:1068]&")
+
+def plan_requests(var,ssp,years,chunk_years=5,models=None,base_url=BASE_URL):
+    """
+    Splits the download for a variable/SSP into one request per model per
+    block of chunk_years consecutive years.
+
+    Parameters
+    ----------
+    var : string
+        'pr' or 'tasmax'.
+    ssp : string
+        'historical', 'ssp126', 'ssp245' or 'ssp585'. The historical period
+        is served from the ssp126 files.
+    years : list of integer
+        Years needed.
+    chunk_years : integer, optional
+        Years per request. The default is 5.
+    models : list of string, optional
+        Subset of mod_ls. The default is None (all models).
+    base_url : string, optional
+        Folder url of the PCIC files. The default is BASE_URL.
+
+    Returns
+    -------
+    req_ls : list of dict
+        'key', 'var', 'ssp', 'mod', 'url', 'y0', 'y1' for each request.
+    """
+    ssp_url="ssp126" if ssp=="historical" else ssp
+    years=sorted(years)
+    blocks=[years[i:i+chunk_years] for i in range(0,len(years),chunk_years)]
+    req_ls=[]
+    for mod,vers in zip(mod_ls,vers_ls):
+        if models!=None and mod not in models:
+            continue
+        for block in blocks:
+            y0,y1=block[0],block[-1]
+            url=build_url(var,mod,vers,ssp_url,time_index(mod,y0),time_index(mod,y1,end=True),base_url)
+            req_ls.append({'key':ssp+"/"+var+"/"+mod+"_"+str(y0)+"_"+str(y1),'var':var,'ssp':ssp,
+                           'mod':mod,'url':url,'y0':y0,'y1':y1})
+    return req_ls
+
+def _retryable(e):
+    #Server errors, timeouts and dropped connections are worth another try.
+    #Client errors (4xx, e.g. a bad url) will fail the same way again
+    if isinstance(e,urllib.error.HTTPError):
+        return e.code>=500
+    return isinstance(e,(urllib.error.URLError,socket.timeout,ConnectionError,http.client.HTTPException))
+
+def fetch(url,dst_fp,retries=5,backoff=30,max_backoff=600,timeout=600):
+    """
+    Downloads a url to dst_fp. The data is streamed to dst_fp+'.part' and
+    only renamed to dst_fp once complete. Attempts that fail with a 5xx
+    status, a timeout or a connection error are retried with exponentially
+    increasing waits. Other errors (e.g. 404) are raised straight away.
+
+    Parameters
+    ----------
+    url : string
+    dst_fp : string
+    retries : integer, optional
+        Number of retries after the first attempt. The default is 5.
+    backoff : float, optional
+        Wait in seconds before the first retry, doubled after each failure.
+        The default is 30.
+    max_backoff : float, optional
+        Longest wait between attempts. The default is 600.
+    timeout : float, optional
+        Socket timeout in seconds. The default is 600.
+
+    Returns
+    -------
+    n_bytes : integer
+        Size of the downloaded file.
+    """
+    os.makedirs(os.path.dirname(dst_fp),exist_ok=True)
+    part_fp=dst_fp+'.part'
+    #PCIC's certificate doesn't verify on the office machines
+    ctx=ssl._create_unverified_context()
+    attempt=0
+    while True:
+        try:
+            n_bytes=0
+            with urllib.request.urlopen(url,timeout=timeout,context=ctx) as resp, open(part_fp,'wb') as f:
+                size=resp.headers.get('Content-Length')
+                while True:
+                    buf=resp.read(1<<22)
+                    if not buf:
+                        break
+                    f.write(buf)
+                    n_bytes+=len(buf)
+            #read() just stops early if the connection drops mid-file
+            if size!=None and n_bytes!=int(size):
+                raise http.client.IncompleteRead(b'',int(size)-n_bytes)
+            os.replace(part_fp,dst_fp)
+            return os.path.getsize(dst_fp)
+        except Exception as e:
+            attempt+=1
+            if attempt>retries or not _retryable(e):
+                if os.path.isfile(part_fp):
+                    os.remove(part_fp)
+                raise
+            wait=min(backoff*2**(attempt-1),max_backoff)
+            print(e)
+            print("Download failed. Trying again in "+str(wait)+" s. Attempt "+str(attempt)+" of "+str(retries))
+            sleep(wait)
+
+def _load_manifest(fp):
+    if os.path.isfile(fp):
+        with open(fp) as f:
+            return json.load(f)
+    return {}
+
+def _save_manifest(manifest,fp):
+    tmp_fp=fp+'.tmp'
+    with open(tmp_fp,'w') as f:
+        json.dump(manifest,f,indent=1)
+    os.replace(tmp_fp,fp)
+
+def download_all(req_ls,cache_dir,n_threads=4,retries=5,backoff=30):
+    """
+    Downloads a list of requests from plan_requests into cache_dir, a few at
+    a time. Progress is kept in cache_dir/manifest.json so requests that
+    already finished (and whose file is still there with the same size) are
+    skipped on a rerun.
+
+    Parameters
+    ----------
+    req_ls : list of dict
+        Requests from plan_requests.
+    cache_dir : string
+        Folder for the downloaded files and the manifest.
+    n_threads : integer, optional
+        Number of downloads running at the same time. Keep this small to be
+        polite to the PCIC servers. The default is 4.
+    retries : integer, optional
+        See fetch.
+    backoff : float, optional
+        See fetch.
+
+    Returns
+    -------
+    fp_dict : dict
+        Request key -> local file path for every request that is available.
+    failed : list of string
+        Keys of requests that still failed after all retries.
+    """
+    os.makedirs(cache_dir,exist_ok=True)
+    man_fp=os.path.join(cache_dir,'manifest.json')
+    manifest=_load_manifest(man_fp)
+    lock=threading.Lock()
+
+    fp_dict={}
+    todo=[]
+    for req in req_ls:
+        fp=os.path.join(cache_dir,*req['key'].split('/'))+'.nc'
+        entry=manifest.get(req['key'])
+        if (entry!=None and entry['url']==req['url'] and os.path.isfile(fp)
+                and os.path.getsize(fp)==entry['bytes']):
+            fp_dict[req['key']]=fp
+        else:
+            todo.append((req,fp))
+    print(str(len(fp_dict))+" of "+str(len(req_ls))+" requests already downloaded")
+
+    def _job(req,fp):
+        n_bytes=fetch(req['url'],fp,retries=retries,backoff=backoff)
+        with lock:
+            manifest[req['key']]={'url':req['url'],'bytes':n_bytes}
+            _save_manifest(manifest,man_fp)
+        return fp
+
+    failed=[]
+    with ThreadPoolExecutor(max_workers=n_threads) as ex:
+        futs={ex.submit(_job,req,fp):req['key'] for req,fp in todo}
+        for fut in as_completed(futs):
+            key=futs[fut]
+            try:
+                fp_dict[key]=fut.result()
+                print("Downloaded "+key)
+            except Exception as e:
+                print("Giving up on "+key+": "+str(e))
+                failed.append(key)
+    return fp_dict,failed
+
+def open_year(fp,mod,year,y0):
+    """
+    Opens one year of a multi-year download on a 365 day calendar. Leap days
+    are dropped from the gregorian models and times are set to noon of each
+    day, same as the yearly downloads used to be.
+
+    Parameters
+    ----------
+    fp : string
+        Downloaded file covering years y0 onwards.
+    mod : string
+        Model name.
+    year : integer
+        Year to open.
+    y0 : integer
+        First year in the file.
+
+    Returns
+    -------
+    nc_data : xarray.Dataset
+    """
+    time_ls=pd.date_range(str(year)+'-01-01',str(year)+'-12-31',freq='d')
+    if calendar.isleap(year):
+        time_ls=time_ls[time_ls!=np.datetime64(str(year)+'-02-29')]
+
+    if mod in greg_mod_ls:
+        nc_data=xr.open_dataset(fp)
+        nc_data=nc_data.sel(time=str(year))
+        if calendar.isleap(year):
+            nc_data=nc_data.drop_sel(time=[np.datetime64(str(year)+'-02-29T12:00:00.000000000')])
+    else:
+        nc_data=xr.open_dataset(fp,decode_times=False)
+        i0=365*(year-y0)
+        nc_data=nc_data.isel(time=slice(i0,i0+365))
+    nc_data["time"]=time_ls+np.timedelta64(12, 'h')
+    return nc_data
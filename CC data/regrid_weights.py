@@ -0,0 +1,143 @@
+#Area-average regridding from the CanDCS grid onto the ERA5 grid as a sparse
+#matrix. Both grids are regular lat/lon, so the weight of a source cell in a
+#target cell is the product of their overlaps in lat and in lon (same as
+#Resampling.average in rio.reproject_match, which also works in degrees). The
+#weights are built once, cached on disk and applied to all days at once as a
+#sparse matrix product. Used by CMIP_deltas.ipynb.
+
+import xarray as xr
+import numpy as np
+import scipy.sparse as sp
+import hashlib
+import os
+
+
+def cell_edges(c):
+    #Cell edges from (regularly spaced) cell centres, same order as c
+    c=np.asarray(c,dtype=np.float64)
+    mid=(c[1:]+c[:-1])/2
+    return np.concatenate([[c[0]-(mid[0]-c[0])],mid,[c[-1]+(c[-1]-mid[-1])]])
+
+def overlap_matrix(src_c,dst_c):
+    """
+    1D overlap lengths between target and source cells.
+
+    Parameters
+    ----------
+    src_c : array
+        Source cell centres (increasing or decreasing).
+    dst_c : array
+        Target cell centres (increasing or decreasing).
+
+    Returns
+    -------
+    W : scipy.sparse.csr_matrix
+        Shape (len(dst_c), len(src_c)).
+    """
+    se=cell_edges(src_c)
+    de=cell_edges(dst_c)
+    s_lo,s_hi=np.minimum(se[:-1],se[1:]),np.maximum(se[:-1],se[1:])
+    d_lo,d_hi=np.minimum(de[:-1],de[1:]),np.maximum(de[:-1],de[1:])
+    #Source cells sorted by lower edge so each target only checks the cells
+    #that can overlap it
+    order=np.argsort(s_lo)
+    s_lo_sort=s_lo[order]
+    rows,cols,vals=[],[],[]
+    for i in range(len(d_lo)):
+        j0=max(np.searchsorted(s_lo_sort,d_lo[i],side='right')-1,0)
+        j1=np.searchsorted(s_lo_sort,d_hi[i],side='left')
+        j=order[j0:j1]
+        ov=np.minimum(s_hi[j],d_hi[i])-np.maximum(s_lo[j],d_lo[i])
+        keep=ov>0
+        rows.extend([i]*int(keep.sum()))
+        cols.extend(j[keep])
+        vals.extend(ov[keep])
+    return sp.csr_matrix((vals,(rows,cols)),shape=(len(dst_c),len(src_c)))
+
+def build_weights(src_y,src_x,dst_y,dst_x):
+    """
+    2D area weights, rows are target cells and columns source cells, both
+    flattened in (y, x) order.
+
+    Returns
+    -------
+    W : scipy.sparse.csr_matrix
+        Shape (len(dst_y)*len(dst_x), len(src_y)*len(src_x)). Rows are not
+        normalised, that is done when applying so missing data can be left
+        out.
+    """
+    return sp.kron(overlap_matrix(src_y,dst_y),overlap_matrix(src_x,dst_x),format='csr')
+
+def load_weights(src_y,src_x,dst_y,dst_x,cache_dir):
+    """
+    Returns the weights for a pair of grids, building and caching them in
+    cache_dir the first time. The file name is a hash of the coordinates.
+    """
+    h=hashlib.sha256()
+    for c in [src_y,src_x,dst_y,dst_x]:
+        h.update(np.asarray(c,dtype=np.float64).tobytes())
+        h.update(b'|')
+    fp=os.path.join(cache_dir,'avg_weights_'+h.hexdigest()[:16]+'.npz')
+    if os.path.isfile(fp):
+        return sp.load_npz(fp)
+    W=build_weights(src_y,src_x,dst_y,dst_x)
+    os.makedirs(cache_dir,exist_ok=True)
+    tmp_fp=fp[:-4]+'.tmp.npz'
+    sp.save_npz(tmp_fp,W)
+    os.replace(tmp_fp,fp)
+    return W
+
+def apply_weights(W,data,dst_shape):
+    """
+    Regrids a stack of 2D fields. NaNs are left out of the average, and
+    target cells with no valid source data are NaN.
+
+    Parameters
+    ----------
+    W : scipy.sparse.csr_matrix
+        Weights from build_weights/load_weights.
+    data : array
+        Shape (n, src_y, src_x).
+    dst_shape : tuple
+        (dst_y, dst_x).
+
+    Returns
+    -------
+    out : array
+        Shape (n, dst_y, dst_x), float32.
+    """
+    X=np.asarray(data,dtype=np.float64).reshape(data.shape[0],-1)
+    valid=~np.isnan(X)
+    num=(W@np.where(valid,X,0).T).T
+    den=(W@valid.T.astype(np.float64)).T
+    with np.errstate(invalid='ignore',divide='ignore'):
+        out=np.where(den>0,num/den,np.nan)
+    return out.reshape((data.shape[0],)+tuple(dst_shape)).astype(np.float32)
+
+def regrid(da,dst_y,dst_x,cache_dir,y_dim='lat',x_dim='lon'):
+    """
+    Area-average regrid of a (time, lat, lon) DataArray onto a target grid.
+    Subset the days that are needed before calling this, only the given
+    days are regridded.
+
+    Parameters
+    ----------
+    da : xarray.DataArray
+        Dims (time, y_dim, x_dim).
+    dst_y, dst_x : array
+        Target cell centres, e.g. the ERA5 latitude/longitude.
+    cache_dir : string
+        Folder for the cached weights.
+    y_dim, x_dim : string, optional
+        Names of the source dims. The defaults are 'lat' and 'lon'.
+
+    Returns
+    -------
+    out : xarray.DataArray
+        Dims (time, y, x), named as rio.reproject_match names them.
+    """
+    da=da.transpose('time',y_dim,x_dim)
+    W=load_weights(da[y_dim].values,da[x_dim].values,dst_y,dst_x,cache_dir)
+    out=apply_weights(W,da.values,(len(dst_y),len(dst_x)))
+    return xr.DataArray(out,dims=('time','y','x'),name=da.name,
+                        coords={'time':da['time'].values,'y':np.asarray(dst_y),'x':np.asarray(dst_x)})
@@ -6,14 +6,38 @@ import pysyncrosim as ps
 import pandas as pd
 import os
 import rasterio as rio
-import time
 import rioxarray as rxr
 import numpy as np
 import subprocess
 import multiprocessing as mp
-from scipy.optimize import fsolve
-import math
 import geopandas as gpd
+import shutil
+import tempfile
+import calval_cache
+from ztp_funcs import ztp_dist
+from bp_rescale import rescale_raster
+import stage_timer
+
+#Sheet inputs (weather, rasters, ign/SED dists) on the Y: drive
+DATA_DIR="Y:/client-data/demo_projects/climate85/Working_data"
+#Template library and output folders used by the tuning runs
+SSIM_FP="C:\\Users\\GiovanniCorti\\Documents\\NTS_template.ssim"
+STATS_DIR="C:\\Users\\GiovanniCorti\\Documents\\Stats"
+BP_DIR="C:\\Users\\GiovanniCorti\\Documents\\BP_maps"
+#Summarised fire stats of earlier runs, see calval_cache.py
+CACHE_DIR="C:\\Users\\GiovanniCorti\\Documents\\calval_cache"
+#Stage timing logs (JSONL), see stage_timer.py. None turns timing off
+TIMING_DIR="C:\\Users\\GiovanniCorti\\Documents\\calval_timing"
+
+#Path of the library copy owned by a pool worker (set by _init_worker)
+_worker_ssim_fp=None
+
+#Open SyncroSim scenarios keyed on (ssim_fp, sess_fp), plus the datasheets 
+#read from and saved to each of them. These live for the life of the 
+#process so each worker only starts a session and opens its library once.
+_scen_pool={}
+#Input csvs read from the network drive, keyed on file path
+_csv_cache={}
 
 
 def run_BP3(NTS_code, it_list):
@@ -32,32 +56,30 @@ def run_BP3(NTS_code, it_list):
     -------
     """
     
-    #Setup scenario
-    ign_rescaling=_setup_scen(NTS_code,"C:\\Users\\GiovanniCorti\\Documents\\NTS_template.ssim")
-    
-    #Check if zero igns
-    if ign_rescaling==None:
-        return
-    
-    for it_num in it_list:
-        #Run BP3 for all iteration values
-        bp_dst_fp, it_num=_init_run(NTS_code,it_num,"C:\\Users\\GiovanniCorti\\Documents\\NTS_template.ssim")
-        if ign_rescaling<1: #Rescale igns if needed. 
-            raster=rio.open(bp_dst_fp)
-            rd=raster.read(1)*ign_rescaling
-            raster.close()
-            with rio.open(bp_dst_fp, "w", **raster.meta) as dst:
-                dst.write(rd,1)
+    with stage_timer.context(NTS_code=NTS_code):
+        #Setup scenario
+        setup=_setup_scen(NTS_code,SSIM_FP)
+        
+        #Check if zero igns
+        if setup==None:
+            return
+        ign_rescaling,scen=setup
+        
+        for it_num in it_list:
+            #Run BP3 for all iteration values
+            bp_dst_fp, it_num=_init_run(NTS_code,it_num,SSIM_FP)
+            if ign_rescaling<1: #Rescale igns if needed. Done block by block into a 
+                #tiled, compressed copy that replaces the original (see bp_rescale.py)
+                with stage_timer.span('rescale_bp'):
+                    rescale_raster(bp_dst_fp,ign_rescaling)
                 
-def _setup_scen(NTS_code,ssim_fp,sess_fp='C:/Program Files/SyncroSim'):
+def _get_scen(ssim_fp,sess_fp='C:/Program Files/SyncroSim'):
     """
-    Pulls in the NTS sheet specific parameters for a base Syncrosim scenario 
-    (.ssim file) from the the the network drive (\\athena02) and saves the .ssim file. 
+    Returns the base scenario of a library, opening the session and library
+    only the first time it is asked for in this process.
 
     Parameters
     ----------
-    NTS_code : string
-        Code/name for the NTS sheet that is being modified.
     ssim_fp : string
         File path for the .ssim file.
     sess_fp : string, optional
@@ -66,31 +88,124 @@ def _setup_scen(NTS_code,ssim_fp,sess_fp='C:/Program Files/SyncroSim'):
 
     Returns
     -------
-    ign_rescaling : float or None  
-        rescaling factor needed for average ign numbers 
-        less than 1. Returns none if the sheet has 0 igns. 
+    scen : pysyncrosim.Scenario
+    """
+    key=(ssim_fp,sess_fp)
+    if key not in _scen_pool:
+        with stage_timer.span('open_library'):
+            sess=ps.Session(sess_fp, silent=False)
+            #Read in a library, project and Scenario that has already been created.
+            #This scenario will then be modified for each sheet/run.
+            lib=ps.library(name = ssim_fp, session=sess, package='burnP3Plus', addons='burnP3PlusCell2Fire', use_conda=True)
+            proj=lib.projects(pid=1)
+            scen=proj.scenarios(sid=1)
+        _scen_pool[key]={'scen':scen,'loaded':{},'saved':{},'temp_dir':_lib_temp_dir(lib,ssim_fp)}
+    return _scen_pool[key]['scen']
+
+def _lib_temp_dir(lib,ssim_fp):
+    #Temp folder of a library (where BP3+ writes the summary outputs) as set in
+    #the library's properties. SyncroSim's default is <library>.temp
+    try:
+        info=lib.info
+        row=info[info.iloc[:,0].astype(str).str.contains('Temporary',case=False)]
+        if len(row)>0:
+            return str(row.iloc[0,1])
+    except (AttributeError,KeyError,IndexError):
+        pass
+    return ssim_fp+'.temp'
 
+def get_temp_dir(ssim_fp,sess_fp='C:/Program Files/SyncroSim'):
     """
+    Temp folder of a library, read from the library the first time it is
+    opened. All outputs of runs on that library are read from here.
+
+    Parameters
+    ----------
+    ssim_fp : string
+        File path for the .ssim file.
+    sess_fp : string, optional
+        Filepath for the Syncrosim install. The default is 
+        'C:/Program Files/SyncroSim'.
+
+    Returns
+    -------
+    temp_dir : string
+    """
+    _get_scen(ssim_fp,sess_fp)
+    return _scen_pool[(ssim_fp,sess_fp)]['temp_dir']
+
+def _load_datasheet(scen,name):
+    #Copy of a datasheet as first read from the scenario
+    entry=next(e for e in _scen_pool.values() if e['scen'] is scen)
+    if name not in entry['loaded']:
+        entry['loaded'][name]=scen.datasheets(name=name)
+    return entry['loaded'][name].copy()
+
+def _save_datasheet(scen,name,data):
+    """
+    Saves a datasheet to the scenario unless it is identical to the last one
+    saved under that name, e.g., the landscape rasters, ign grids and weather 
+    stream when only the SED distribution changes between tuning rounds.
+
+    Parameters
+    ----------
+    scen : pysyncrosim.Scenario
+        Scenario from _get_scen.
+    name : string
+        Datasheet name.
+    data : pandas.DataFrame
+        Datasheet values.
+
+    Returns
+    -------
+    saved : bool
+        True if the datasheet was written.
+    """
+    entry=next(e for e in _scen_pool.values() if e['scen'] is scen)
+    prev=entry['saved'].get(name)
+    if prev is not None and prev.equals(data):
+        return False
+    #Drop the entry first so a failed save is retried next time
+    entry['saved'].pop(name,None)
+    with stage_timer.span('save_datasheet',datasheet=name):
+        scen.save_datasheet(name=name,data=data)
+    entry['saved'][name]=data.copy()
+    return True
+
+def _read_csv(fp):
+    #pd.read_csv that only reads each file once per process
+    if fp not in _csv_cache:
+        _csv_cache[fp]=pd.read_csv(fp)
+    return _csv_cache[fp].copy()
+
+def _sheet_inputs(NTS_code,SED=None):
+    """
+    Reads the NTS sheet specific BP3+ inputs from the network drive (\\athena02)
+    without touching SyncroSim, so they can also be used to look up earlier 
+    runs in the results cache.
+
+    Parameters
+    ----------
+    NTS_code : string
+        Code/name for the NTS sheet.
+    SED : pandas.DataFrame, optional
+        SED distribution (Value, RelativeFrequency, Name) to use instead of
+        the sheet's sed_dist csv. The default is None.
+
+    Returns
+    -------
+    inputs : dict or None
+        'ls_fps' ([DEM, Fuel] file paths), 'ign_grid_fps' (list of ign grid
+        file paths, empty if the sheet has none), 'FWI' (weather stream), 
+        'dist' (SED and ign distribution values) and 'ign_rescaling'. 
+        Returns None if the sheet has 0 igns.
+    """
+    sheet_dir=DATA_DIR+'/NARR_weather_csvs/NTS_SNRC_'+NTS_code
+    Fuel_fp=sheet_dir+'/Fuel_NTS_SNRC_'+NTS_code+'.tif'
+    DEM_fp=sheet_dir+'/DEM_NTS_SNRC_'+NTS_code+'.tif'
     
-    sess=ps.Session(sess_fp, silent=False)
-    #Read in a library, project and Scenario that has already been created.
-    #This scenario will then be modified in the loop to change the number of iterations.
-    lib=ps.library(name = ssim_fp, session=sess, package='burnP3Plus', addons='burnP3PlusCell2Fire', use_conda=True)
-    proj=lib.projects(pid=1)
-    scen=proj.scenarios(sid=1)
-    
-    #Set landscape rasters
-    ls_ds=scen.datasheets(name='burnP3Plus_LandscapeRasters')
-    Fuel_fp='Y:/client-data/demo_projects/climate85/Working_data/NARR_weather_csvs/NTS_SNRC_'+NTS_code+'/Fuel_NTS_SNRC_'+NTS_code+'.tif'
-    DEM_fp='Y:/client-data/demo_projects/climate85/Working_data/NARR_weather_csvs/NTS_SNRC_'+NTS_code+'/DEM_NTS_SNRC_'+NTS_code+'.tif'
-    ls_ds.loc[0,['ElevationGridFileName','FuelGridFileName']]=[DEM_fp,Fuel_fp]
-    try: #May fail if no fuel map exists (i.e., sheet is all water/Arctic)
-        scen.save_datasheet(name='burnP3Plus_LandscapeRasters',data=ls_ds)
-    except:
-        print("No fuel map found. Moving to next NTS sheet") 
-        return None
     #Set ignition number/distribution
-    ign_dist=pd.read_csv("Y:/client-data/demo_projects/climate85/Working_data/ign_dist/ign_dist_"+NTS_code+".csv")
+    ign_dist=_read_csv(DATA_DIR+"/ign_dist/ign_dist_"+NTS_code+".csv")
     
     #Needed to check if average ign number is less than 1 as BP3+ will not accept zero as an ign value. 
     ign_num=(ign_dist['ign_per_it']*(ign_dist['pct']/100)).sum()
@@ -117,42 +232,90 @@ def _setup_scen(NTS_code,ssim_fp,sess_fp='C:/Program Files/SyncroSim'):
     file_pre = ["H_Spring_", "H_Summer_", "L_Spring_","L_Summer_"]
     ign_grid_fps=[]
     for f in file_pre:
-        ign_grid_fps.append('Y:/client-data/demo_projects/climate85/Working_data/NARR_weather_csvs/NTS_SNRC_'
-        +NTS_code+'/'+f+'NTS_SNRC_'+NTS_code+'.tif')
+        ign_grid_fps.append(sheet_dir+'/'+f+'NTS_SNRC_'+NTS_code+'.tif')
+    if not all(list(map(os.path.isfile,ign_grid_fps))):
+        ign_grid_fps=[]
+    
+    #Weather stream
+    FWI=_read_csv(sheet_dir+'/FWI_NTS_SNRC_'+NTS_code+'.csv')
+    cnames=['Season', 'Temperature', 'RelativeHumidity', 'WindSpeed', 'WindDirection', 
+            'Precipitation', 'FineFuelMoistureCode', 'DuffMoistureCode', 'DroughtCode', 
+            'InitialSpreadIndex', 'BuildupIndex', 'FireWeatherIndex']
+    FWI.columns=cnames
+    
+    #Get SED from csv set in SyncroSim
+    if SED is None:
+        SED=_read_csv(DATA_DIR+"/sed_dist/sed_dist_"+NTS_code+".csv")
+        SED['Name']='SED'
+        SED=SED.rename(columns={'sp_ev_days': 'Value', 'pct': 'RelativeFrequency'})
+    dist=pd.concat([SED, ign_dist], ignore_index=True)
+    
+    return {'ls_fps':[DEM_fp,Fuel_fp],'ign_grid_fps':ign_grid_fps,'FWI':FWI,
+            'dist':dist,'ign_rescaling':ign_rescaling}
+
+@stage_timer.span('setup_scen')
+def _setup_scen(NTS_code,ssim_fp,sess_fp='C:/Program Files/SyncroSim',SED=None):
+    """
+    Pulls in the NTS sheet specific parameters for a base Syncrosim scenario 
+    (.ssim file) from the the the network drive (\\athena02) and saves the .ssim file. 
+
+    Parameters
+    ----------
+    NTS_code : string
+        Code/name for the NTS sheet that is being modified.
+    ssim_fp : string
+        File path for the .ssim file.
+    sess_fp : string, optional
+        Filepath for the Syncrosim install. The default is 
+        'C:/Program Files/SyncroSim'.
+    SED : pandas.DataFrame, optional
+        SED distribution (Value, RelativeFrequency, Name) to use instead of
+        the sheet's sed_dist csv. The default is None.
+
+    Returns
+    -------
+    ign_rescaling : float or None  
+        rescaling factor needed for average ign numbers 
+        less than 1. Returns none if the sheet has 0 igns. 
+
+    """
+    inputs=_sheet_inputs(NTS_code,SED)
+    if inputs==None:
+        return None
+    
+    scen=_get_scen(ssim_fp,sess_fp)
+    
+    #Set landscape rasters
+    ls_ds=_load_datasheet(scen,'burnP3Plus_LandscapeRasters')
+    ls_ds.loc[0,['ElevationGridFileName','FuelGridFileName']]=inputs['ls_fps']
+    try: #May fail if no fuel map exists (i.e., sheet is all water/Arctic)
+        _save_datasheet(scen,'burnP3Plus_LandscapeRasters',ls_ds)
+    except:
+        print("No fuel map found. Moving to next NTS sheet") 
+        return None
         
-    ign_grid_ds=scen.datasheets(name="burnP3Plus_ProbabilisticIgnitionLocation")
-    if all(list(map(os.path.isfile,ign_grid_fps))):
+    ign_grid_fps=inputs['ign_grid_fps']
+    ign_grid_ds=_load_datasheet(scen,"burnP3Plus_ProbabilisticIgnitionLocation")
+    if len(ign_grid_fps)>0:
         #Set ign grids
         ign_grid_ds.loc[0,['Season','Cause','IgnitionGridFileName']]=[1,'Human',ign_grid_fps[0]]
         ign_grid_ds.loc[1,['Season','Cause','IgnitionGridFileName']]=[2,'Human',ign_grid_fps[1]]
         ign_grid_ds.loc[2,['Season','Cause','IgnitionGridFileName']]=[1,'Lightning',ign_grid_fps[2]]
         ign_grid_ds.loc[3,['Season','Cause','IgnitionGridFileName']]=[2,'Lightning',ign_grid_fps[3]]
-        scen.save_datasheet(name="burnP3Plus_ProbabilisticIgnitionLocation",data=ign_grid_ds)
+        _save_datasheet(scen,"burnP3Plus_ProbabilisticIgnitionLocation",ign_grid_ds)
     else:
         #If no ign grids, ensure that the ign grid values are empty
-        scen.save_datasheet(name="burnP3Plus_ProbabilisticIgnitionLocation",data=ign_grid_ds[0:0])
-    
-    #Set weather stream
-    FWI_ds=scen.datasheets(name="burnP3Plus_WeatherStream")
-    FWI=pd.read_csv('Y:/client-data/demo_projects/climate85/Working_data/NARR_weather_csvs/NTS_SNRC_'+NTS_code+'/FWI_NTS_SNRC_'+NTS_code+'.csv')
-    cnames=['Season', 'Temperature', 'RelativeHumidity', 'WindSpeed', 'WindDirection', 
-            'Precipitation', 'FineFuelMoistureCode', 'DuffMoistureCode', 'DroughtCode', 
-            'InitialSpreadIndex', 'BuildupIndex', 'FireWeatherIndex']
-    FWI.columns=cnames
-    scen.save_datasheet(name='burnP3Plus_WeatherStream',data=FWI)
-
+        _save_datasheet(scen,"burnP3Plus_ProbabilisticIgnitionLocation",ign_grid_ds[0:0])
     
-    #Get SED from csv set in SyncroSim
-    SED=pd.read_csv("Y:/client-data/demo_projects/climate85/Working_data/sed_dist/sed_dist_"+NTS_code+".csv")
-    SED['Name']='SED'
-    SED=SED.rename(columns={'sp_ev_days': 'Value', 'pct': 'RelativeFrequency'})
-    SED=pd.concat([SED, ign_dist], ignore_index=True)
-    scen.save_datasheet(name="burnP3Plus_DistributionValue",data=SED)
+    #Set weather stream and SED/ign distributions
+    _save_datasheet(scen,'burnP3Plus_WeatherStream',inputs['FWI'])
+    _save_datasheet(scen,"burnP3Plus_DistributionValue",inputs['dist'])
     print('Setup complete for NTS sheet '+NTS_code)
 
-    return ign_rescaling, scen
+    return inputs['ign_rescaling'], scen
 
-def _init_run(NTS_code,it_num,ssim_fp,sess_fp='C:/Program Files/SyncroSim'):
+def _init_run(NTS_code,it_num,ssim_fp,sess_fp='C:/Program Files/SyncroSim',
+              jobs=None,temp_dir=None,it_start=1):
     '''
     Runs BP3+, with given number(s) of iterations, for an NTS sheet and saves 
     outputs to the C:\\BP3IO folder.
@@ -162,12 +325,24 @@ def _init_run(NTS_code,it_num,ssim_fp,sess_fp='C:/Program Files/SyncroSim'):
     NTS_code : string
         Code/name for the NTS sheet being run.
     it_num : Integer
-        Number of iteration to run.
+        Number of iteration to run. When it_start is given this is the last
+        iteration of the batch.
     ssim_fp : string
         File path for the .ssim file.
     sess_fp : string, optional
         Filepath for the Syncrosim install. The default is 
         'C:/Program Files/SyncroSim'.
+    jobs : integer, optional
+        Number of SyncroSim jobs (i.e., cores) for this run. The default is
+        None, which uses all but one of the available cores.
+    temp_dir : string, optional
+        SyncroSim temp folder of the library, which holds the summary 
+        outputs. The default is None, which uses the folder set in the
+        library (see get_temp_dir).
+    it_start : integer, optional
+        First iteration to run. Running iterations it_start to it_num lets a
+        run be split into batches that don't repeat iterations. The default
+        is 1.
 
     Returns
     -------
@@ -178,92 +353,338 @@ def _init_run(NTS_code,it_num,ssim_fp,sess_fp='C:/Program Files/SyncroSim'):
         Number of iterations run
 
     '''
-    #Connect to syncrosim
-    sess=ps.Session(sess_fp, silent=False)
-    #Read in a library, project and Scenario that has already been created.
-    #This scenario will then be modified in the loop to change the number of 
-    #iterations. Scenario here corresponds to Ft. Mac NTS sheet
-    lib=ps.library(name = ssim_fp, session=sess, package='burnP3Plus', addons='burnP3PlusCell2Fire', use_conda=True)
-    proj=lib.projects(pid=1)
-    scen=proj.scenarios(sid=1)
+    #Connect to syncrosim. The scenario is the one set up by _setup_scen
+    scen=_get_scen(ssim_fp,sess_fp)
+    if temp_dir==None:
+        temp_dir=get_temp_dir(ssim_fp,sess_fp)
     
     #Running scenario for it_num iterations
-    df_time=pd.DataFrame(columns=['Iteration Number','Time (min)'])
-    os.makedirs('C:\\Users\\GiovanniCorti\\Documents\\Stats', exist_ok=True)
+    os.makedirs(STATS_DIR, exist_ok=True)
+    os.makedirs(BP_DIR, exist_ok=True)
     #os.makedirs('BP3IO/'+NTS_code+'/BurnMap', exist_ok=True)
     #os.makedirs('BP3IO/'+NTS_code+'/Stats', exist_ok=True)
     
     #Change iteration number
-    RC=scen.datasheets(name="burnP3Plus_RunControl")
+    RC=_load_datasheet(scen,"burnP3Plus_RunControl")
+    RC.at[0,'MinimumIteration']=it_start
     RC.at[0,'MaximumIteration']=it_num
-    scen.save_datasheet(name="burnP3Plus_RunControl",data=RC)
+    _save_datasheet(scen,"burnP3Plus_RunControl",RC)
                  
     #Run simulation
     print('Running NTS Sheet '+NTS_code+ ' for '+ str(it_num)+ ' iterations.')
-    st_time=time.time()
 
-    out=scen.run(jobs=mp.cpu_count()-1)
+    if jobs==None:
+        jobs=mp.cpu_count()-1
+    with stage_timer.span('scen_run',jobs=jobs,it_start=it_start,it_num=it_num):
+        out=scen.run(jobs=jobs)
         
-    #Copy burn probability maps        
-    bp_fp="C:\\NTS_template.ssim.temp\\summary\\"+str(out.datasheets(name="burnP3Plus_OutputBurnProbability")["FileName"][0])
-    bp_dst_fp='C:\\Users\\GiovanniCorti\\Documents\\BP_maps\\BP_it'+str(it_num)+'.tif'
-    os.system('copy /y '+bp_fp+' '+bp_dst_fp)
-            
-    #Output burn count
-    #bc_fp="C:\\NTS_template.ssim.temp\\summary\\"+str(out.datasheets(name="burnP3Plus_OutputBurnCount")["FileName"][0])
-    #bc_dst_fp=r"C:\\BP3IO\\"+NTS_code+'\\BurnMap\\BM_it'+str(it_num)+'.tif'
-    #os.system('copy /y '+bc_fp+' '+bc_dst_fp)
-            
-    #Burn stats spreadsheet
-    stat_tab=out.datasheets(name="burnP3Plus_OutputFireStatistic")
-    stat_tab.to_csv("C:\\Users\\GiovanniCorti\\Documents\\Stats\\FireStats_"+NTS_code+"_it"+str(it_num)+'.csv')
+    with stage_timer.span('copy_outputs'):
+        #Copy burn probability maps. Sheet code is in the name so parallel runs
+        #don't overwrite each other
+        bp_fp=os.path.join(temp_dir,"summary",str(out.datasheets(name="burnP3Plus_OutputBurnProbability")["FileName"][0]))
+        bp_dst_fp=os.path.join(BP_DIR,'BP_'+NTS_code+'_it'+str(it_num)+'.tif')
+        shutil.copyfile(bp_fp,bp_dst_fp)
+                
+        #Output burn count
+        #bc_fp="C:\\NTS_template.ssim.temp\\summary\\"+str(out.datasheets(name="burnP3Plus_OutputBurnCount")["FileName"][0])
+        #bc_dst_fp=r"C:\\BP3IO\\"+NTS_code+'\\BurnMap\\BM_it'+str(it_num)+'.tif'
+        #os.system('copy /y '+bc_fp+' '+bc_dst_fp)
+                
+        #Burn stats spreadsheet
+        stat_tab=out.datasheets(name="burnP3Plus_OutputFireStatistic")
+        stat_tab.to_csv(os.path.join(STATS_DIR,"FireStats_"+NTS_code+"_it"+str(it_num)+'.csv'))
         
-
-    end_time=time.time()
-    tt=(end_time-st_time)/60
-    df_time.loc[len(df_time.index)] = [it_num,tt]
+    #Run times are in the stage_timer logs
     print('Done running '+str(it_num)+' iterations.')
         
-    #df_time.to_csv('C:/BP3IO/'+NTS_code+'/run_time.csv')
-    bp_dst_fp=None
     return bp_dst_fp, it_num
 
-#Get probs for zero-truncated poisson dist dists
-def ztp(L,x):
-    return np.float64(((L**x)*np.e**(-1*L))/(math.factorial(x)*(1-np.e**(-1*L))))
-
-#Calc parameters to define ztp based on desired average. Will be fed into 
-#fsolve, a numerical solver
-def ztp_mean(L,mu):
-    return (L*np.e**(L))/(np.e**(L)-1)-mu    
-
-#Create ztp dist
-def ztp_dist(name,mu):
-    assert name in ['SED','Igns'], "Name must be either SED or Igns"
-    rf_ls=[]
-    val_ls=[]
-    #Calc lambda param
-    L=fsolve(ztp_mean,0.01,args=mu)
-    x=1
-    
-    #Calc prob until prob is less that 1 percent
-    prob=ztp(L,x)
-    if mu==1:
-        rf_ls.append(1)
-        val_ls.append(1)
-    else:
-        rf_ls.append(prob)
-        val_ls.append(x)
-        while prob>.01 or x<mu:
-            x=x+1
-            prob=ztp(L,x)
-            rf_ls.append(prob)
-            val_ls.append(x)
-    ztp_df=pd.DataFrame({'Value':val_ls,'RelativeFrequency':rf_ls})
-    ztp_df['Name']=name
-    return ztp_df
-
-def run_test_nts(NTS_ls, SED_mu,ez_fs_mu):
+def _init_worker(ssim_fp,work_root,log_dir=None):
+    """
+    Pool initializer. Copies the template library into a temp directory owned
+    by this worker so concurrent runs never share a .ssim file or its temp
+    folder.
+
+    Parameters
+    ----------
+    ssim_fp : string
+        File path for the template .ssim file.
+    work_root : string or None
+        Directory that the per-worker temp directories are created in. None
+        uses the system temp directory.
+    log_dir : string, optional
+        Stage timing log folder (see stage_timer.py). The default is None
+        (no timing).
+
+    Returns
+    -------
+    """
+    global _worker_ssim_fp
+    stage_timer.configure(log_dir)
+    wdir=tempfile.mkdtemp(prefix='bp3_worker_'+str(os.getpid())+'_',dir=work_root)
+    #Library copy and its outputs are deleted when the worker exits (pool
+    #close/join)
+    mp.util.Finalize(None,shutil.rmtree,args=(wdir,),kwargs={'ignore_errors':True},exitpriority=10)
+    _worker_ssim_fp=os.path.join(wdir,os.path.basename(ssim_fp))
+    shutil.copyfile(ssim_fp,_worker_ssim_fp)
+
+def _check_temp_dir(ssim_fp,work_root=None):
+    #A temp folder set to a fixed path in the template would be shared by all
+    #the worker copies. Checked on a scratch copy in the parent, as an error in
+    #a pool initializer just makes the pool restart the worker forever
+    wdir=tempfile.mkdtemp(prefix='bp3_check_',dir=work_root)
+    copy_fp=os.path.join(wdir,os.path.basename(ssim_fp))
+    try:
+        shutil.copyfile(ssim_fp,copy_fp)
+        temp_dir=os.path.normcase(os.path.abspath(get_temp_dir(copy_fp)))
+    finally:
+        _scen_pool.pop((copy_fp,'C:/Program Files/SyncroSim'),None)
+        shutil.rmtree(wdir,ignore_errors=True)
+    if not temp_dir.startswith(os.path.normcase(os.path.abspath(wdir))+os.sep):
+        raise RuntimeError("Library temp folder "+temp_dir+" is shared by the worker copies, "
+                           "reset the template's temporary folder to the default")
+
+def _fire_stats(area):
+    #Count, mean and sum of squared deviations (Welford) of fire areas
+    area=np.asarray(area,dtype=np.float64)
+    if len(area)==0:
+        return 0,0.0,0.0
+    mean=area.mean()
+    return len(area),mean,np.sum((area-mean)**2)
+
+def _merge_stats(a,b):
+    #Combine two (count, mean, M2) accumulators (Chan et al. parallel update)
+    n=a[0]+b[0]
+    if n==0:
+        return 0,0.0,0.0
+    delta=b[1]-a[1]
+    mean=a[1]+delta*b[0]/n
+    M2=a[2]+b[2]+delta**2*a[0]*b[0]/n
+    return n,mean,M2
+
+def _base_key(NTS_code,inputs=None):
+    """
+    Hash of the inputs of a sheet other than the SED distribution (ign 
+    distribution, weather stream and rasters). Cached runs are only compared
+    with each other if they share this key.
+
+    Parameters
+    ----------
+    NTS_code : string
+        Code/name for the NTS sheet.
+    inputs : dict, optional
+        Output of _sheet_inputs. The default is None, which reads them.
+
+    Returns
+    -------
+    key : string or None
+        None if the sheet has 0 igns.
+    """
+    if inputs==None:
+        inputs=_sheet_inputs(NTS_code)
+        if inputs==None:
+            return None
+    ign_df=inputs['dist'][inputs['dist']['Name']=='Igns']
+    rasters=[calval_cache.file_sig(fp) for fp in inputs['ls_fps']+inputs['ign_grid_fps']]
+    return calval_cache.hash_inputs(NTS_code,ign_df,inputs['FWI'],rasters)
+
+def _run_sheet(NTS_code,SED_mu,it_num,ssim_fp,jobs,it_start=1):
+    """
+    Sets up a single NTS sheet with a ztp SED distribution, runs BP3+ and
+    returns the fire area totals needed for the ecozone average fire size.
+    Runs whose exact inputs are already in the results cache are not rerun.
+
+    Parameters
+    ----------
+    NTS_code : string
+        Code/name for the NTS sheet being run.
+    SED_mu : float
+        Average SED number to try.
+    it_num : integer
+        Last iteration to run.
+    ssim_fp : string
+        File path for the .ssim file.
+    jobs : integer or None
+        Number of SyncroSim jobs for this run.
+    it_start : integer, optional
+        First iteration to run. The default is 1.
+
+    Returns
+    -------
+    stats : tuple
+        (count, mean, M2) of the burned area of the simulated fires, see
+        _fire_stats.
+    """
+    #Check the results cache first
+    SED_df=ztp_dist('SED',SED_mu)
+    with stage_timer.span('sheet_inputs'):
+        inputs=_sheet_inputs(NTS_code,SED_df)
+    if inputs==None:
+        return _fire_stats([])
+    base_key=_base_key(NTS_code,inputs)
+    key=calval_cache.hash_inputs(base_key,inputs['dist'],it_start,it_num)
+    rec=calval_cache.load(CACHE_DIR,key)
+    if rec!=None:
+        print('Using cached run for NTS sheet '+NTS_code)
+        return rec['n'],rec['mean'],rec['M2']
+    
+    #Setup NTS_sheet with a ztp dist based of SED_mu. Only datasheets that
+    #changed since the last run on this library are saved
+    setup=_setup_scen(NTS_code,ssim_fp,SED=SED_df)
+    if setup==None:
+        return _fire_stats([])
+    ign_rescaling,scen=setup
+    
+    #Run NTS sheet
+    bp_dst_fp, it_num=_init_run(NTS_code,it_num,ssim_fp,jobs=jobs,it_start=it_start)
+    
+    #Read stats csv and calc params for average fire size
+    with stage_timer.span('read_stats'):
+        stats_df=pd.read_csv(os.path.join(STATS_DIR,"FireStats_"+NTS_code+"_it"+str(it_num)+'.csv'))
+    stats=_fire_stats(stats_df["Area"])
+    calval_cache.save(CACHE_DIR,key,{'NTS_code':NTS_code,'base_key':base_key,
+                      'SED_mu':float(SED_mu),'it_start':int(it_start),'it_num':int(it_num),
+                      'n':int(stats[0]),'mean':float(stats[1]),'M2':float(stats[2])})
+    return stats
+
+def _sheet_worker(args):
+    #Runs one sheet on the library copy owned by this worker, with the timing
+    #tags of the parent process
+    NTS_code,SED_mu,it_num,jobs,it_start,tags=args
+    with stage_timer.context(**dict(tags,NTS_code=NTS_code)):
+        return _run_sheet(NTS_code,SED_mu,it_num,_worker_ssim_fp,jobs,it_start)
+
+def make_pool(n_workers,ssim_fp=SSIM_FP,work_root=None):
+    """
+    Creates a process pool for running NTS sheets at the same time. Each 
+    worker gets its own copy of the template library. Raises RuntimeError if
+    the template's temp folder is a fixed path, which the copies would share.
+
+    Parameters
+    ----------
+    n_workers : integer
+        Number of sheets to run at the same time.
+    ssim_fp : string, optional
+        File path for the template .ssim file.
+    work_root : string, optional
+        Directory for the per-worker library copies. The default is None,
+        which uses the system temp directory.
+
+    Returns
+    -------
+    pool : multiprocessing.Pool
+    """
+    _check_temp_dir(ssim_fp,work_root)
+    return mp.Pool(n_workers,initializer=_init_worker,
+                   initargs=(ssim_fp,work_root,stage_timer.get_log_dir()))
+
+def run_sheets(NTS_ls,SED_mu,it_num,pool=None,jobs=None,it_start=1):
+    """
+    Runs a set of NTS sheets with the same SED average. If a pool is given the 
+    sheets are run at the same time, otherwise one after another on the 
+    template library.
+
+    Parameters
+    ----------
+    NTS_ls : list of string
+        NTS codes for the sheets to run.
+    SED_mu : float
+        Average SED number to try.
+    it_num : integer
+        Last iteration to run for each sheet.
+    pool : multiprocessing.Pool, optional
+        Pool from make_pool. The default is None.
+    jobs : integer, optional
+        SyncroSim jobs per sheet run. The default is None, which uses all but
+        one core when running serially and splits the cores between the 
+        sheets when running in parallel.
+    it_start : integer, optional
+        First iteration to run for each sheet. The default is 1.
+
+    Returns
+    -------
+    res_ls : list of tuple
+        (count, mean, M2) of the fire areas for each sheet, in the order of 
+        NTS_ls.
+    """
+    if pool==None:
+        res_ls=[]
+        for NTS_code in NTS_ls:
+            with stage_timer.context(NTS_code=NTS_code):
+                res_ls.append(_run_sheet(NTS_code,SED_mu,it_num,SSIM_FP,jobs,it_start))
+        return res_ls
+    if jobs==None:
+        jobs=max(1,(mp.cpu_count()-1)//len(NTS_ls))
+    tags=stage_timer.get_context()
+    return pool.map(_sheet_worker,[(NTS_code,SED_mu,it_num,jobs,it_start,tags) for NTS_code in NTS_ls])
+
+def _eval_fire_size(NTS_ls,SED_mu,it_num=500,pool=None,jobs=None,
+                    ez_fs_mu=None,tol=.05,batch=100,max_it=2000,z=1.96):
+    """
+    Runs all test sheets of an ecozone for one SED average and returns the
+    modelled average fire size over all the sheets.
+    
+    If a target fire size is given the sheets are run in batches of 
+    iterations instead of a fixed count. Fire areas from each batch are 
+    merged into a running mean/variance and the runs stop once the 
+    confidence interval half width on the mean fire size is within the 
+    tolerance, or the whole interval is outside the tolerance band (i.e., 
+    the SED clearly needs to move).
+
+    Parameters
+    ----------
+    NTS_ls : list of string
+        NTS codes for the test sheets.
+    SED_mu : float
+        Average SED number to try.
+    it_num : integer, optional
+        Number of iterations per sheet when running a fixed count. The 
+        default is 500.
+    pool : multiprocessing.Pool, optional
+        See run_sheets.
+    jobs : integer, optional
+        See run_sheets.
+    ez_fs_mu : float, optional
+        Target average fire size. The default is None, which runs a fixed
+        it_num iterations.
+    tol : float, optional
+        Relative fire size tolerance. The default is .05.
+    batch : integer, optional
+        Iterations per sheet in each batch. The default is 100.
+    max_it : integer, optional
+        Maximum iterations per sheet. The default is 2000.
+    z : float, optional
+        Normal quantile for the confidence interval. The default is 1.96.
+
+    Returns
+    -------
+    mod_fs_mu : float
+        Modelled average fire size.
+    """
+    print("Trying with SED avg of "+str(SED_mu))
+    if ez_fs_mu==None:
+        batch=max_it=it_num
+    
+    stats=_fire_stats([])
+    it_end=0
+    while it_end<max_it:
+        it_start=it_end+1
+        it_end=min(it_end+batch,max_it)
+        for res in run_sheets(NTS_ls,SED_mu,it_end,pool=pool,jobs=jobs,it_start=it_start):
+            stats=_merge_stats(stats,res)
+        if ez_fs_mu==None or stats[0]<2:
+            continue
+        
+        #Confidence interval on the mean fire size
+        n,mean,M2=stats
+        half=z*np.sqrt(M2/(n-1)/n)
+        band=tol*ez_fs_mu
+        if half<=band or mean-half>ez_fs_mu+band or mean+half<ez_fs_mu-band:
+            break
+    print('Used '+str(it_end)+' iterations per sheet.')
+    return stats[1]
+
+def run_test_nts(NTS_ls, SED_mu,ez_fs_mu,pool=None,jobs=None):
     """
     Function to setup and run NTS sheets, adjusting the number of SEDs
     until the average. Here we use the ign values and probabilistic ign grids
@@ -279,43 +700,27 @@ def run_test_nts(NTS_ls, SED_mu,ez_fs_mu):
         
     ez_fs_mu: float
         Target average fire size
+    
+    pool: multiprocessing.Pool, optional
+        Pool from make_pool used to run the sheets at the same time. The 
+        default is None, which runs the sheets one after another.
+    
+    jobs: integer, optional
+        SyncroSim jobs per sheet run (see run_sheets).
             
     Returns
     ---------
     
     SED_mu: float
         Final SED number attempted. This will yield a result close to the
-        desired fire size
+        desired fire size, or SED_mu=1 if the sheets burn too much even at
+        the smallest SED
     
     """
     fs_delta=1
     while fs_delta>.05:
-        print("Trying with SED avg of "+str(SED_mu))
-        area_sum=0
-        tot_fires=0
-        for NTS_code in NTS_ls:
-            #Setup NTS_sheet
-            ign_rescaling,scen=_setup_scen(NTS_code,"C:\\Users\\GiovanniCorti\\Documents\\NTS_template.ssim")
-            
-            #Create ztp dist based of SED_mu
-            SED_df=ztp_dist('SED',SED_mu)
-            ign_df=pd.read_csv("Y:/client-data/demo_projects/climate85/Working_data/ign_dist/ign_dist_"+NTS_code+".csv")
-            ign_df['Name']='Igns'
-            ign_df=ign_df.rename(columns={'ign_per_it': 'Value', 'pct': 'RelativeFrequency'})
-            
-            dist_df=pd.concat([SED_df, ign_df], ignore_index=True)
-            scen.save_datasheet(name="burnP3Plus_DistributionValue",data=dist_df)
-            
-            #Run NTS sheet for 500 its
-            bp_dst_fp, it_num=_init_run(NTS_code,500,"C:\\Users\\GiovanniCorti\\Documents\\NTS_template.ssim")
-            
-            #Read stats csv and calc params for average fire size
-            stats_df=pd.read_csv("C:\\Users\\GiovanniCorti\\Documents\\Stats\\FireStats_"+NTS_code+"_it"+str(it_num)+'.csv')
-            area_sum=area_sum+stats_df["Area"].sum()
-            tot_fires=tot_fires+len(stats_df["Area"])
-            
         #Calc avg fire size and delta from desired target size
-        mod_fs_mu=area_sum/tot_fires
+        mod_fs_mu=_eval_fire_size(NTS_ls,SED_mu,pool=pool,jobs=jobs)
         fs_delta=np.abs((mod_fs_mu-ez_fs_mu)/ez_fs_mu)
         print("Ecozone Avg fire size",ez_fs_mu)
         print("Model Avg fire size",mod_fs_mu)
@@ -323,7 +728,7 @@ def run_test_nts(NTS_ls, SED_mu,ez_fs_mu):
         #Stop if SED falls below 1
         if SED_mu==1 and ez_fs_mu<mod_fs_mu:
             print('Hit min SED val. Stopping')
-            exit()
+            return SED_mu
             
         #Adjust SED_mu up or down depending on how far off we are from the
         #desired ecozone fire size. Step size varies based on how far off
@@ -336,8 +741,147 @@ def run_test_nts(NTS_ls, SED_mu,ez_fs_mu):
                 SED_mu=1
     return SED_mu
         
-def run_EZs():
-    #Wrapper function to run run_test_nts for all ecozones
+def calibrate_sed(NTS_ls,ez_fs_mu,SED_mu=2,tol=.05,SED_min=1,SED_max=7,
+                  max_iter=12,history=None,pool=None,jobs=None,adaptive=False):
+    """
+    Tunes the SED average for a set of NTS sheets by treating the modelled
+    average fire size as an increasing function of SED_mu and solving 
+    fire size = target with the Illinois (modified regula falsi) method.
+    Every BP3+ round is kept so the bracket and the secant steps use all
+    of the (SED_mu, fire size) pairs seen so far.
+
+    Parameters
+    ----------
+    NTS_ls : list of string
+        NTS codes for the test sheets.
+    ez_fs_mu : float
+        Target average fire size.
+    SED_mu : float, optional
+        First SED average to try, e.g. the tuned value of a neighbouring
+        ecozone. The default is 2.
+    tol : float, optional
+        Relative fire size tolerance. The default is .05.
+    SED_min : float, optional
+        Smallest allowed SED average. The default is 1.
+    SED_max : float, optional
+        Largest allowed SED average. Large SEDs can crash BP3+ due to memory
+        limits. The default is 7.
+    max_iter : integer, optional
+        Maximum number of BP3+ rounds. Steps onto SEDs already in history
+        don't run BP3+, so the loop is also stopped after max_iter plus the
+        number of earlier pairs passes. The default is 12.
+    history : list of tuple, optional
+        Earlier (SED_mu, fire size) pairs for these sheets. The default is
+        None.
+    pool : multiprocessing.Pool, optional
+        See run_sheets.
+    jobs : integer, optional
+        See run_sheets.
+    adaptive : bool, optional
+        Stop each round once the fire size estimate is precise enough 
+        instead of running 500 iterations (see _eval_fire_size). The default
+        is False.
+
+    Returns
+    -------
+    res : dict
+        'SED_mu' (best SED average), 'fire_size' (modelled fire size for 
+        it), 'status' ('converged', 'hit_bound' or 'max_iter'), 'n_iter' 
+        (BP3+ rounds run by this call) and 'history' (all (SED_mu, fire 
+        size) pairs).
+    """
+    hist=list(history) if history!=None else []
+    n_iter=0
+    max_pass=max_iter+len(hist)
+    
+    def _result(status):
+        SED_best,fs_best=min(hist,key=lambda p: abs(p[1]-ez_fs_mu))
+        print("SED tuning "+status+" after "+str(n_iter)+" rounds. SED avg of "+str(SED_best))
+        return {'SED_mu':SED_best,'fire_size':fs_best,'status':status,
+                'n_iter':n_iter,'history':hist}
+    
+    SED_mu=min(max(SED_mu,SED_min),SED_max)
+    side=0 #Endpoint retained twice in a row (-1 lo, 1 hi), used by Illinois
+    for n_pass in range(max_pass+1):
+        #Reuse an earlier round if we've already tried this SED
+        fs_prev=[p[1] for p in hist if p[0]==SED_mu]
+        if n_pass==max_pass or (len(fs_prev)==0 and n_iter>=max_iter):
+            return _result('max_iter')
+        if len(fs_prev)>0:
+            mod_fs_mu=fs_prev[0]
+        else:
+            if adaptive:
+                mod_fs_mu=_eval_fire_size(NTS_ls,SED_mu,pool=pool,jobs=jobs,
+                                          ez_fs_mu=ez_fs_mu,tol=tol)
+            else:
+                mod_fs_mu=_eval_fire_size(NTS_ls,SED_mu,pool=pool,jobs=jobs)
+            hist.append((SED_mu,mod_fs_mu))
+            n_iter+=1
+            print("Ecozone Avg fire size",ez_fs_mu)
+            print("Model Avg fire size",mod_fs_mu)
+        
+        if np.abs((mod_fs_mu-ez_fs_mu)/ez_fs_mu)<=tol:
+            return _result('converged')
+        if mod_fs_mu>ez_fs_mu and SED_mu<=SED_min:
+            return _result('hit_bound')
+        if mod_fs_mu<ez_fs_mu and SED_mu>=SED_max:
+            return _result('hit_bound')
+        
+        #Tightest bracket from all pairs seen so far
+        lo=[p for p in hist if p[1]<ez_fs_mu]
+        hi=[p for p in hist if p[1]>ez_fs_mu]
+        lo=max(lo) if len(lo)>0 else None
+        hi=min(hi) if len(hi)>0 else None
+        
+        if lo!=None and hi!=None:
+            #Illinois step. The fire size of an endpoint kept for two rounds
+            #in a row is halved so the bracket shrinks from both sides
+            f_lo=lo[1]-ez_fs_mu
+            f_hi=hi[1]-ez_fs_mu
+            new_side=-1 if mod_fs_mu<ez_fs_mu else 1
+            if new_side==side==-1:
+                f_hi=f_hi/2
+            elif new_side==side==1:
+                f_lo=f_lo/2
+            side=new_side
+            SED_new=lo[0]-f_lo*(hi[0]-lo[0])/(f_hi-f_lo)
+        else:
+            #Not bracketed yet. Assume fire size is roughly proportional to
+            #SED_mu and step at least 25% towards the target
+            ratio=ez_fs_mu/mod_fs_mu if mod_fs_mu>0 else 2
+            if ratio>1:
+                SED_new=SED_mu*max(ratio,1.25)
+            else:
+                SED_new=SED_mu*min(ratio,.8)
+        
+        SED_mu=float(min(max(SED_new,SED_min),SED_max))
+        
+def run_EZs(n_workers=1,jobs=None,mode='bracket',adaptive=False):
+    """
+    Wrapper function to run run_test_nts or calibrate_sed for all ecozones
+
+    Parameters
+    ----------
+    n_workers : integer, optional
+        Number of NTS sheets to run at the same time. The default is 1 (run
+        sheets one after another).
+    jobs : integer, optional
+        SyncroSim jobs per sheet run (see run_sheets).
+    mode : string, optional
+        'step' uses the fixed multiplicative step of run_test_nts, 'bracket'
+        uses calibrate_sed and warm starts each ecozone from cached runs of
+        its test sheets or, failing that, an already tuned neighbour. The 
+        default is 'bracket'.
+    adaptive : bool, optional
+        Use adaptive iteration counts in 'bracket' mode (see 
+        _eval_fire_size). The default is False.
+
+    Returns
+    -------
+    """
+    assert mode in ['step','bracket'], "mode must be either step or bracket"
+    #Set before the pool is made so the workers log too
+    stage_timer.configure(TIMING_DIR)
     
     #Test sheets for each ecozone. Here I attempt span the geographic extent of
     #the ecozone with a few sheets.  
@@ -349,17 +893,50 @@ def run_EZs():
     fs_dict={4.0: 2824.47, 5.0: 3740.222, 6.2: 3700.776, 6.1: 2783.094,
              9.0: 2121.775, 11.0: 2958.133, 
              12.0: 4296.312, 13.0: 465.003, 14.0: 1679.746, 15.0: 1254.873}
+    #Neighbouring ecozones, closest match first. Used to warm start tuning
+    nbr_dict={4.0:[11.0,12.0,5.0,9.0,6.2], 5.0:[4.0,6.2,6.1,15.0],
+              6.1:[6.2,5.0,15.0], 6.2:[6.1,9.0,5.0,15.0], 9.0:[6.2,4.0,14.0],
+              11.0:[12.0,4.0], 12.0:[11.0,4.0,14.0,13.0], 13.0:[12.0,14.0],
+              14.0:[12.0,9.0,13.0], 15.0:[6.2,6.1,5.0]}
+    
+    #Ecozones have at most 3 test sheets so there is no gain from more workers
+    pool=None
+    if n_workers>1:
+        pool=make_pool(min(n_workers,max(len(v) for v in ts_dict.values())))
     
     tuned_sed_df=pd.DataFrame(columns=["Ecozone Code", "SED value"])
+    tuned_dict={}
     #Run tunning for each ecozone
-    for ez_code in fs_dict:
-        print("Running Ecozone", ez_code)
-        SED_mu=run_test_nts(ts_dict[ez_code],2,fs_dict[ez_code])
-        tdf=pd.DataFrame({"Ecozone Code":[ez_code], "SED value":[SED_mu]})
-        
-        #Saved tuned SEDs to a csv
-        tuned_sed_df=pd.concat([tuned_sed_df,tdf])
-        tuned_sed_df.to_csv("C:\\Users\\GiovanniCorti\\Documents\\tuned_sed.csv")
+    try:
+        for ez_code in fs_dict:
+            with stage_timer.context(ecozone=ez_code),stage_timer.span('tune_ecozone'):
+                print("Running Ecozone", ez_code)
+                if mode=='step':
+                    SED_mu=run_test_nts(ts_dict[ez_code],2,fs_dict[ez_code],pool=pool,jobs=jobs)
+                    tdf=pd.DataFrame({"Ecozone Code":[ez_code], "SED value":[SED_mu]})
+                else:
+                    #Earlier runs of these sheets from the results cache
+                    base_keys={k:_base_key(k) for k in ts_dict[ez_code]}
+                    base_keys={k:v for k,v in base_keys.items() if v!=None}
+                    hist=calval_cache.ecozone_history(CACHE_DIR,base_keys)
+                    SED_0=calval_cache.guess_sed(CACHE_DIR,base_keys,fs_dict[ez_code])
+                    if SED_0==None:
+                        SED_0=next((tuned_dict[k] for k in nbr_dict[ez_code] if k in tuned_dict),2)
+                    res=calibrate_sed(ts_dict[ez_code],fs_dict[ez_code],SED_0,history=hist,
+                                      pool=pool,jobs=jobs,adaptive=adaptive)
+                    tuned_dict[ez_code]=res['SED_mu']
+                    tdf=pd.DataFrame({"Ecozone Code":[ez_code], "SED value":[res['SED_mu']],
+                                      "Status":[res['status']], "Rounds":[res['n_iter']]})
+            
+                #Saved tuned SEDs to a csv
+                tuned_sed_df=pd.concat([tuned_sed_df,tdf])
+                tuned_sed_df.to_csv("C:\\Users\\GiovanniCorti\\Documents\\tuned_sed.csv")
+    finally:
+        if pool!=None:
+            pool.close()
+            pool.join()
+    if TIMING_DIR!=None:
+        print(stage_timer.summarise(TIMING_DIR,by=('ecozone',),top=20))
         
     
     
@@ -368,4 +945,4 @@ if __name__ == "__main__":
 
     #Connect to Y: drive for NTS sheet parameter files
     subprocess.call(r"net use y: \\192.168.99.12\shared /user:gcorti 850Whastings")
-    run_EZs()    
+    run_EZs(n_workers=3,mode='bracket',adaptive=True)    
@@ -0,0 +1,241 @@
+#Synthetic inputs for the benchmarks in run_bench.py, so the input pipeline can
+#be timed without the Y: drive, the climate disk or a SyncroSim install. Makes
+#an NTS-like grid of sheets (with the 100/250 km buffers), ecozones, an FBP-like
+#fuel raster, NFDB-like fire points, per-sheet FWI csvs for the baseline and
+#climate scenarios, yearly CMIP-like NetCDF cubes and the sheet input folders
+#SED_calval.py reads. Everything is seeded, so a scale always gives the same
+#fixtures and they are only built once per work folder.
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import xarray as xr
+import rasterio as rio
+from rasterio.transform import from_bounds
+import shapely
+import json
+import os
+
+#Sizes of each scale. Sheets are nx x ny, the fuel raster is px x px, the FWI
+#csvs have fwi_rows rows each for the baseline and n_scen scenarios, the CMIP
+#cubes are 365 x lat x lon for cmip_years years and calibration runs n_ez
+#ecozones of 3 test sheets.
+SCALES={'small':{'nx':8,'ny':6,'px':1024,'n_pnts':20000,'fwi_rows':2000,'n_scen':2,
+                 'cmip_years':5,'lat':24,'lon':48,'n_ez':1},
+        'medium':{'nx':20,'ny':12,'px':4096,'n_pnts':200000,'fwi_rows':5000,'n_scen':3,
+                  'cmip_years':10,'lat':60,'lon':120,'n_ez':3},
+        'large':{'nx':30,'ny':20,'px':8192,'n_pnts':1000000,'fwi_rows':4000,'n_scen':1,
+                 'cmip_years':15,'lat':100,'lon':200,'n_ez':10}}
+
+#EASE-Grid 2.0 North (equal area), as used for the sheet areas in the notebooks
+CRS='EPSG:6931'
+#Sheet size (m), roughly that of a 1:250k NTS sheet
+SHEET_W=150000
+SHEET_H=110000
+#Fuel codes and how common they are. 101-122 are non-fuel/water
+FUEL_CODES=np.array([1,2,3,4,5,7,13,31,101,102,118,122],dtype=np.uint8)
+FUEL_P=np.array([.05,.25,.1,.05,.05,.05,.1,.05,.05,.05,.15,.05])
+FUEL_NODATA=255
+#Columns of the fwi_era_NTS_SNRC_ csvs and the weather stream csvs
+FWI_COLS=['year','doy','node','temp','rh','ws','wd','prec','ffmc','dmc','dc','isi','bui','fwi']
+WX_COLS=['Season','Temperature','RelativeHumidity','WindSpeed','WindDirection','Precipitation',
+         'FineFuelMoistureCode','DuffMoistureCode','DroughtCode','InitialSpreadIndex',
+         'BuildupIndex','FireWeatherIndex']
+
+
+def sheet_code(k):
+    #NTS-like code, e.g. '002C'
+    return '%03d'%(k//16)+'ABCDEFGHIJKLMNOP'[k%16]
+
+def nts_grid(nx,ny):
+    """
+    Grid of nx x ny rectangular sheets.
+
+    Returns
+    -------
+    nts : GeoDataFrame
+        'NTS_SNRC' and geometry, in CRS.
+    """
+    x0,y0=-2500000,-3500000
+    ix,iy=np.meshgrid(np.arange(nx),np.arange(ny))
+    ix,iy=ix.ravel(),iy.ravel()
+    geom=shapely.box(x0+ix*SHEET_W,y0+iy*SHEET_H,x0+(ix+1)*SHEET_W,y0+(iy+1)*SHEET_H)
+    return gpd.GeoDataFrame({'NTS_SNRC':[sheet_code(k) for k in range(len(geom))]},geometry=geom,crs=CRS)
+
+def ecozones(bounds,n=12,seed=0):
+    """
+    Voronoi cells of random seeds clipped to bounds, with an average fire
+    size for each.
+
+    Returns
+    -------
+    ez : GeoDataFrame
+        'ECOZONE', 'fs_mu' and geometry, in CRS.
+    """
+    rng=np.random.default_rng(seed)
+    pts=shapely.points(rng.uniform(bounds[0],bounds[2],n),rng.uniform(bounds[1],bounds[3],n))
+    box=shapely.box(*bounds)
+    cells=shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(pts),extend_to=box))
+    cells=shapely.intersection(cells,box)
+    return gpd.GeoDataFrame({'ECOZONE':np.arange(1,len(cells)+1).astype(np.float64),
+                             'fs_mu':rng.uniform(400,4500,len(cells))},geometry=cells,crs=CRS)
+
+def fuel_raster(fp,bounds,px,seed=0):
+    """
+    Writes a px x px uint8 fuel raster over bounds. Fuel types come in
+    patches (a coarse random grid blown up 16x) so blocks compress and
+    clip like the real layer. The edges are nodata.
+    """
+    rng=np.random.default_rng(seed)
+    coarse=rng.choice(FUEL_CODES,size=(px//16+1,px//16+1),p=FUEL_P)
+    fuel=np.repeat(np.repeat(coarse,16,axis=0),16,axis=1)[:px,:px]
+    fuel[:px//50]=FUEL_NODATA
+    fuel[:,:px//50]=FUEL_NODATA
+    profile={'driver':'GTiff','width':px,'height':px,'count':1,'dtype':'uint8','crs':CRS,
+             'transform':from_bounds(*bounds,px,px),'nodata':FUEL_NODATA,
+             'tiled':True,'blockxsize':256,'blockysize':256,'compress':'deflate'}
+    with rio.open(fp,'w',**profile) as dst:
+        dst.write(fuel,1)
+
+def nfdb_points(bounds,n,seed=0):
+    """
+    Fire points with NFDB-like attributes.
+
+    Returns
+    -------
+    pnts : GeoDataFrame
+        'CAUSE' (H, L or U), 'YEAR' (1990-2021), 'SIZE_HA' (lognormal, most
+        fires tiny) and point geometry, in CRS.
+    """
+    rng=np.random.default_rng(seed)
+    geom=shapely.points(rng.uniform(bounds[0],bounds[2],n),rng.uniform(bounds[1],bounds[3],n))
+    return gpd.GeoDataFrame({'CAUSE':rng.choice(['H','L','U'],n,p=[.5,.45,.05]),
+                             'YEAR':rng.integers(1990,2022,n).astype(np.int64),
+                             'SIZE_HA':np.round(rng.lognormal(-1,2.5,n),2)},geometry=geom,crs=CRS)
+
+def _fwi_df(n_rows,rng,shift=0):
+    #One sheet's weather, fwi skewed like the real data (mostly low, long tail)
+    df=pd.DataFrame({'year':rng.integers(2010,2021,n_rows),'doy':rng.integers(91,305,n_rows),
+                     'node':rng.integers(0,50,n_rows)})
+    for col in FWI_COLS[3:-1]:
+        df[col]=np.round(rng.gamma(2,10,n_rows),3)
+    df['fwi']=np.round(rng.gamma(1.5,6,n_rows)*(1+shift),3)
+    return df
+
+def fwi_csvs(out_dir,codes,n_rows,scen_ls,seed=0):
+    """
+    Writes fwi_era_NTS_SNRC_<code>.csv and fwi_era_NTS_SNRC_<code>_<scen>.csv
+    for each sheet. Scenario weather is the baseline shifted up a little.
+
+    Returns
+    -------
+    csv_ls : list of tuple
+        (NTS code, scenario, file path), as from fwi_store.scan_csvs.
+    """
+    os.makedirs(out_dir,exist_ok=True)
+    rng=np.random.default_rng(seed)
+    csv_ls=[]
+    for code in codes:
+        for k,scen in enumerate([None]+list(scen_ls)):
+            fp=os.path.join(out_dir,'fwi_era_NTS_SNRC_'+code+('' if scen==None else '_'+scen)+'.csv')
+            _fwi_df(n_rows,rng,shift=.05*k).to_csv(fp,index=False)
+            csv_ls.append((code,'baseline' if scen==None else scen,fp))
+    return csv_ls
+
+def cmip_cubes(out_dir,years,n_lat,n_lon,seed=0):
+    """
+    Writes <year>_mean.nc files with a (time, lat, lon) pr cube for each
+    year, like the yearly CanDCS ensemble files. Cells over the "ocean"
+    corner are NaN.
+    """
+    os.makedirs(out_dir,exist_ok=True)
+    rng=np.random.default_rng(seed)
+    lat=np.linspace(41,83,n_lat)
+    lon=np.linspace(-141,-52,n_lon)
+    doy=np.arange(1,366)
+    seas=(1+np.sin(2*np.pi*doy/365))[:,None,None]
+    for year in years:
+        pr=(seas*rng.gamma(1,2,(365,n_lat,n_lon))).astype(np.float32)
+        pr[:,:n_lat//5,:n_lon//5]=np.nan
+        da=xr.DataArray(pr,dims=('time','lat','lon'),name='pr',
+                        coords={'time':doy,'lat':lat,'lon':lon})
+        da.to_dataset().to_netcdf(os.path.join(out_dir,str(year)+'_mean.nc'))
+
+def sheet_inputs(data_dir,codes,ign_per_it=2,n_wx=500,seed=0):
+    """
+    Writes the sheet inputs SED_calval._sheet_inputs reads (ign/SED dists,
+    weather stream and placeholder DEM/fuel rasters) under data_dir, in the
+    same layout as the Y: drive. Every sheet gets ign_per_it ignitions per
+    iteration.
+    """
+    rng=np.random.default_rng(seed)
+    for d in ['ign_dist','sed_dist']:
+        os.makedirs(os.path.join(data_dir,d),exist_ok=True)
+    for code in codes:
+        sheet_dir=os.path.join(data_dir,'NARR_weather_csvs','NTS_SNRC_'+code)
+        os.makedirs(sheet_dir,exist_ok=True)
+        pd.DataFrame({'ign_per_it':[ign_per_it],'pct':[100]}).to_csv(
+            os.path.join(data_dir,'ign_dist','ign_dist_'+code+'.csv'),index=False)
+        pd.DataFrame({'sp_ev_days':[1,2,3],'pct':[50,30,20]}).to_csv(
+            os.path.join(data_dir,'sed_dist','sed_dist_'+code+'.csv'),index=False)
+        wx=pd.DataFrame(np.round(rng.gamma(2,10,(n_wx,len(WX_COLS))),2),columns=WX_COLS)
+        wx['Season']=rng.integers(1,3,n_wx)
+        wx.to_csv(os.path.join(sheet_dir,'FWI_NTS_SNRC_'+code+'.csv'),index=False)
+        for pre in ['DEM','Fuel']:
+            with open(os.path.join(sheet_dir,pre+'_NTS_SNRC_'+code+'.tif'),'wb') as f:
+                f.write(code.encode())
+
+def build(scale,work_dir):
+    """
+    Builds (or reuses) all fixtures for a scale.
+
+    Parameters
+    ----------
+    scale : string
+        Key of SCALES.
+    work_dir : string
+        Folder the fixtures go in, under a sub folder per scale. Fixtures
+        already built there are reused.
+
+    Returns
+    -------
+    fx : dict
+        The GeoDataFrames ('nts', 'buff' (dict of buffered sheets), 'ez',
+        'pnts'), file paths/folders ('fuel_fp', 'fwi_csvs', 'cmip_dir',
+        'data_dir', 'ssim_fp'), 'cmip_years', 'cal_sheets' (list of test
+        sheet lists, one per ecozone) and the scale's settings ('cfg').
+    """
+    cfg=SCALES[scale]
+    root=os.path.join(work_dir,scale)
+    nts=nts_grid(cfg['nx'],cfg['ny'])
+    bounds=tuple(nts.total_bounds)
+    codes=list(nts['NTS_SNRC'])
+    scen_ls=['ssp%d2040_2060'%s for s in [126,245,585,370][:cfg['n_scen']]]
+    years=list(range(2010,2010+cfg['cmip_years']))
+    fx={'cfg':cfg,'nts':nts,'buff':{'H':nts.buffer(100000),'L':nts.buffer(250000)},
+        'ez':ecozones(bounds),'pnts':nfdb_points(bounds,cfg['n_pnts']),
+        'fuel_fp':os.path.join(root,'fuel.tif'),'cmip_dir':os.path.join(root,'cmip','pr'),
+        'cmip_years':years,'data_dir':os.path.join(root,'Working_data'),
+        'ssim_fp':os.path.join(root,'NTS_template.ssim')}
+    fx['buff']={k:gpd.GeoDataFrame(geometry=v,crs=CRS) for k,v in fx['buff'].items()}
+    #Spread the test sheets out over the grid like the real ones
+    step=max(1,len(codes)//(3*cfg['n_ez']))
+    fx['cal_sheets']=[codes[3*i*step:3*(i+1)*step:step] for i in range(cfg['n_ez'])]
+
+    done_fp=os.path.join(root,'fixtures.json')
+    if os.path.isfile(done_fp):
+        with open(done_fp) as f:
+            fx['fwi_csvs']=[tuple(c) for c in json.load(f)['fwi_csvs']]
+        return fx
+
+    os.makedirs(root,exist_ok=True)
+    print('Building '+scale+' fixtures in '+root)
+    fuel_raster(fx['fuel_fp'],bounds,cfg['px'])
+    fx['fwi_csvs']=fwi_csvs(os.path.join(root,'fwi'),codes,cfg['fwi_rows'],scen_ls)
+    cmip_cubes(fx['cmip_dir'],years,cfg['lat'],cfg['lon'])
+    sheet_inputs(fx['data_dir'],sorted(set(sum(fx['cal_sheets'],[]))))
+    with open(fx['ssim_fp'],'wb') as f:
+        f.write(b'')
+    with open(done_fp,'w') as f:
+        json.dump({'scale':scale,'cfg':cfg,'fwi_csvs':fx['fwi_csvs']},f)
+    return fx
@@ -0,0 +1,117 @@
+#Stand-in for the parts of pysyncrosim that SED_calval.py uses (Session,
+#library, projects, scenarios, datasheets, save_datasheet and run), so the SED
+#tuning loop can be benchmarked without SyncroSim. Instead of running BP3+,
+#run() draws fire sizes from a simple model where the mean fire size grows with
+#the average SED of the saved distribution:
+#
+#   area = FS_BASE * sheet_factor * SED_mu**FS_EXP * lognormal noise
+#
+#The noise is seeded on the sheet and iteration range, so rerunning the same
+#iterations with another SED only changes the SED term, as with BP3+ on a fixed
+#seed. Set SECONDS_PER_IT to add a fixed cost per iteration. Put in
+#sys.modules['pysyncrosim'] before SED_calval is imported, see run_bench.py.
+
+import numpy as np
+import pandas as pd
+import zlib
+import time
+import os
+
+FS_BASE=400
+FS_EXP=1.2
+#Sigma of the lognormal noise (mean 1)
+FS_SIGMA=1
+SECONDS_PER_IT=0
+
+#Datasheets of the template scenario, as SED_calval expects them
+_TEMPLATE={'burnP3Plus_LandscapeRasters':['ElevationGridFileName','FuelGridFileName'],
+           'burnP3Plus_ProbabilisticIgnitionLocation':['Season','Cause','IgnitionGridFileName'],
+           'burnP3Plus_RunControl':['MinimumIteration','MaximumIteration'],
+           'burnP3Plus_WeatherStream':[],
+           'burnP3Plus_DistributionValue':['Name','Value','RelativeFrequency']}
+_ONE_ROW=['burnP3Plus_LandscapeRasters','burnP3Plus_RunControl']
+
+
+def sheet_factor(fuel_fp):
+    #Fixed multiplier between .5 and 1.5 for a sheet, from its fuel raster name
+    return .5+(zlib.crc32(os.path.basename(fuel_fp).encode())%1000)/1000
+
+def fire_size(fuel_fp,SED_mu):
+    #Expected fire size of a sheet for an average SED
+    return FS_BASE*sheet_factor(fuel_fp)*SED_mu**FS_EXP
+
+def _dist_mean(dist,name):
+    d=dist[dist['Name']==name]
+    return float((d['Value']*d['RelativeFrequency']).sum()/d['RelativeFrequency'].sum())
+
+
+class Session:
+    def __init__(self,location=None,silent=True,**kwargs):
+        self.location=location
+
+class Library:
+    def __init__(self,name):
+        self.name=name
+        self.info=pd.DataFrame({'Property':['Name:','Temporary files:'],
+                                'Value':[os.path.basename(name),name+'.temp']})
+
+    def projects(self,pid=1):
+        return Project(self)
+
+class Project:
+    def __init__(self,lib):
+        self.lib=lib
+
+    def scenarios(self,sid=1):
+        return Scenario(self.lib)
+
+class Scenario:
+    def __init__(self,lib):
+        self.lib=lib
+        self._sheets={}
+        for name,cols in _TEMPLATE.items():
+            self._sheets[name]=pd.DataFrame({c:[None] if name in _ONE_ROW else [] for c in cols},dtype=object)
+
+    def datasheets(self,name):
+        return self._sheets[name].copy()
+
+    def save_datasheet(self,name,data):
+        if name=='burnP3Plus_LandscapeRasters' and not os.path.isfile(data.loc[0,'FuelGridFileName']):
+            raise RuntimeError('Fuel grid not found')
+        self._sheets[name]=data.copy()
+
+    def run(self,jobs=None):
+        fuel_fp=self._sheets['burnP3Plus_LandscapeRasters'].loc[0,'FuelGridFileName']
+        dist=self._sheets['burnP3Plus_DistributionValue']
+        rc=self._sheets['burnP3Plus_RunControl']
+        it_start=int(rc.loc[0,'MinimumIteration'])
+        it_num=int(rc.loc[0,'MaximumIteration'])
+        n_its=it_num-it_start+1
+        n_ign=max(1,int(round(_dist_mean(dist,'Igns'))))
+        if SECONDS_PER_IT>0:
+            time.sleep(SECONDS_PER_IT*n_its)
+
+        seed=zlib.crc32(os.path.basename(fuel_fp).encode())
+        rng=np.random.default_rng([seed,it_start,it_num])
+        noise=rng.lognormal(-FS_SIGMA**2/2,FS_SIGMA,n_its*n_ign)
+        area=fire_size(fuel_fp,_dist_mean(dist,'SED'))*noise
+        stats=pd.DataFrame({'Iteration':np.repeat(np.arange(it_start,it_num+1),n_ign),
+                            'FireID':np.arange(len(area))+1,'Area':area})
+
+        #Placeholder burn probability map for SED_calval to copy
+        summ_dir=os.path.join(self.lib.name+'.temp','summary')
+        os.makedirs(summ_dir,exist_ok=True)
+        with open(os.path.join(summ_dir,'bp.tif'),'wb') as f:
+            f.write(b'')
+        return Result({'burnP3Plus_OutputBurnProbability':pd.DataFrame({'FileName':['bp.tif']}),
+                       'burnP3Plus_OutputFireStatistic':stats})
+
+class Result:
+    def __init__(self,sheets):
+        self._sheets=sheets
+
+    def datasheets(self,name):
+        return self._sheets[name].copy()
+
+def library(name,session=None,**kwargs):
+    return Library(name)
@@ -0,0 +1,261 @@
+#Times each stage of the BP3+ input pipeline on the synthetic fixtures from
+#fixtures.py, at one or more scales, and compares the times with the baselines
+#stored for this machine in baselines.json. A stage is flagged as a regression
+#if it is more than --tol slower than its baseline. Run from the repo folder,
+#
+#   python benchmarks/run_bench.py --scales small medium
+#   python benchmarks/run_bench.py --save            (store new baselines)
+#
+#Exits with 1 if anything regressed. The calibration stages run SED_calval with
+#mock_syncrosim.py in place of pysyncrosim, sheets one after another.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+BENCH_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR,'..'))
+sys.path.append(os.path.join(BENCH_DIR,'..','CC data'))
+import fixtures
+
+BASELINE_FP=os.path.join(BENCH_DIR,'baselines.json')
+
+
+#Each stage takes the fixtures and an empty output folder and returns the
+#function that is timed, so setup (e.g. a fresh store) isn't counted
+
+def _ztp(fx,out_dir):
+    from ztp_funcs import ztp_dist_batch, write_sheet_csvs
+    codes=list(fx['nts']['NTS_SNRC'])
+    mu=np.random.default_rng(0).uniform(1,8,len(codes))
+    for code in codes:
+        os.makedirs(os.path.join(out_dir,code))
+    def run():
+        ztp_df=ztp_dist_batch(mu,keys=codes,name='SED')
+        write_sheet_csvs(ztp_df,os.path.join(out_dir,'{0}','sed_dist_{0}.csv'),'sp_ev_days')
+    return run
+
+def _ign_counts(fx,out_dir):
+    from ign_counts import join_points, count_points
+    #Fresh copies so the spatial index is built inside the timed part
+    zone_sets={'nts':fx['nts'].copy(),'H':fx['buff']['H'].copy(),'L':fx['buff']['L'].copy()}
+    def run():
+        hits=join_points(fx['pnts'],zone_sets)
+        for name,zones in zone_sets.items():
+            count_points(hits[name],len(zones),years=(2010,2020))
+            count_points(hits[name],len(zones),years=(2010,2020),min_size=200,by=['CAUSE'])
+    return run
+
+def _fuel_counts(fx,out_dir):
+    from zonal_counts import zonal_fuel_counts
+    zone_sets={'nts':fx['nts'],'H':fx['buff']['H'],'L':fx['buff']['L']}
+    return lambda:zonal_fuel_counts(fx['fuel_fp'],zone_sets,block_size=2048)
+
+def _ecozone_weights(fx,out_dir):
+    from ecozone_weights import area_matrix, weighted_mean, argmax_zone, point_zone
+    nts=fx['nts'].copy()
+    ez=fx['ez'].copy()
+    def run():
+        A=area_matrix(nts,ez)
+        weighted_mean(A,ez['fs_mu'].values)
+        argmax_zone(A)
+        point_zone(fx['pnts'].geometry,ez)
+    return run
+
+def _fwi_ingest(fx,out_dir):
+    from fwi_store import ingest
+    return lambda:ingest(fx['fwi_csvs'],os.path.join(out_dir,'store'))
+
+def _fwi_threshold(fx,out_dir):
+    from fwi_store import ingest, exceedance, write_thresholded
+    store_dir=os.path.join(out_dir,'store')
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest(fx['fwi_csvs'],store_dir)
+    thr=pd.Series(np.random.default_rng(0).uniform(10,25,len(fx['nts'])),index=fx['nts']['NTS_SNRC'])
+    def run():
+        exceedance(store_dir,thr)
+        write_thresholded(store_dir,thr,os.path.join(out_dir,'{0}','fwi_cf_era_NTS_SNRC_{0}_{1}.csv'))
+    return run
+
+def _aggregate_year(fx,out_dir):
+    #Each yearly cube stands in for one model's download of the same year
+    from PCIC_fetch import mod_ls, greg_mod_ls
+    from PCIC_aggregate import aggregate_year
+    mod=next(m for m in mod_ls if m not in greg_mod_ls)
+    year=fx['cmip_years'][0]
+    fp_ls=[(os.path.join(fx['cmip_dir'],str(y)+'_mean.nc'),mod,year) for y in fx['cmip_years']]
+    out_fps={stat:os.path.join(out_dir,stat+'.nc') for stat in ['tot','mean','std']}
+    return lambda:aggregate_year(fp_ls,year,'pr',out_fps,block_rows=16)
+
+def _cmip_climatology(fx,out_dir):
+    from CMIP_climatology import build_store, period_mean
+    store_fp=os.path.join(out_dir,'pr.npy')
+    years=fx['cmip_years']
+    def run():
+        build_store(fx['cmip_dir'],years,store_fp)
+        period_mean(store_fp,years[0],years[-1])
+        period_mean(store_fp,years[len(years)//2],years[-1])
+    return run
+
+def _cmip_regrid(fx,out_dir):
+    from CMIP_climatology import build_store, period_mean
+    from regrid_weights import regrid
+    store_fp=os.path.join(out_dir,'pr.npy')
+    years=fx['cmip_years']
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_store(fx['cmip_dir'],years,store_fp)
+    da=period_mean(store_fp,years[0],years[-1])
+    #ERA5-like target grid at about twice the resolution
+    dst_y=np.linspace(84,40,2*len(da['lat']))
+    dst_x=np.linspace(-142,-51,2*len(da['lon']))
+    return lambda:regrid(da.sel(time=[15]),dst_y,dst_x,os.path.join(out_dir,'weights'))
+
+def _calval(fx,out_dir):
+    #SED_calval pointed at the fixture sheets, with empty caches
+    import mock_syncrosim
+    sys.modules['pysyncrosim']=mock_syncrosim
+    import SED_calval
+    SED_calval.DATA_DIR=fx['data_dir']
+    SED_calval.SSIM_FP=os.path.join(out_dir,'NTS_template.ssim')
+    shutil.copyfile(fx['ssim_fp'],SED_calval.SSIM_FP)
+    for name in ['STATS_DIR','BP_DIR','CACHE_DIR']:
+        setattr(SED_calval,name,os.path.join(out_dir,name.lower()))
+    SED_calval._scen_pool.clear()
+    SED_calval._csv_cache.clear()
+    #Target fire size of each ecozone is what the mock gives at an SED of 3.3
+    fs_ls=[]
+    for sheets in fx['cal_sheets']:
+        fuel_fps=[fx['data_dir']+'/NARR_weather_csvs/NTS_SNRC_'+c+'/Fuel_NTS_SNRC_'+c+'.tif' for c in sheets]
+        fs_ls.append(np.mean([mock_syncrosim.fire_size(fp,3.3) for fp in fuel_fps]))
+    return SED_calval,fs_ls
+
+def _calibrate_sed(fx,out_dir):
+    SED_calval,fs_ls=_calval(fx,out_dir)
+    def run():
+        for sheets,fs in zip(fx['cal_sheets'],fs_ls):
+            SED_calval.calibrate_sed(sheets,fs,2,adaptive=True)
+    return run
+
+def _run_test_nts(fx,out_dir):
+    SED_calval,fs_ls=_calval(fx,out_dir)
+    def run():
+        for sheets,fs in zip(fx['cal_sheets'],fs_ls):
+            SED_calval.run_test_nts(sheets,2,fs)
+    return run
+
+STAGES={'ztp_dist':_ztp,'ign_counts':_ign_counts,'fuel_counts':_fuel_counts,
+        'ecozone_weights':_ecozone_weights,'fwi_ingest':_fwi_ingest,'fwi_threshold':_fwi_threshold,
+        'aggregate_year':_aggregate_year,'cmip_climatology':_cmip_climatology,'cmip_regrid':_cmip_regrid,
+        'calibrate_sed':_calibrate_sed,'run_test_nts':_run_test_nts}
+
+
+def time_stage(stage,fx,repeat=3):
+    """
+    Best of repeat runs of a stage, each with a fresh output folder.
+
+    Returns
+    -------
+    t : float
+        Seconds.
+    """
+    t_ls=[]
+    for r in range(repeat):
+        out_dir=tempfile.mkdtemp(prefix='bp3_bench_')
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                fn=STAGES[stage](fx,out_dir)
+                t0=time.perf_counter()
+                fn()
+                t_ls.append(time.perf_counter()-t0)
+        finally:
+            shutil.rmtree(out_dir,ignore_errors=True)
+    return min(t_ls)
+
+def load_baselines(fp=BASELINE_FP):
+    if not os.path.isfile(fp):
+        return {}
+    with open(fp) as f:
+        return json.load(f)
+
+def save_baselines(base,fp=BASELINE_FP):
+    tmp_fp=fp+'.tmp'
+    with open(tmp_fp,'w') as f:
+        json.dump(base,f,indent=1,sort_keys=True)
+    os.replace(tmp_fp,fp)
+
+def compare(res_df,base,tol=.25,min_diff=.05):
+    """
+    Adds the baseline time, ratio and a regression flag to the results.
+    Differences under min_diff seconds are never flagged, as very short
+    stages are mostly noise.
+
+    Parameters
+    ----------
+    res_df : DataFrame
+        'stage', 'scale' and 'seconds'.
+    base : dict
+        Baselines of this machine, stage -> scale -> seconds.
+    tol : float, optional
+        Allowed slow down. The default is .25 (25%).
+    min_diff : float, optional
+        Seconds. The default is .05.
+
+    Returns
+    -------
+    res_df : DataFrame
+    """
+    res_df=res_df.copy()
+    res_df['baseline']=[base.get(s,{}).get(c,np.nan) for s,c in zip(res_df['stage'],res_df['scale'])]
+    res_df['ratio']=res_df['seconds']/res_df['baseline']
+    res_df['regression']=(res_df['ratio']>1+tol)&(res_df['seconds']-res_df['baseline']>min_diff)
+    return res_df
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Benchmark the BP3+ input stages on synthetic fixtures.')
+    parser.add_argument('--scales',nargs='+',default=['small'],choices=list(fixtures.SCALES))
+    parser.add_argument('--stages',nargs='+',default=list(STAGES),choices=list(STAGES))
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--tol',type=float,default=.25,help='allowed slow down before flagging, .25 is 25%%')
+    parser.add_argument('--work-dir',default=os.path.join(tempfile.gettempdir(),'bp3_bench_fixtures'),
+                        help='folder for the fixtures, reused between runs')
+    parser.add_argument('--machine',default=platform.node(),help='baseline key, the default is the host name')
+    parser.add_argument('--baselines',default=BASELINE_FP)
+    parser.add_argument('--save',action='store_true',help='store these times as the new baselines')
+    args=parser.parse_args(argv)
+
+    rec_ls=[]
+    for scale in args.scales:
+        fx=fixtures.build(scale,args.work_dir)
+        for stage in args.stages:
+            t=time_stage(stage,fx,args.repeat)
+            print('%-18s %-7s %8.3f s'%(stage,scale,t))
+            rec_ls.append({'stage':stage,'scale':scale,'seconds':t})
+
+    base=load_baselines(args.baselines)
+    res_df=compare(pd.DataFrame(rec_ls),base.get(args.machine,{}),args.tol)
+    print()
+    print(res_df.to_string(index=False,float_format='%.3f'))
+    if args.save:
+        mach=base.setdefault(args.machine,{})
+        for rec in rec_ls:
+            mach.setdefault(rec['stage'],{})[rec['scale']]=round(rec['seconds'],4)
+        save_baselines(base,args.baselines)
+        print('Saved baselines for '+args.machine)
+        return 0
+    if res_df['regression'].any():
+        print('Regressions: '+', '.join(res_df.loc[res_df['regression'],'stage']+'/'+res_df.loc[res_df['regression'],'scale']))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
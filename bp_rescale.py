@@ -0,0 +1,161 @@
+#Post-processing for the BP3+ burn probability rasters. Sheets with a mean
+#ignition number below 1 are run with 1 ignition and their burn probability
+#scaled down afterwards (see SED_calval.run_BP3). The rescaling here is done one
+#block at a time into a tiled, DEFLATE compressed GeoTIFF that replaces the
+#original only once complete, and many sheets can be done at once. For the
+#national product the scale factors can instead be folded into a VRT mosaic of
+#all the BP_*.tif outputs, so the sheet rasters don't need rewriting at all.
+
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+from xml.sax.saxutils import escape
+import multiprocessing as mp
+import os
+
+#Creation options for the rescaled GeoTIFFs
+GTIFF_OPTS={'driver':'GTiff','tiled':True,'blockxsize':256,'blockysize':256,
+            'compress':'deflate','zlevel':6,'BIGTIFF':'IF_SAFER'}
+
+
+def rescale_raster(src_fp,scale,dst_fp=None,block_rows=1024):
+    """
+    Multiplies a single band raster by scale, reading and writing block_rows
+    rows at a time. Nodata pixels are left as they are. The output is written
+    to a temp file and renamed into place, so an interrupted run never leaves
+    a half written raster.
+
+    Parameters
+    ----------
+    src_fp : string
+        Burn probability raster.
+    scale : float
+        Scale factor, e.g. the ign_rescaling of the sheet.
+    dst_fp : string, optional
+        Output file. The default is None, which replaces src_fp.
+    block_rows : integer, optional
+        Rows read/written at a time. The default is 1024.
+
+    Returns
+    -------
+    dst_fp : string
+    """
+    if dst_fp==None:
+        dst_fp=src_fp
+    tmp_fp=dst_fp+'.tmp.tif'
+    with rio.open(src_fp) as src:
+        profile=src.profile.copy()
+        profile.update(GTIFF_OPTS)
+        #Horizontal differencing for ints, floating point predictor for floats
+        profile['predictor']=3 if np.issubdtype(np.dtype(src.dtypes[0]),np.floating) else 2
+        nodata=src.nodata
+        try:
+            with rio.open(tmp_fp,'w',**profile) as dst:
+                for r0 in range(0,src.height,block_rows):
+                    win=Window(0,r0,src.width,min(block_rows,src.height-r0))
+                    data=src.read(1,window=win)
+                    out=data*scale
+                    if nodata!=None:
+                        out=np.where((data==nodata)|(np.isnan(nodata) and np.isnan(data)),data,out)
+                    dst.write(out.astype(data.dtype),1,window=win)
+        except:
+            if os.path.isfile(tmp_fp):
+                os.remove(tmp_fp)
+            raise
+    os.replace(tmp_fp,dst_fp)
+    return dst_fp
+
+def _rescale_job(args):
+    return rescale_raster(*args)
+
+def rescale_many(job_ls,n_workers=4):
+    """
+    Rescales many rasters at the same time.
+
+    Parameters
+    ----------
+    job_ls : list of tuple
+        (src_fp, scale) or (src_fp, scale, dst_fp) for each raster.
+    n_workers : integer, optional
+        Number of rasters done at the same time. The default is 4.
+
+    Returns
+    -------
+    fp_ls : list of string
+        Output files, same order as job_ls.
+    """
+    if n_workers==1:
+        return [_rescale_job(job) for job in job_ls]
+    with mp.Pool(n_workers) as pool:
+        return pool.map(_rescale_job,job_ls)
+
+def build_vrt(fp_ls,vrt_fp,scales=None):
+    """
+    Writes a VRT mosaic of sheet rasters. Each sheet can have its own scale
+    factor (ScaleRatio), so rescaled burn probability is read straight from
+    the original outputs. All rasters must share the same CRS and pixel size.
+
+    Parameters
+    ----------
+    fp_ls : list of string
+        Rasters to mosaic, e.g. all the BP_*.tif outputs. Where sheets
+        overlap the later one in the list is on top.
+    vrt_fp : string
+        Output .vrt file.
+    scales : dict, optional
+        File path -> scale factor. Rasters not in here are not scaled. The
+        default is None.
+
+    Returns
+    -------
+    vrt_fp : string
+    """
+    if scales==None:
+        scales={}
+    meta_ls=[]
+    for fp in fp_ls:
+        with rio.open(fp) as src:
+            meta_ls.append((fp,src.bounds,src.width,src.height,src.res,src.crs,src.nodata))
+    res=meta_ls[0][4]
+    crs=meta_ls[0][5]
+    for fp,bounds,w,h,r,c,nd in meta_ls:
+        assert np.allclose(r,res) and c==crs, fp+" has a different pixel size or CRS"
+    left=min(m[1].left for m in meta_ls)
+    top=max(m[1].top for m in meta_ls)
+    right=max(m[1].right for m in meta_ls)
+    bottom=min(m[1].bottom for m in meta_ls)
+    width=int(round((right-left)/res[0]))
+    height=int(round((top-bottom)/res[1]))
+    nodata=meta_ls[0][6]
+
+    vrt_dir=os.path.dirname(os.path.abspath(vrt_fp))
+    lines=['<VRTDataset rasterXSize="%d" rasterYSize="%d">'%(width,height),
+           '  <SRS>'+escape(crs.to_wkt())+'</SRS>',
+           '  <GeoTransform>%r, %r, 0.0, %r, 0.0, %r</GeoTransform>'%(left,res[0],top,-res[1]),
+           '  <VRTRasterBand dataType="Float32" band="1">']
+    if nodata!=None:
+        lines.append('    <NoDataValue>%r</NoDataValue>'%nodata)
+    for fp,bounds,w,h,r,c,nd in meta_ls:
+        x_off=int(round((bounds.left-left)/res[0]))
+        y_off=int(round((top-bounds.top)/res[1]))
+        try:
+            src_name,rel=os.path.relpath(os.path.abspath(fp),vrt_dir),1
+        except ValueError:
+            #Different drive to the VRT
+            src_name,rel=os.path.abspath(fp),0
+        lines+=['    <ComplexSource>',
+                '      <SourceFilename relativeToVRT="%d">'%rel+escape(src_name)+'</SourceFilename>',
+                '      <SourceBand>1</SourceBand>',
+                '      <SrcRect xOff="0" yOff="0" xSize="%d" ySize="%d" />'%(w,h),
+                '      <DstRect xOff="%d" yOff="%d" xSize="%d" ySize="%d" />'%(x_off,y_off,w,h)]
+        if nd!=None:
+            lines.append('      <NODATA>%r</NODATA>'%nd)
+        lines.append('      <ScaleRatio>%r</ScaleRatio>'%float(scales.get(fp,1)))
+        lines.append('    </ComplexSource>')
+    lines+=['  </VRTRasterBand>','</VRTDataset>']
+
+    tmp_fp=vrt_fp+'.tmp'
+    with open(tmp_fp,'w') as f:
+        f.write('\n'.join(lines)+'\n')
+    os.replace(tmp_fp,vrt_fp)
+    return vrt_fp
@@ -0,0 +1,371 @@
+#Incremental build of the per-sheet BP3+ input bundles (ign dist, SED dist,
+#thresholded weather stream and probabilistic ign grids) in BP3Inputs/<sheet>.
+#The inputs each sheet depends on (its ign number, its SED average from the
+#tuned ecozone SEDs, its FWI cutoff, the stored weather and the ign grid files)
+#are gathered into a small spec and hashed. Only sheets whose hash differs from
+#the one in the build manifest are rewritten, so e.g. changing one ecozone's
+#tuned SED only rebuilds the sheets that overlap that ecozone. Sheets are written
+#in a process pool, each into a temp folder first and then moved into place,
+#and the manifest is only updated for sheets that finished. Bundles of sheets no
+#longer being built are removed. Replaces the csv
+#writing cells of BP3Plus_igns.ipynb and BP3Plus_SED.ipynb and the thresholded
+#weather cell of BP3Plus_SED.ipynb.
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import multiprocessing as mp
+import tempfile
+import shutil
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import calval_cache
+from ztp_funcs import ztp_dist
+from ecozone_weights import load_area_matrix, weighted_mean, argmax_zone
+from fwi_store import BASELINE, write_thresholded
+
+#Bump when the writers change so every sheet is rebuilt
+BUILD_VERSION=2
+#File names in a bundle, {0} is the NTS code. Same names as the notebooks wrote
+FILE_FMT={'ign':'ign_dist_{0}.csv','sed':'sed_dist_{0}.csv','fwi':'fwi_era_cf_NTS_SNRC_{0}.csv'}
+#Probabilistic ign grids, copied in if a sheet has all four
+IGN_GRID_PRE=['H_Spring_','H_Summer_','L_Spring_','L_Summer_']
+MANIFEST='_build_manifest.json'
+BUNDLE='_bundle.json'
+
+#Inputs, as in the SED and ign notebooks
+NTS_FP="C:\\Users\\GiovanniCorti\\Downloads\\nts_snrc\\nts_snrc_250k.shp"
+EZ_FP_LS=["C:\\Users\\GiovanniCorti\\Downloads\\ecozone_shp\\Ecozones\\ecozones.shp",
+          "C:\\Users\\GiovanniCorti\\Documents\\BSW.shp","C:\\Users\\GiovanniCorti\\Documents\\BSE.shp"]
+IGN_FP="C:\\Users\\GiovanniCorti\\Documents\\Wildfire\\ign_test_2.shp"
+SED_V2_FP="C:\\Users\\GiovanniCorti\\Documents\\Wildfire\\SED_v2.shp"
+FWI_CF_FP="C:\\Users\\GiovanniCorti\\Documents\\Wildfire\\FWI_cf.shp"
+#Tuned SED per ecozone (ZONE_NAME, SED columns), e.g. from SED_calval.run_EZs
+TUNED_SED_FP="C:\\Users\\GiovanniCorti\\Documents\\Wildfire\\tuned_sed_ez.csv"
+AREA_CACHE_DIR="C:\\Users\\GiovanniCorti\\Documents\\Wildfire\\area_cache"
+FWI_STORE_DIR="C:\\Users\\GiovanniCorti\\Documents\\Wildfire\\fwi_store"
+IGN_GRID_DIR="Y:\\client-data\\demo_projects\\climate85\\Working_data\\NARR_weather_csvs"
+OUT_DIR="C:\\Users\\GiovanniCorti\\Desktop\\BP3Inputs"
+
+
+def sheet_sed(A_ez,tuned_sed,sed_norm,sed_min=1,sed_max=7):
+    """
+    SED average of each sheet: the area-weighted tuned SED of the ecozones it
+    overlaps (at least sed_min) times the sheet's SED relative to its
+    ecozone average, clipped to sed_min-sed_max (see BP3Plus_SED.ipynb).
+
+    Parameters
+    ----------
+    A_ez : scipy.sparse.csr_matrix
+        Sheet x ecozone areas, from ecozone_weights.load_area_matrix.
+    tuned_sed : array
+        Tuned SED for each ecozone (column of A_ez), NaN if not tuned.
+    sed_norm : array
+        SED_sm of each sheet over the mean SED_sm of its dominant ecozone.
+    sed_min, sed_max : float, optional
+        SED limits. Large SEDs can crash BP3+. The defaults are 1 and 7.
+
+    Returns
+    -------
+    sed_mu : numpy array
+        NaN where a sheet has no tuned ecozone or no sed_norm.
+    """
+    sed=weighted_mean(A_ez,tuned_sed)
+    with np.errstate(invalid='ignore'):
+        sed=np.where(sed<sed_min,sed_min,sed)
+        return np.clip(sed*np.asarray(sed_norm,dtype=np.float64),sed_min,sed_max)
+
+def _num(x):
+    #Float for the spec, None for NaN/missing
+    return None if x is None or pd.isna(x) else float(x)
+
+def _spec(NTS_code,ign_num,sed_mu,fwi_cf,store_dir,scenario,ign_grid_dir):
+    spec={'NTS_SNRC':NTS_code,'ign_num':ign_num,'sed_mu':sed_mu,'fwi_cf':fwi_cf,
+          'store_dir':store_dir,'scenario':scenario,'fwi_part':None,'ign_grids':[]}
+    if store_dir!=None and fwi_cf!=None:
+        part_fp=os.path.join(store_dir,'NTS_SNRC='+NTS_code,'scenario='+scenario,'part-0.parquet')
+        if os.path.isfile(part_fp):
+            spec['fwi_part']=calval_cache.file_sig(part_fp)
+    if ign_grid_dir!=None:
+        grid_fps=[os.path.join(ign_grid_dir,'NTS_SNRC_'+NTS_code,pre+'NTS_SNRC_'+NTS_code+'.tif') for pre in IGN_GRID_PRE]
+        if all(map(os.path.isfile,grid_fps)):
+            spec['ign_grids']=[calval_cache.file_sig(fp) for fp in grid_fps]
+    spec['key']=calval_cache.hash_inputs(BUILD_VERSION,FILE_FMT,spec)
+    return spec
+
+def plan(NTS_ls,ign_num=None,sed_mu=None,fwi_cf=None,store_dir=None,scenario=BASELINE,
+         ign_grid_dir=None,n_threads=8):
+    """
+    Gathers the inputs of each sheet's bundle into a spec, keyed by a hash
+    of the spec. Tables (ign numbers, SEDs, cutoffs) go in by value, the
+    weather and ign grids by file signature (path, size and modification
+    time, see calval_cache.file_sig) so large files aren't reread.
+
+    Parameters
+    ----------
+    NTS_ls : list of string
+        Sheets to build.
+    ign_num : Series, optional
+        Average igns per iteration indexed by NTS code. Sheets not in here
+        (or NaN) get no ign dist. The default is None.
+    sed_mu : Series, optional
+        SED average indexed by NTS code, e.g. from sheet_sed. The default is
+        None.
+    fwi_cf : Series, optional
+        FWI cutoff indexed by NTS code. The default is None.
+    store_dir : string, optional
+        FWI store (see fwi_store.py) to take the weather from. The default
+        is None (no weather).
+    scenario : string, optional
+        Weather scenario. The default is BASELINE.
+    ign_grid_dir : string, optional
+        Folder with a NTS_SNRC_<code> sub folder of ign grids per sheet. The
+        default is None (no ign grids).
+    n_threads : integer, optional
+        Number of sheets whose files are checked at the same time, as they
+        are mostly on network drives. The default is 8.
+
+    Returns
+    -------
+    specs : dict
+        NTS code -> spec dict, with the hash under 'key'.
+    """
+    args=[(NTS_code,
+           None if ign_num is None else _num(ign_num.get(NTS_code)),
+           None if sed_mu is None else _num(sed_mu.get(NTS_code)),
+           None if fwi_cf is None else _num(fwi_cf.get(NTS_code)),
+           store_dir,scenario,ign_grid_dir) for NTS_code in NTS_ls]
+    with ThreadPoolExecutor(max_workers=n_threads) as ex:
+        spec_ls=list(ex.map(lambda a:_spec(*a),args))
+    return {spec['NTS_SNRC']:spec for spec in spec_ls}
+
+def _ign_dist(ign_num):
+    #Two values (0 or 1) below 1 ign, ztp dist above, as in BP3Plus_igns.ipynb
+    if ign_num<1:
+        return pd.DataFrame({'ign_per_it':[0,1],'pct':[100-np.round(ign_num*100,2),np.round(ign_num*100,2)]})
+    ztp_df=ztp_dist('Igns',ign_num)
+    return pd.DataFrame({'ign_per_it':ztp_df['Value'],'pct':np.round(ztp_df['RelativeFrequency']*100,2)})
+
+def _sed_dist(sed_mu):
+    ztp_df=ztp_dist('SED',sed_mu)
+    return pd.DataFrame({'sp_ev_days':ztp_df['Value'],'pct':np.round(ztp_df['RelativeFrequency']*100,2)})
+
+def build_sheet(spec,out_dir):
+    """
+    Writes one sheet's bundle. Files are written to a temp folder inside
+    the sheet folder and moved into place once all are done, then the
+    sheet's _bundle.json is written. Files of an older bundle that aren't
+    part of the new one are removed. Other files in the sheet folder (e.g.
+    climate scenario dists) are left alone.
+
+    Parameters
+    ----------
+    spec : dict
+        From plan.
+    out_dir : string
+        Folder with a sub folder per sheet.
+
+    Returns
+    -------
+    fn_ls : list of string
+        File names in the bundle.
+    """
+    NTS_code=spec['NTS_SNRC']
+    sheet_dir=os.path.join(out_dir,NTS_code)
+    os.makedirs(sheet_dir,exist_ok=True)
+    tmp_dir=tempfile.mkdtemp(prefix='.build_',dir=sheet_dir)
+    try:
+        if spec['ign_num']!=None:
+            _ign_dist(spec['ign_num']).to_csv(os.path.join(tmp_dir,FILE_FMT['ign'].format(NTS_code)),index=False)
+        if spec['sed_mu']!=None:
+            _sed_dist(spec['sed_mu']).to_csv(os.path.join(tmp_dir,FILE_FMT['sed'].format(NTS_code)),index=False)
+        if spec['fwi_part']!=None:
+            write_thresholded(spec['store_dir'],pd.Series({NTS_code:spec['fwi_cf']}),
+                              os.path.join(tmp_dir,FILE_FMT['fwi']),scenario=spec['scenario'],n_threads=1)
+        for fp,size,mtime in spec['ign_grids']:
+            shutil.copyfile(fp,os.path.join(tmp_dir,os.path.basename(fp)))
+
+        fn_ls=sorted(os.listdir(tmp_dir))
+        bundle_fp=os.path.join(sheet_dir,BUNDLE)
+        old_ls=[]
+        if os.path.isfile(bundle_fp):
+            with open(bundle_fp) as f:
+                old_ls=json.load(f).get('files',[])
+        #Old bundle is invalid from here until the new _bundle.json is in place
+        if os.path.isfile(bundle_fp):
+            os.remove(bundle_fp)
+        for fn in fn_ls:
+            os.replace(os.path.join(tmp_dir,fn),os.path.join(sheet_dir,fn))
+        for fn in set(old_ls)-set(fn_ls):
+            if os.path.isfile(os.path.join(sheet_dir,fn)):
+                os.remove(os.path.join(sheet_dir,fn))
+        tmp_fp=os.path.join(tmp_dir,BUNDLE)
+        with open(tmp_fp,'w') as f:
+            json.dump({'key':spec['key'],'spec':spec,'files':fn_ls,'built':time.time()},f,indent=1)
+        os.replace(tmp_fp,bundle_fp)
+    finally:
+        shutil.rmtree(tmp_dir,ignore_errors=True)
+    return fn_ls
+
+def remove_sheet(NTS_code,out_dir,fn_ls):
+    """
+    Removes a sheet's bundle: its _bundle.json first, so the bundle is
+    never half there but still marked complete, then the bundle files. The
+    sheet folder is removed if nothing else is left in it.
+
+    Parameters
+    ----------
+    NTS_code : string
+        Code/name for the NTS sheet.
+    out_dir : string
+        Folder with a sub folder per sheet.
+    fn_ls : list of string
+        File names in the bundle, from the build manifest.
+
+    Returns
+    -------
+    """
+    sheet_dir=os.path.join(out_dir,NTS_code)
+    for fn in [BUNDLE]+list(fn_ls):
+        if os.path.isfile(os.path.join(sheet_dir,fn)):
+            os.remove(os.path.join(sheet_dir,fn))
+    if os.path.isdir(sheet_dir) and len(os.listdir(sheet_dir))==0:
+        os.rmdir(sheet_dir)
+
+def _build_job(args):
+    spec,out_dir=args
+    try:
+        return spec['NTS_SNRC'],build_sheet(spec,out_dir),None
+    except Exception as e:
+        return spec['NTS_SNRC'],None,repr(e)
+
+def build(specs,out_dir=OUT_DIR,n_workers=4,force=False,verify=False,prune=True):
+    """
+    Rebuilds the bundles whose spec changed since the last build and, with
+    prune, removes the bundles of sheets in the manifest that are no longer
+    in specs.
+
+    Parameters
+    ----------
+    specs : dict
+        From plan.
+    out_dir : string, optional
+        Folder with a sub folder per sheet. The build manifest is kept here.
+        The default is OUT_DIR.
+    n_workers : integer, optional
+        Number of sheets written at the same time. The default is 4.
+    force : bool, optional
+        Rebuild every sheet. The default is False.
+    verify : bool, optional
+        Also rebuild sheets whose _bundle.json is missing or doesn't match
+        the manifest, e.g. after files were deleted by hand. Reads one file
+        per sheet. The default is False.
+    prune : bool, optional
+        Remove the bundles of sheets that were built before but aren't in
+        specs, e.g. sheets that no longer have igns. Only files listed in
+        the manifest are removed. Set to False when specs only holds some of
+        the sheets. The default is True.
+
+    Returns
+    -------
+    res : dict
+        'built' (list of NTS codes), 'skipped' (number of up to date sheets),
+        'removed' (list of NTS codes) and 'failed' (NTS code -> error).
+    """
+    os.makedirs(out_dir,exist_ok=True)
+    man_fp=os.path.join(out_dir,MANIFEST)
+    manifest={}
+    if os.path.isfile(man_fp):
+        with open(man_fp) as f:
+            manifest=json.load(f)
+
+    todo=[]
+    for NTS_code,spec in specs.items():
+        rebuild=force or manifest.get(NTS_code,{}).get('key')!=spec['key']
+        if not rebuild and verify:
+            bundle_fp=os.path.join(out_dir,NTS_code,BUNDLE)
+            if not os.path.isfile(bundle_fp):
+                rebuild=True
+            else:
+                with open(bundle_fp) as f:
+                    rebuild=json.load(f).get('key')!=spec['key']
+        if rebuild:
+            todo.append((spec,out_dir))
+    print(str(len(specs)-len(todo))+" of "+str(len(specs))+" sheets up to date, building "+str(len(todo)))
+
+    res={'built':[],'skipped':len(specs)-len(todo),'removed':[],'failed':{}}
+    pool=None
+    try:
+        if prune:
+            for NTS_code in sorted(set(manifest)-set(specs)):
+                remove_sheet(NTS_code,out_dir,manifest[NTS_code].get('files',[]))
+                del manifest[NTS_code]
+                res['removed'].append(NTS_code)
+        if n_workers==1 or len(todo)<2:
+            it=map(_build_job,todo)
+        else:
+            pool=mp.Pool(min(n_workers,len(todo)))
+            it=pool.imap_unordered(_build_job,todo,chunksize=max(1,len(todo)//(8*n_workers)))
+        for NTS_code,fn_ls,err in it:
+            if err!=None:
+                print(NTS_code,err)
+                res['failed'][NTS_code]=err
+                manifest.pop(NTS_code,None)
+            else:
+                res['built'].append(NTS_code)
+                manifest[NTS_code]={'key':specs[NTS_code]['key'],'files':fn_ls}
+    finally:
+        if pool!=None:
+            pool.close()
+            pool.join()
+        tmp_fp=man_fp+'.tmp'
+        with open(tmp_fp,'w') as f:
+            json.dump(manifest,f,indent=1,sort_keys=True)
+        os.replace(tmp_fp,man_fp)
+    return res
+
+def load_sheets(tuned_sed_fp=TUNED_SED_FP):
+    """
+    Reads the sheet level inputs the notebooks produce and works out the ign
+    number, SED average and FWI cutoff of each sheet.
+
+    Returns
+    -------
+    sheets : DataFrame
+        'NTS_SNRC', 'ign_num', 'sed_mu' and 'fwi_cf', one row per sheet.
+    """
+    df_nts=gpd.read_file(NTS_FP).to_crs(epsg=6931)
+    #Boreal shield split into east and west, as in BP3Plus_SED.ipynb
+    df_ez=pd.concat([gpd.read_file(fp) for fp in EZ_FP_LS],ignore_index=True)
+    df_ez=df_ez.drop([15]).reset_index(drop=True).to_crs(epsg=6931)
+    A_ez=load_area_matrix(df_nts,df_ez,AREA_CACHE_DIR)
+
+    #Sheet SED relative to the average of its dominant ecozone
+    sed_v2=gpd.read_file(SED_V2_FP)
+    sed_sm=pd.Series(sed_v2['SED_sm'].values,index=sed_v2['NTS_SNRC']).reindex(df_nts['NTS_SNRC'])
+    ez_idx=argmax_zone(A_ez)
+    ez_name=pd.Series(np.where(ez_idx>=0,df_ez['ZONE_NAME'].values[ez_idx],None),index=sed_sm.index)
+    sed_norm=sed_sm/sed_sm.groupby(ez_name).transform('mean')
+
+    tuned=pd.read_csv(tuned_sed_fp)
+    tuned_sed=df_ez['ZONE_NAME'].map(pd.Series(tuned['SED'].values,index=tuned['ZONE_NAME'])).values
+    sed_mu=sheet_sed(A_ez,tuned_sed,sed_norm.values)
+
+    df_ign=gpd.read_file(IGN_FP)
+    df_cf=gpd.read_file(FWI_CF_FP)
+    sheets=pd.DataFrame({'NTS_SNRC':df_nts['NTS_SNRC'].values,'sed_mu':sed_mu})
+    sheets['ign_num']=sheets['NTS_SNRC'].map(pd.Series(df_ign['ign_num'].values,index=df_ign['NTS_SNRC']))
+    sheets['fwi_cf']=sheets['NTS_SNRC'].map(pd.Series(df_cf['FWI_cf'].values,index=df_cf['NTS_SNRC']))
+    #Only sheets with igns and a SED are run
+    sheets=sheets[(sheets['ign_num']>0)&sheets['sed_mu'].notna()]
+    return sheets.drop_duplicates('NTS_SNRC').reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    sheets=load_sheets()
+    sheets=sheets.set_index('NTS_SNRC')
+    specs=plan(list(sheets.index),sheets['ign_num'],sheets['sed_mu'],sheets['fwi_cf'],
+               store_dir=FWI_STORE_DIR,ign_grid_dir=IGN_GRID_DIR)
+    print(build(specs,OUT_DIR,n_workers=4))
@@ -0,0 +1,265 @@
+#Local results cache for the SED tuning runs in SED_calval.py. Each BP3+ run is
+#stored as a small json file named after a hash of the exact scenario inputs
+#(sheet, SED/ign distributions, weather stream, rasters and iteration range) so
+#repeat runs are free and earlier runs can be used to pick better first guesses.
+#Note the template .ssim is not part of the key, so use a new cache folder if
+#the template library itself changes.
+
+import hashlib
+import json
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+
+def file_sig(fp):
+    """
+    Cheap signature for an input file (path, size and modification time),
+    used for the rasters rather than hashing multi-MB files every run.
+
+    Parameters
+    ----------
+    fp : string
+        File path.
+
+    Returns
+    -------
+    sig : list
+        [fp, size, mtime], or [fp, None, None] if the file doesn't exist.
+    """
+    try:
+        st=os.stat(fp)
+        return [fp,st.st_size,int(st.st_mtime)]
+    except OSError:
+        return [fp,None,None]
+
+def hash_inputs(*parts):
+    """
+    Hashes scenario inputs. DataFrames are hashed on their column names and
+    values, everything else on its json representation.
+
+    Parameters
+    ----------
+    *parts : DataFrames, strings, numbers or lists
+
+    Returns
+    -------
+    key : string
+        sha256 hex digest.
+    """
+    h=hashlib.sha256()
+    for p in parts:
+        if isinstance(p,pd.DataFrame):
+            h.update(json.dumps(list(map(str,p.columns))).encode())
+            h.update(pd.util.hash_pandas_object(p,index=False).values.tobytes())
+        else:
+            h.update(json.dumps(p,default=str).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+def _rec_fp(cache_dir,key):
+    return os.path.join(cache_dir,key[:2],key+'.json')
+
+def load(cache_dir,key):
+    """
+    Returns the cached record for a key, or None on a cache miss.
+    """
+    fp=_rec_fp(cache_dir,key)
+    if not os.path.isfile(fp):
+        return None
+    with open(fp) as f:
+        return json.load(f)
+
+def save(cache_dir,key,rec):
+    """
+    Writes a record for a key. The file is written under a temp name and
+    then renamed so parallel workers never see a partial record.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Cache folder.
+    key : string
+        Key from hash_inputs.
+    rec : dict
+        Record to store. Should have 'NTS_code', 'base_key', 'SED_mu',
+        'it_start', 'it_num', 'n', 'mean' and 'M2'.
+
+    Returns
+    -------
+    """
+    fp=_rec_fp(cache_dir,key)
+    os.makedirs(os.path.dirname(fp),exist_ok=True)
+    tmp_fp=fp+'.'+str(os.getpid())+'.tmp'
+    with open(tmp_fp,'w') as f:
+        json.dump(rec,f)
+    os.replace(tmp_fp,fp)
+
+def _read_records(cache_dir):
+    #Every record in the cache
+    recs=[]
+    for fp in glob.glob(os.path.join(cache_dir,'*','*.json')):
+        with open(fp) as f:
+            recs.append(json.load(f))
+    return recs
+
+def sheet_table(cache_dir,NTS_code,base_key,recs=None):
+    """
+    Summarises all cached runs of one sheet that used the same non-SED
+    inputs (base_key), merging iteration batches for the same SED average.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Cache folder.
+    NTS_code : string
+        Code/name for the NTS sheet.
+    base_key : string
+        Hash of the sheet inputs other than the SED distribution and
+        iteration range.
+    recs : list of dict, optional
+        Records already read from the cache, so several sheets can be
+        summarised from one pass over it (see sheet_tables). The default is
+        None, which reads the cache.
+
+    Returns
+    -------
+    tab : pandas.DataFrame
+        One row per SED_mu (sorted) with 'its' (iterations run), 'n' (fires),
+        'area' (total burned area), 'fs_mu' (average fire size),
+        'area_per_it' and 'fires_per_it'.
+    """
+    if recs==None:
+        recs=_read_records(cache_dir)
+    recs=[rec for rec in recs if rec['NTS_code']==NTS_code and rec['base_key']==base_key]
+    if len(recs)==0:
+        return pd.DataFrame(columns=['SED_mu','its','n','area','fs_mu','area_per_it','fires_per_it'])
+
+    df=pd.DataFrame(recs)
+    #Drop runs that repeat iterations already covered by another run with the
+    #same SED (e.g., a batch that was also part of a fixed 500 iteration run)
+    df=df.sort_values(['SED_mu','it_start','it_num'],ascending=[True,True,False])
+    keep=[]
+    prev_SED,it_covered=None,0
+    for SED_mu,it_start,it_num in zip(df['SED_mu'],df['it_start'],df['it_num']):
+        if SED_mu!=prev_SED:
+            prev_SED,it_covered=SED_mu,0
+        keep.append(bool(it_start>it_covered))
+        if keep[-1]:
+            it_covered=it_num
+    df=df[keep].copy()
+    df['its']=df['it_num']-df['it_start']+1
+    df['area']=df['n']*df['mean']
+    tab=df.groupby('SED_mu')[['its','n','area']].sum().reset_index()
+    tab['fs_mu']=tab['area']/tab['n']
+    tab['area_per_it']=tab['area']/tab['its']
+    tab['fires_per_it']=tab['n']/tab['its']
+    return tab
+
+def sheet_tables(cache_dir,base_keys):
+    """
+    sheet_table for each of a set of sheets, reading the cache once.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Cache folder.
+    base_keys : dict
+        NTS code -> base_key for each sheet.
+
+    Returns
+    -------
+    tabs : dict
+        NTS code -> table.
+    """
+    recs=_read_records(cache_dir)
+    return {k:sheet_table(cache_dir,k,v,recs) for k,v in base_keys.items()}
+
+def ecozone_history(cache_dir,base_keys):
+    """
+    (SED_mu, average fire size) pairs for a set of test sheets, pooled over
+    the sheets, for every SED average that all of the sheets have been run
+    with. These can be passed to SED_calval.calibrate_sed as its history.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Cache folder.
+    base_keys : dict
+        NTS code -> base_key for each test sheet.
+
+    Returns
+    -------
+    hist : list of tuple
+    """
+    tabs=[tab.set_index('SED_mu') for tab in sheet_tables(cache_dir,base_keys).values()]
+    if len(tabs)==0:
+        return []
+    SED_vals=set(tabs[0].index)
+    for tab in tabs[1:]:
+        SED_vals&=set(tab.index)
+    hist=[]
+    for SED_mu in sorted(SED_vals):
+        #Pool using per-iteration rates so sheets run for different numbers
+        #of iterations are weighted the same as in a single BP3+ round
+        area=sum(tab.loc[SED_mu,'area_per_it'] for tab in tabs)
+        fires=sum(tab.loc[SED_mu,'fires_per_it'] for tab in tabs)
+        if fires>0:
+            hist.append((float(SED_mu),float(area/fires)))
+    return hist
+
+def guess_sed(cache_dir,base_keys,ez_fs_mu,n_grid=200):
+    """
+    First guess for the SED average of a set of test sheets from cached
+    runs. The burned area and number of fires per iteration are linearly
+    interpolated against SED_mu for each sheet, pooled, and the pooled
+    fire size curve is solved for the target. Sheets don't need to share
+    SED values, so runs from earlier tuning rounds with other test sheets
+    are still useful. Sheets with fewer than 2 cached SED values can't be
+    interpolated and are left out, so the guess then only reflects the
+    sheets that have been run.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Cache folder.
+    base_keys : dict
+        NTS code -> base_key for each test sheet.
+    ez_fs_mu : float
+        Target average fire size.
+    n_grid : integer, optional
+        Number of SED values the pooled curve is evaluated at. The default is
+        200.
+
+    Returns
+    -------
+    SED_mu : float or None
+        None if no sheet has 2 or more cached SED values, their SED ranges
+        don't overlap or the target isn't inside the range of the pooled
+        curve.
+    """
+    tabs=[tab for tab in sheet_tables(cache_dir,base_keys).values() if len(tab)>=2]
+    if len(tabs)==0:
+        return None
+    lo=max(tab['SED_mu'].min() for tab in tabs)
+    hi=min(tab['SED_mu'].max() for tab in tabs)
+    if lo>=hi:
+        return None
+
+    grid=np.linspace(lo,hi,n_grid)
+    area=np.zeros(n_grid)
+    fires=np.zeros(n_grid)
+    for tab in tabs:
+        area+=np.interp(grid,tab['SED_mu'],tab['area_per_it'])
+        fires+=np.interp(grid,tab['SED_mu'],tab['fires_per_it'])
+    fs=area/fires-ez_fs_mu
+
+    #First sign change of the pooled curve
+    idx=np.nonzero(np.sign(fs[:-1])*np.sign(fs[1:])<=0)[0]
+    if len(idx)==0:
+        return None
+    i=idx[0]
+    if fs[i]==fs[i+1]:
+        return float(grid[i])
+    return float(grid[i]-fs[i]*(grid[i+1]-grid[i])/(fs[i+1]-fs[i]))
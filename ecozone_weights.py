@@ -0,0 +1,130 @@
+#NTS sheet x ecozone intersection areas as a sparse matrix, computed once with a
+#vectorized overlay and cached on disk. Area-weighted averages of ecozone values
+#(FWI cutoffs, fire durations, tuned SEDs), the dominant ecozone of each sheet and
+#point-in-ecozone lookups are then sparse matrix products rather than an
+#intersection per sheet. Used by BP3Plus_SED.ipynb.
+
+import numpy as np
+import scipy.sparse as sp
+import shapely
+import hashlib
+import os
+
+
+def area_matrix(zones_a,zones_b):
+    """
+    Intersection area of every pair of geometries from two sets. Only pairs
+    whose geometries intersect are stored.
+
+    Parameters
+    ----------
+    zones_a : GeoDataFrame
+        e.g. the NTS sheets, in an equal-area CRS.
+    zones_b : GeoDataFrame
+        e.g. the ecozones, in the same CRS.
+
+    Returns
+    -------
+    A : scipy.sparse.csr_matrix
+        Shape (len(zones_a), len(zones_b)), areas in CRS units.
+    """
+    geom_a=np.asarray(zones_a.geometry.values)
+    geom_b=np.asarray(zones_b.geometry.values)
+    ia,ib=zones_b.sindex.query(geom_a,predicate='intersects')
+    area=shapely.area(shapely.intersection(geom_a[ia],geom_b[ib]))
+    keep=area>0
+    return sp.csr_matrix((area[keep],(ia[keep],ib[keep])),shape=(len(geom_a),len(geom_b)))
+
+def load_area_matrix(zones_a,zones_b,cache_dir):
+    """
+    Returns area_matrix(zones_a,zones_b), building and caching it in cache_dir
+    the first time. The file name is a hash of both sets of geometries and
+    their CRS, so editing a shapefile gives a new matrix.
+
+    Parameters
+    ----------
+    zones_a, zones_b : GeoDataFrame
+        See area_matrix.
+    cache_dir : string
+        Folder for the cached matrices.
+
+    Returns
+    -------
+    A : scipy.sparse.csr_matrix
+    """
+    h=hashlib.sha256()
+    for zones in [zones_a,zones_b]:
+        h.update(str(zones.crs).encode())
+        for wkb in shapely.to_wkb(np.asarray(zones.geometry.values)):
+            h.update(wkb)
+        h.update(b'|')
+    fp=os.path.join(cache_dir,'area_'+h.hexdigest()[:16]+'.npz')
+    if os.path.isfile(fp):
+        return sp.load_npz(fp)
+    A=area_matrix(zones_a,zones_b)
+    os.makedirs(cache_dir,exist_ok=True)
+    tmp_fp=fp[:-4]+'.tmp.npz'
+    sp.save_npz(tmp_fp,A)
+    os.replace(tmp_fp,fp)
+    return A
+
+def weighted_mean(A,vals):
+    """
+    Area-weighted average of zone values for each row of A. Zones with a NaN
+    value are left out and the weights renormalised over the rest.
+
+    Parameters
+    ----------
+    A : scipy.sparse.csr_matrix
+        From area_matrix/load_area_matrix.
+    vals : array
+        One value per column of A (e.g. per ecozone row).
+
+    Returns
+    -------
+    avg : numpy array
+        One value per row of A, NaN where a row has no area in a zone with a
+        value.
+    """
+    vals=np.asarray(vals,dtype=np.float64)
+    valid=~np.isnan(vals)
+    num=A@np.where(valid,vals,0)
+    den=A@valid.astype(np.float64)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return np.where(den>0,num/den,np.nan)
+
+def argmax_zone(A):
+    """
+    Column with the largest area in each row of A, e.g. the dominant ecozone
+    of each sheet.
+
+    Returns
+    -------
+    idx : numpy array
+        Column position for each row, -1 where the row has no area.
+    """
+    idx=np.asarray(A.argmax(axis=1)).ravel()
+    return np.where(A.getnnz(axis=1)>0,idx,-1)
+
+def point_zone(pnts,zones):
+    """
+    Zone each point falls within. Where zones overlap the first one is used.
+
+    Parameters
+    ----------
+    pnts : GeoSeries
+        Points, e.g. fire centroids. Reprojected to the zones' CRS if needed.
+    zones : GeoDataFrame
+
+    Returns
+    -------
+    idx : numpy array
+        Row position in zones for each point, -1 where a point is outside all
+        zones.
+    """
+    if pnts.crs!=zones.crs:
+        pnts=pnts.to_crs(zones.crs)
+    ip,iz=zones.sindex.query(np.asarray(pnts.values),predicate='within')
+    idx=np.full(len(pnts),len(zones),dtype=np.int64)
+    np.minimum.at(idx,ip,iz)
+    return np.where(idx<len(zones),idx,-1)
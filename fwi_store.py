@@ -0,0 +1,240 @@
+#Columnar store for the per-sheet FWI weather csvs (fwi_era_NTS_SNRC_<code>.csv
+#and the climate scenario versions fwi_era_NTS_SNRC_<code>_<scenario>.csv). The
+#csvs are ingested once into Parquet, partitioned by sheet and scenario with
+#compact integer dtypes (floats stay float64 so the weather written back out
+#matches the csvs). Exceedance counts above the FWI cutoffs for every sheet and
+#scenario then come from one scan of the fwi column, and thresholded weather
+#streams are written straight from the store. Adding a scenario only ingests
+#the new csvs. Used by BP3Plus_SED.ipynb and CC data/BP3_CC_prep.ipynb.
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import numpy as np
+import pandas as pd
+import glob
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+#Scenario name used for the baseline (no scenario suffix) csvs
+BASELINE='baseline'
+#Layout of the parquet parts. Stores written with another version are ingested
+#again in full (version 1 stored floats as float32)
+STORE_VERSION=2
+
+
+def scan_csvs(src_dir,prefix='fwi_era_NTS_SNRC_',baseline=BASELINE):
+    """
+    Finds the weather csvs in a folder (and its sub folders) and works out the
+    sheet and scenario of each from its name, e.g. fwi_era_NTS_SNRC_082L.csv
+    is sheet 082L, baseline and fwi_era_NTS_SNRC_082L_ssp1262040_2060.csv is
+    sheet 082L, scenario ssp1262040_2060.
+
+    Parameters
+    ----------
+    src_dir : string
+        Folder to search.
+    prefix : string, optional
+        File name before the sheet code. The default is 'fwi_era_NTS_SNRC_'.
+    baseline : string, optional
+        Scenario name for csvs without a scenario suffix, e.g. 'lsm' for the
+        land/sea masked fwi_era_lsm_NTS_SNRC_ csvs. The default is BASELINE.
+
+    Returns
+    -------
+    csv_ls : list of tuple
+        (NTS code, scenario, file path) for each csv.
+    """
+    pat=re.compile(re.escape(prefix)+r'(\w{4})(?:_(\w+))?\.csv$')
+    csv_ls=[]
+    for fp in sorted(glob.glob(os.path.join(src_dir,'**',prefix+'*.csv'),recursive=True)):
+        m=pat.search(os.path.basename(fp))
+        if m!=None:
+            csv_ls.append((m.group(1),m.group(2) or baseline,fp))
+    return csv_ls
+
+def _part_dir(store_dir,NTS_code,scen):
+    return os.path.join(store_dir,'NTS_SNRC='+NTS_code,'scenario='+scen)
+
+def _compact(df):
+    #Ints to the smallest type that holds them. Floats are left as read so the
+    #thresholded csvs have the same values as the originals. The original row
+    #number is kept so thresholded csvs keep the same index.
+    df=df.reset_index(drop=True)
+    df.insert(0,'row',np.arange(len(df),dtype=np.int32))
+    for col in df.columns[1:]:
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col]=pd.to_numeric(df[col],downcast='integer')
+    return df
+
+def _ingest_one(store_dir,NTS_code,scen,fp):
+    df=_compact(pd.read_csv(fp))
+    part_dir=_part_dir(store_dir,NTS_code,scen)
+    os.makedirs(part_dir,exist_ok=True)
+    tmp_fp=os.path.join(part_dir,'part-0.parquet.tmp')
+    pq.write_table(pa.Table.from_pandas(df,preserve_index=False),tmp_fp,compression='zstd')
+    os.replace(tmp_fp,os.path.join(part_dir,'part-0.parquet'))
+    st=os.stat(fp)
+    return NTS_code+'/'+scen,[fp,st.st_size,int(st.st_mtime)]
+
+def ingest(csv_ls,store_dir,n_threads=8):
+    """
+    Copies weather csvs into the store. A csv is skipped if it was already
+    ingested and hasn't changed since (same size and modification time, kept
+    in store_dir/_manifest.json), so this can be rerun as scenarios are added.
+    Everything is ingested again if the store was written with an older
+    STORE_VERSION.
+
+    Parameters
+    ----------
+    csv_ls : list of tuple
+        (NTS code, scenario, file path), e.g. from scan_csvs.
+    store_dir : string
+        Root folder of the store.
+    n_threads : integer, optional
+        Number of csvs read at the same time. Reading is mostly waiting on the
+        network drive so threads are enough. The default is 8.
+
+    Returns
+    -------
+    n_new : integer
+        Number of csvs ingested.
+    """
+    os.makedirs(store_dir,exist_ok=True)
+    #Leading _ so pyarrow doesn't treat it as part of the dataset
+    man_fp=os.path.join(store_dir,'_manifest.json')
+    manifest={}
+    if os.path.isfile(man_fp):
+        with open(man_fp) as f:
+            manifest=json.load(f)
+    if manifest.get('_version')!=STORE_VERSION:
+        manifest={'_version':STORE_VERSION}
+    todo=[]
+    for NTS_code,scen,fp in csv_ls:
+        st=os.stat(fp)
+        if manifest.get(NTS_code+'/'+scen)!=[fp,st.st_size,int(st.st_mtime)]:
+            todo.append((store_dir,NTS_code,scen,fp))
+    print(str(len(csv_ls)-len(todo))+" of "+str(len(csv_ls))+" csvs already in the store")
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_threads) as ex:
+            for key,sig in ex.map(lambda a:_ingest_one(*a),todo):
+                manifest[key]=sig
+    finally:
+        tmp_fp=man_fp+'.tmp'
+        with open(tmp_fp,'w') as f:
+            json.dump(manifest,f,indent=1)
+        os.replace(tmp_fp,man_fp)
+    return len(todo)
+
+def open_store(store_dir):
+    #Whole store as a pyarrow dataset, with the sheet and scenario as columns
+    return ds.dataset(store_dir,format='parquet',
+                      partitioning=ds.HivePartitioning.discover(infer_dictionary=True))
+
+def exceedance(store_dir,thresholds,denom=None,scenarios=None,col='fwi'):
+    """
+    Number (or fraction) of weather rows above each sheet's FWI cutoff, for
+    every sheet and scenario in one scan of the store.
+
+    Parameters
+    ----------
+    store_dir : string
+        Root folder of the store.
+    thresholds : Series
+        FWI cutoff indexed by NTS code, e.g. the FWI_cf values. Sheets not in
+        here are left out.
+    denom : Series, optional
+        Number of samples indexed by NTS code (e.g. node_days*214*11). If
+        given, counts are divided by it. The default is None (counts).
+    scenarios : list of string, optional
+        Scenarios to include. The default is None (all).
+    col : string, optional
+        Column to threshold. The default is 'fwi'.
+
+    Returns
+    -------
+    exc : DataFrame
+        Index is the NTS codes in thresholds, one column per scenario (all of
+        scenarios if given). NaN where a sheet has no data for a scenario.
+    """
+    dset=open_store(store_dir)
+    filt=ds.field('NTS_SNRC').isin(list(thresholds.index))
+    if scenarios!=None:
+        filt=filt&ds.field('scenario').isin(list(scenarios))
+    thr=thresholds.astype(np.float64)
+    counts={}
+    for batch in dset.to_batches(columns=[col,'NTS_SNRC','scenario'],filter=filt):
+        if batch.num_rows==0:
+            continue
+        nts=batch.column('NTS_SNRC')
+        scen=batch.column('scenario')
+        nts_ls=nts.dictionary.to_pylist()
+        scen_ls=scen.dictionary.to_pylist()
+        nts_i=nts.indices.to_numpy()
+        scen_i=scen.indices.to_numpy()
+        vals=batch.column(col).to_numpy(zero_copy_only=False)
+        above=vals>thr.reindex(nts_ls).values[nts_i]
+        key=nts_i*len(scen_ls)+scen_i
+        n_above=np.bincount(key,weights=above,minlength=len(nts_ls)*len(scen_ls))
+        n_rows=np.bincount(key,minlength=len(nts_ls)*len(scen_ls))
+        for k in np.flatnonzero(n_rows):
+            idx=(nts_ls[k//len(scen_ls)],scen_ls[k%len(scen_ls)])
+            counts[idx]=counts.get(idx,0)+int(n_above[k])
+    if len(counts)>0:
+        exc=pd.Series(counts,dtype=np.float64).unstack()
+    else:
+        exc=pd.DataFrame(dtype=np.float64)
+    exc=exc.reindex(index=thresholds.index,columns=scenarios if scenarios!=None else exc.columns)
+    exc.index.name='NTS_SNRC'
+    exc.columns.name='scenario'
+    if denom is not None:
+        exc=exc.div(denom.reindex(exc.index),axis=0)
+    return exc
+
+def _write_one(store_dir,NTS_code,scen,thr,fp,col):
+    part_fp=os.path.join(_part_dir(store_dir,NTS_code,scen),'part-0.parquet')
+    if not os.path.isfile(part_fp):
+        return None
+    df=pq.read_table(part_fp).to_pandas()
+    df=df[df[col]>thr]
+    df=df.set_index('row')
+    df.index.name=None
+    os.makedirs(os.path.dirname(fp),exist_ok=True)
+    df.to_csv(fp)
+    return fp
+
+def write_thresholded(store_dir,thresholds,fp_fmt,scenario=BASELINE,col='fwi',n_threads=8):
+    """
+    Writes the rows above each sheet's FWI cutoff as a csv, in the same
+    format as fwi_df[fwi_df['fwi']>FWI_cf].to_csv(fp) on the original csv.
+    One sheet is read from the store at a time.
+
+    Parameters
+    ----------
+    store_dir : string
+        Root folder of the store.
+    thresholds : Series
+        FWI cutoff indexed by NTS code.
+    fp_fmt : string
+        Output path with {0} for the NTS code and {1} for the scenario, e.g.
+        'Z:\\BP3Inputs\\{0}\\fwi_cf_era_NTS_SNRC_{0}_{1}.csv'.
+    scenario : string, optional
+        Scenario to write. The default is BASELINE.
+    col : string, optional
+        Column to threshold. The default is 'fwi'.
+    n_threads : integer, optional
+        Number of csvs written at the same time. The default is 8.
+
+    Returns
+    -------
+    fp_ls : list of string
+        Files written. Sheets with no data for the scenario are skipped.
+    """
+    args=[(store_dir,NTS_code,scenario,float(thr),fp_fmt.format(NTS_code,scenario),col)
+          for NTS_code,thr in thresholds.items()]
+    with ThreadPoolExecutor(max_workers=n_threads) as ex:
+        fp_ls=list(ex.map(lambda a:_write_one(*a),args))
+    return [fp for fp in fp_ls if fp!=None]
@@ -0,0 +1,80 @@
+#Counts of NFDB fire points per zone (NTS sheets, ignition buffers). Every fire
+#is matched to the zones it falls within once, with the zones' spatial index,
+#and the counts are then grouped from that table. Year windows, size cutoffs and
+#cause/year splits are applied when counting, so changing them doesn't mean
+#redoing the spatial join. Used by BP3Plus_igns.ipynb.
+
+import numpy as np
+import pandas as pd
+
+
+def join_points(pnts,zone_sets,cols=('CAUSE','YEAR','SIZE_HA')):
+    """
+    Finds the zones each point falls within, for one or more zone sets.
+
+    Parameters
+    ----------
+    pnts : GeoDataFrame
+        Fire points, e.g. the NFDB point file. Reprojected to each zone set's
+        CRS if needed.
+    zone_sets : dict
+        Name -> GeoDataFrame of zones. Zones may overlap (e.g. the buffered
+        sheets), a point is then matched to each zone it is in.
+    cols : tuple, optional
+        Point attributes to keep for counting. The default is
+        ('CAUSE','YEAR','SIZE_HA').
+
+    Returns
+    -------
+    hits : dict
+        Name -> DataFrame with one row per point/zone pair: 'zone' (row
+        position in the zone set), 'pnt' (row position in pnts) and cols.
+    """
+    attrs=pnts[list(cols)].reset_index(drop=True)
+    hits={}
+    for name,zones in zone_sets.items():
+        geom=pnts.geometry if pnts.crs==zones.crs else pnts.geometry.to_crs(zones.crs)
+        pnt_idx,zone_idx=zones.sindex.query(geom.values,predicate='within')
+        df=attrs.iloc[pnt_idx].reset_index(drop=True)
+        df.insert(0,'pnt',pnt_idx)
+        df.insert(0,'zone',zone_idx)
+        hits[name]=df
+    return hits
+
+def count_points(hits,n_zones,years=None,min_size=None,by=None,year_col='YEAR',size_col='SIZE_HA'):
+    """
+    Number of points per zone from a join_points table.
+
+    Parameters
+    ----------
+    hits : DataFrame
+        One zone set from join_points.
+    n_zones : integer
+        Number of zones in the set, zones without points get 0.
+    years : tuple, optional
+        First and last year (inclusive) to count. The default is None (all
+        years).
+    min_size : float, optional
+        Only count fires of at least this size (ha). The default is None (all
+        sizes).
+    by : list of string, optional
+        Columns to split the counts by, e.g. ['CAUSE'] or ['CAUSE','YEAR'].
+        The default is None (total only).
+    year_col, size_col : string, optional
+        Year and size columns. The defaults are 'YEAR' and 'SIZE_HA'.
+
+    Returns
+    -------
+    counts : Series or DataFrame
+        Indexed by zone position. A Series of totals if by is None, otherwise
+        one column per group.
+    """
+    sel=hits
+    if years!=None:
+        sel=sel[sel[year_col].between(*years)]
+    if min_size!=None:
+        sel=sel[sel[size_col].ge(min_size)]
+    if by==None:
+        return pd.Series(np.bincount(sel['zone'],minlength=n_zones),name='count')
+    counts=sel.groupby(['zone']+list(by)).size().unstack(list(by),fill_value=0)
+    return counts.reindex(range(n_zones),fill_value=0)
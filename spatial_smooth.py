@@ -0,0 +1,142 @@
+#Neighbour graphs for the NTS sheets (k nearest centroids or touching sheets) as
+#sparse matrices, built once and cached on disk, plus NaN-aware row-normalised
+#smoothing of any number of columns at once with a sparse matrix product. Used
+#for the SED smoothing in BP3Plus_SED.ipynb and the climate adjustment factors
+#in CC data/CC_batch.py.
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.spatial import cKDTree
+import shapely
+import hashlib
+import os
+
+
+def knn_graph(geoms,k=8):
+    """
+    k nearest neighbours of each geometry by centroid distance, not counting
+    itself (same neighbours as libpysal.weights.KNN.from_dataframe).
+
+    Parameters
+    ----------
+    geoms : GeoDataFrame or GeoSeries
+    k : integer, optional
+        Number of neighbours. The default is 8.
+
+    Returns
+    -------
+    W : scipy.sparse.csr_matrix
+        Shape (n, n), 1 where column j is a neighbour of row i.
+    """
+    cent=shapely.centroid(np.asarray(geoms.geometry.values))
+    xy=np.column_stack([shapely.get_x(cent),shapely.get_y(cent)])
+    n=len(xy)
+    k=min(k,n-1)
+    #k+1 as each point is its own nearest neighbour
+    _,nbr=cKDTree(xy).query(xy,k=k+1)
+    rows=np.repeat(np.arange(n),k+1)
+    cols=nbr.ravel()
+    keep=cols!=rows
+    #With duplicate centroids self may not come first, so drop the extra
+    #neighbour where self wasn't found
+    W=sp.csr_matrix((np.ones(keep.sum()),(rows[keep],cols[keep])),shape=(n,n))
+    extra=np.flatnonzero(W.getnnz(axis=1)>k)
+    if len(extra):
+        W=W.tolil()
+        for i in extra:
+            W[i,nbr[i,-1]]=0
+        W=W.tocsr()
+        W.eliminate_zeros()
+    return W
+
+def touches_graph(geoms):
+    """
+    Geometries that touch each other (share an edge or a corner), from one
+    spatial index query.
+
+    Parameters
+    ----------
+    geoms : GeoDataFrame or GeoSeries
+
+    Returns
+    -------
+    W : scipy.sparse.csr_matrix
+        Shape (n, n), 1 where column j touches row i.
+    """
+    g=np.asarray(geoms.geometry.values)
+    i,j=geoms.sindex.query(g,predicate='touches')
+    return sp.csr_matrix((np.ones(len(i)),(i,j)),shape=(len(g),len(g)))
+
+def load_graph(geoms,kind,cache_dir,k=8):
+    """
+    Returns knn_graph or touches_graph for geoms, building and caching it in
+    cache_dir the first time. The file name is a hash of the geometries, kind
+    and k.
+
+    Parameters
+    ----------
+    geoms : GeoDataFrame or GeoSeries
+    kind : string
+        'knn' or 'touches'.
+    cache_dir : string
+        Folder for the cached graphs.
+    k : integer, optional
+        Number of neighbours for 'knn'. The default is 8.
+
+    Returns
+    -------
+    W : scipy.sparse.csr_matrix
+    """
+    h=hashlib.sha256()
+    h.update((kind+'|'+str(k)+'|'+str(geoms.crs)).encode())
+    for wkb in shapely.to_wkb(np.asarray(geoms.geometry.values)):
+        h.update(wkb)
+    fp=os.path.join(cache_dir,kind+'_'+h.hexdigest()[:16]+'.npz')
+    if os.path.isfile(fp):
+        return sp.load_npz(fp)
+    if kind=='knn':
+        W=knn_graph(geoms,k)
+    elif kind=='touches':
+        W=touches_graph(geoms)
+    else:
+        raise ValueError("kind must be 'knn' or 'touches'")
+    os.makedirs(cache_dir,exist_ok=True)
+    tmp_fp=fp[:-4]+'.tmp.npz'
+    sp.save_npz(tmp_fp,W)
+    os.replace(tmp_fp,fp)
+    return W
+
+def smooth(W,X,include_self=False):
+    """
+    Row-normalised average of each row's neighbours, for one or more columns
+    at once. NaN values are left out and the weights renormalised over the
+    remaining neighbours, so a row is only NaN if all of its neighbours are.
+
+    Parameters
+    ----------
+    W : scipy.sparse matrix
+        Neighbour graph, e.g. from load_graph.
+    X : array, Series or DataFrame
+        Values to smooth, one row per geometry. Columns (e.g. climate
+        scenarios) are smoothed independently.
+    include_self : bool, optional
+        Include each row's own value in its average, as in a nanmean over a
+        sheet and the sheets it touches. The default is False (as in
+        libpysal.weights.lag_spatial with row-standardised weights).
+
+    Returns
+    -------
+    X_sm : same type and shape as X
+    """
+    if include_self:
+        W=W+sp.identity(W.shape[0],format='csr')
+    vals=np.asarray(X,dtype=np.float64)
+    valid=~np.isnan(vals)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        sm=(W@np.where(valid,vals,0))/(W@valid.astype(np.float64))
+    if isinstance(X,pd.DataFrame):
+        return pd.DataFrame(sm,index=X.index,columns=X.columns)
+    if isinstance(X,pd.Series):
+        return pd.Series(sm,index=X.index,name=X.name)
+    return sm
@@ -0,0 +1,191 @@
+#Stage timing for the tuning and input pipelines. span() wraps a block of code
+#(or a function, as a decorator) and, once configure() has been called, appends
+#one JSON line per call with its wall time, CPU time, peak memory and bytes
+#read/written. Tags from context() are added to every span inside it, e.g. the
+#ecozone and NTS sheet being run. summarise() totals the logs to show where the
+#time goes. Each process writes its own file so pool workers never share one.
+#What can be measured depends on the platform: CPU time of finished child
+#processes (e.g. SyncroSim) only on Linux/macOS, bytes read/written only with
+#psutil installed, and peak memory with psutil or on Linux/macOS. Anything not
+#measured is logged as null and shown as n/a by summarise().
+
+import contextlib
+import json
+import os
+import time
+import glob
+import numpy as np
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil=None
+try:
+    import resource
+except ImportError:
+    resource=None
+
+#Folder the logs are written to, None means spans aren't recorded
+_log_dir=None
+#Tags added to every span, see context()
+_context={}
+
+
+def configure(log_dir):
+    """
+    Starts (or, with None, stops) recording spans to log_dir.
+
+    Parameters
+    ----------
+    log_dir : string or None
+        Folder for the JSONL logs, one file per process.
+
+    Returns
+    -------
+    """
+    global _log_dir
+    _log_dir=log_dir
+    if log_dir!=None:
+        os.makedirs(log_dir,exist_ok=True)
+
+def get_log_dir():
+    return _log_dir
+
+def get_context():
+    #Copy of the current tags, e.g. to pass on to a pool worker
+    return dict(_context)
+
+@contextlib.contextmanager
+def context(**tags):
+    """
+    Adds tags (e.g. NTS_code='082L') to every span recorded inside the with
+    block.
+    """
+    prev=dict(_context)
+    _context.update(tags)
+    try:
+        yield
+    finally:
+        _context.clear()
+        _context.update(prev)
+
+def _usage():
+    t=os.times()
+    u={'cpu':t.user+t.system,'cpu_children':None,
+       'peak_rss':None,'read_bytes':None,'write_bytes':None}
+    #Child times are always 0 on Windows
+    if os.name!='nt':
+        u['cpu_children']=t.children_user+t.children_system
+    if psutil!=None:
+        proc=psutil.Process()
+        try:
+            io=proc.io_counters()
+            u['read_bytes'],u['write_bytes']=io.read_bytes,io.write_bytes
+        except (AttributeError,psutil.Error):
+            pass
+        u['peak_rss']=getattr(proc.memory_info(),'peak_wset',None)
+    if u['peak_rss']==None and resource!=None:
+        #kB on Linux
+        u['peak_rss']=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+    return u
+
+def _write(rec):
+    fp=os.path.join(_log_dir,'stages_'+str(os.getpid())+'.jsonl')
+    with open(fp,'a') as f:
+        f.write(json.dumps(rec,default=str)+'\n')
+
+class span(contextlib.ContextDecorator):
+    """
+    Times a stage. Use as a context manager,
+
+        with span('scen_run',jobs=4):
+            ...
+
+    or as a decorator, @span('setup_scen'). Extra tags can be added while
+    the span is open through its tags dict. Nothing is recorded unless
+    configure() has been called.
+    """
+    def __init__(self,name,**tags):
+        self.name=name
+        self.tags=tags
+
+    def _recreate_cm(self):
+        #New instance for each call of a decorated function
+        return span(self.name,**self.tags)
+
+    def __enter__(self):
+        if _log_dir!=None:
+            self.t0=time.time()
+            self.u0=_usage()
+        return self
+
+    def __exit__(self,exc_type,exc,tb):
+        if _log_dir==None or not hasattr(self,'t0'):
+            return False
+        u1=_usage()
+        rec={'name':self.name,'start':self.t0,'wall':time.time()-self.t0,
+             'cpu':u1['cpu']-self.u0['cpu'],'peak_rss':u1['peak_rss'],
+             'pid':os.getpid(),'status':'ok' if exc_type==None else 'error'}
+        for k in ['cpu_children','read_bytes','write_bytes']:
+            rec[k]=None if u1[k]==None else u1[k]-self.u0[k]
+        rec.update(_context)
+        rec.update(self.tags)
+        _write(rec)
+        return False
+
+def read_logs(log_dir):
+    #All spans in log_dir as a DataFrame
+    rec_ls=[]
+    for fp in sorted(glob.glob(os.path.join(log_dir,'stages_*.jsonl'))):
+        with open(fp) as f:
+            rec_ls+=[json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(rec_ls)
+
+def summarise(log_dir,by=('NTS_code',),top=None):
+    """
+    Totals per stage, e.g. per sheet or per ecozone, sorted by wall time.
+
+    Parameters
+    ----------
+    log_dir : string
+        Folder with the JSONL logs.
+    by : tuple, optional
+        Tags to group by before the stage name, e.g. ('ecozone',). Spans
+        without the tag are grouped under NaN. The default is ('NTS_code',).
+    top : integer, optional
+        Only return this many rows. The default is None (all).
+
+    Returns
+    -------
+    summ : DataFrame
+        Count, total/mean wall time, CPU (own and child processes), peak RSS,
+        bytes read/written and the share of the group's wall time for each
+        group and stage. Spans can nest, so an outer span's times include
+        those of the spans inside it. Values that weren't measured on the
+        platform the logs came from are 'n/a'.
+    """
+    df=read_logs(log_dir)
+    if len(df)==0:
+        return df
+    keys=list(by)+['name']
+    for k in keys:
+        if k not in df:
+            df[k]=None
+    opt=['cpu_children','peak_rss','read_bytes','write_bytes']
+    for k in opt:
+        df[k]=pd.to_numeric(df[k],errors='coerce') if k in df else np.nan
+    _sum=lambda s:s.sum(min_count=1)
+    summ=df.groupby(keys,dropna=False).agg(n=('wall','size'),wall=('wall','sum'),wall_mean=('wall','mean'),
+                                           cpu=('cpu','sum'),cpu_children=('cpu_children',_sum),
+                                           peak_rss=('peak_rss','max'),read_bytes=('read_bytes',_sum),
+                                           write_bytes=('write_bytes',_sum))
+    if len(by)>0:
+        summ['pct_wall']=100*summ['wall']/summ.groupby(level=list(range(len(by))),dropna=False)['wall'].transform('sum')
+    else:
+        summ['pct_wall']=100*summ['wall']/summ['wall'].sum()
+    summ=summ.sort_values('wall',ascending=False)
+    if top!=None:
+        summ=summ.head(top)
+    summ[opt]=summ[opt].astype(object).where(summ[opt].notna(),'n/a')
+    return summ
@@ -0,0 +1,6 @@
+import os
+import sys
+
+TESTS_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path[:0]=[TESTS_DIR,os.path.join(TESTS_DIR,'..'),os.path.join(TESTS_DIR,'..','CC data'),
+              os.path.join(TESTS_DIR,'..','benchmarks')]
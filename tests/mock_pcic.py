@@ -0,0 +1,126 @@
+#Local stand-in for the PCIC OPeNDAP server, used by the PCIC_fetch tests. Any
+#url of the form build_url makes, i.e. .../<file>.nc.nc?<var>[t0:t1][y0:y1][x0:x1]
+#is answered with a small netCDF subset of synthetic values,
+#
+#   <var>[t,y,x] = t + y/100 + x/10000
+#
+#on an n_lat x n_lon grid (the spatial slices are clipped to it). Failures can
+#be queued so the retry paths of fetch can be tested, see Server.fail.
+
+import io
+import re
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import xarray as xr
+
+_QUERY=re.compile(r'\?(\w+)\[(\d+):(\d+)\]\[(\d+):(\d+)\]\[(\d+):(\d+)\]')
+
+
+def subset(var,t0,t1,y0,y1,x0,x1,n_lat=4,n_lon=5):
+    """
+    Dataset served for a request. Slices are inclusive, as in OPeNDAP.
+    """
+    t=np.arange(t0,t1+1)
+    y=np.arange(y0,min(y1,n_lat-1)+1)
+    x=np.arange(x0,min(x1,n_lon-1)+1)
+    vals=t[:,None,None]+y[None,:,None]/100+x[None,None,:]/10000
+    ds=xr.Dataset({var:(('time','lat','lon'),vals.astype('float32'))},
+                  coords={'time':t,'lat':40+y,'lon':-140+x})
+    ds['time'].attrs={'units':'days since 1950-01-01','calendar':'365_day'}
+    return ds
+
+class Server:
+    """
+    Serves subsets on localhost from a background thread. Use as a context
+    manager, the base url to pass to plan_requests is in .url.
+
+    Parameters
+    ----------
+    n_lat, n_lon : integer, optional
+        Grid size. The defaults are 4 and 5.
+    """
+    def __init__(self,n_lat=4,n_lon=5):
+        self.n_lat=n_lat
+        self.n_lon=n_lon
+        #Paths of all requests received, failed or not
+        self.requests=[]
+        self._rules=[]
+        self._lock=threading.Lock()
+
+    def fail(self,action,match='',times=1):
+        """
+        Queues a failure for the next request(s) whose path contains match.
+
+        Parameters
+        ----------
+        action : integer or string
+            HTTP status to answer with, 'truncate' (send half the file then
+            close the connection) or 'hang' (never answer, for timeouts).
+        match : string, optional
+            The default is '' (any request).
+        times : integer, optional
+            Number of requests to fail. The default is 1.
+        """
+        with self._lock:
+            self._rules+=[(match,action)]*times
+
+    def _next_action(self,path):
+        with self._lock:
+            self.requests.append(path)
+            for i,(match,action) in enumerate(self._rules):
+                if match in path:
+                    del self._rules[i]
+                    return action
+        return None
+
+    def body(self,path):
+        m=_QUERY.search(path)
+        if m==None:
+            return None
+        var=m.group(1)
+        idx=[int(v) for v in m.groups()[1:]]
+        buf=io.BytesIO()
+        buf.write(subset(var,*idx,n_lat=self.n_lat,n_lon=self.n_lon).to_netcdf())
+        return buf.getvalue()
+
+    def __enter__(self):
+        server=self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                action=server._next_action(self.path)
+                if action=='hang':
+                    server._stop.wait()
+                    return
+                if isinstance(action,int):
+                    self.send_error(action)
+                    return
+                data=server.body(self.path)
+                if data==None:
+                    self.send_error(400,'Malformed constraint expression')
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type','application/x-netcdf')
+                self.send_header('Content-Length',str(len(data)))
+                self.end_headers()
+                if action=='truncate':
+                    self.wfile.write(data[:len(data)//2])
+                    self.close_connection=True
+                    return
+                self.wfile.write(data)
+
+            def log_message(self,*args):
+                pass
+
+        self._stop=threading.Event()
+        self._httpd=ThreadingHTTPServer(('127.0.0.1',0),Handler)
+        self._httpd.daemon_threads=True
+        self._thread=threading.Thread(target=self._httpd.serve_forever,daemon=True)
+        self._thread.start()
+        self.url='http://127.0.0.1:'+str(self._httpd.server_address[1])+'/data/downscaled_cmip6_multi/'
+        return self
+
+    def __exit__(self,*exc):
+        self._stop.set()
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,129 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import build_inputs
+import fwi_store
+
+CODES=['082L','083A','093N']
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    #FWI store and ign grids for three sheets
+    rng=np.random.default_rng(0)
+    csv_dir=tmp_path/'csv'
+    csv_dir.mkdir()
+    for code in CODES:
+        pd.DataFrame({'date':np.arange(50),'fwi':rng.uniform(0,40,50).round(7),
+                      'ws':rng.uniform(0,30,50)}).to_csv(csv_dir/('fwi_era_NTS_SNRC_'+code+'.csv'),index=False)
+    store_dir=str(tmp_path/'store')
+    fwi_store.ingest(fwi_store.scan_csvs(str(csv_dir)),store_dir)
+    grid_dir=tmp_path/'grids'
+    for code in CODES[:2]:
+        (grid_dir/('NTS_SNRC_'+code)).mkdir(parents=True)
+        for pre in build_inputs.IGN_GRID_PRE:
+            (grid_dir/('NTS_SNRC_'+code)/(pre+'NTS_SNRC_'+code+'.tif')).write_bytes(pre.encode())
+    tab=pd.DataFrame({'ign_num':[.5,2.,3.5],'sed_mu':[2.,3.,4.],'fwi_cf':[10.,20.,30.]},index=CODES)
+    return {'csv_dir':csv_dir,'store_dir':store_dir,'grid_dir':str(grid_dir),'tab':tab,
+            'out_dir':str(tmp_path/'out')}
+
+def _plan(inp,tab=None):
+    tab=inp['tab'] if tab is None else tab
+    return build_inputs.plan(list(tab.index),tab['ign_num'],tab['sed_mu'],tab['fwi_cf'],
+                             store_dir=inp['store_dir'],ign_grid_dir=inp['grid_dir'])
+
+def _mtimes(out_dir):
+    return {fp:os.stat(os.path.join(out_dir,fp)).st_mtime_ns for fp in
+            [os.path.join(d,f) for d in CODES if os.path.isdir(os.path.join(out_dir,d)) for f in os.listdir(os.path.join(out_dir,d))]}
+
+@pytest.mark.parametrize('n_workers',[1,2])
+def test_bundle_contents(inputs,n_workers):
+    res=build_inputs.build(_plan(inputs),inputs['out_dir'],n_workers=n_workers)
+    assert sorted(res['built'])==CODES
+    sheet_dir=os.path.join(inputs['out_dir'],'082L')
+    assert sorted(os.listdir(sheet_dir))==sorted([build_inputs.BUNDLE,'ign_dist_082L.csv','sed_dist_082L.csv',
+                                                  'fwi_era_cf_NTS_SNRC_082L.csv']+
+                                                 [pre+'NTS_SNRC_082L.tif' for pre in build_inputs.IGN_GRID_PRE])
+    #Weather is the same as thresholding the original csv
+    orig=pd.read_csv(inputs['csv_dir']/'fwi_era_NTS_SNRC_082L.csv')
+    ref=orig[orig['fwi']>10.].to_csv()
+    with open(os.path.join(sheet_dir,'fwi_era_cf_NTS_SNRC_082L.csv')) as f:
+        assert f.read()==ref
+    #No ign grids for 093N
+    assert not any(fn.endswith('.tif') for fn in os.listdir(os.path.join(inputs['out_dir'],'093N')))
+
+def test_incremental_rebuild(inputs):
+    out_dir=inputs['out_dir']
+    build_inputs.build(_plan(inputs),out_dir,n_workers=1)
+    mt=_mtimes(out_dir)
+    res=build_inputs.build(_plan(inputs),out_dir,n_workers=1)
+    assert res['built']==[] and res['skipped']==3
+    assert _mtimes(out_dir)==mt
+
+    #Only the sheet whose SED changed is rewritten
+    tab=inputs['tab'].copy()
+    tab.loc['083A','sed_mu']=5.
+    res=build_inputs.build(_plan(inputs,tab),out_dir,n_workers=1)
+    assert res['built']==['083A']
+    mt2=_mtimes(out_dir)
+    assert {fp for fp in mt if mt[fp]!=mt2[fp]}<={os.path.join('083A',fn) for fn in os.listdir(os.path.join(out_dir,'083A'))}
+    with open(os.path.join(out_dir,'083A',build_inputs.BUNDLE)) as f:
+        assert json.load(f)['spec']['sed_mu']==5.
+
+    #Removing a sheet's ign grids drops the copies from its bundle
+    for pre in build_inputs.IGN_GRID_PRE:
+        os.remove(os.path.join(inputs['grid_dir'],'NTS_SNRC_082L',pre+'NTS_SNRC_082L.tif'))
+    res=build_inputs.build(_plan(inputs,tab),out_dir,n_workers=1)
+    assert res['built']==['082L']
+    assert not any(fn.endswith('.tif') for fn in os.listdir(os.path.join(out_dir,'082L')))
+
+def test_verify_rebuilds_missing_bundle(inputs):
+    out_dir=inputs['out_dir']
+    build_inputs.build(_plan(inputs),out_dir,n_workers=1)
+    os.remove(os.path.join(out_dir,'093N',build_inputs.BUNDLE))
+    assert build_inputs.build(_plan(inputs),out_dir,n_workers=1)['built']==[]
+    assert build_inputs.build(_plan(inputs),out_dir,n_workers=1,verify=True)['built']==['093N']
+
+def test_prune(inputs):
+    out_dir=inputs['out_dir']
+    build_inputs.build(_plan(inputs),out_dir,n_workers=1)
+    #A file that isn't part of the bundle is left alone
+    with open(os.path.join(out_dir,'083A','sed_dist_083A_ssp245.csv'),'w') as f:
+        f.write('x')
+    tab=inputs['tab'].drop(['083A','093N'])
+    res=build_inputs.build(_plan(inputs,tab),out_dir,n_workers=1,prune=False)
+    assert res['removed']==[]
+    assert os.path.isfile(os.path.join(out_dir,'093N',build_inputs.BUNDLE))
+    res=build_inputs.build(_plan(inputs,tab),out_dir,n_workers=1)
+    assert res['removed']==['083A','093N']
+    assert os.listdir(os.path.join(out_dir,'083A'))==['sed_dist_083A_ssp245.csv']
+    assert not os.path.exists(os.path.join(out_dir,'093N'))
+    with open(os.path.join(out_dir,build_inputs.MANIFEST)) as f:
+        assert sorted(json.load(f))==['082L']
+
+def test_failed_build_keeps_old_bundle(inputs,monkeypatch):
+    out_dir=inputs['out_dir']
+    build_inputs.build(_plan(inputs),out_dir,n_workers=1)
+    sheet_dir=os.path.join(out_dir,'083A')
+    old={fn:open(os.path.join(sheet_dir,fn),'rb').read() for fn in os.listdir(sheet_dir)}
+
+    #Fail after the dists are written to the temp folder but before the
+    #weather, so nothing has been moved into place yet
+    def _fail(*args,**kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(build_inputs,'write_thresholded',_fail)
+    tab=inputs['tab'].copy()
+    tab['sed_mu']+=1
+    res=build_inputs.build(_plan(inputs,tab),out_dir,n_workers=1)
+    assert sorted(res['failed'])==CODES
+    assert {fn:open(os.path.join(sheet_dir,fn),'rb').read() for fn in os.listdir(sheet_dir)}==old
+    with open(os.path.join(out_dir,build_inputs.MANIFEST)) as f:
+        assert json.load(f)=={}
+
+    #and the failed sheets are retried on the next build
+    monkeypatch.undo()
+    res=build_inputs.build(_plan(inputs,tab),out_dir,n_workers=1)
+    assert sorted(res['built'])==CODES and res['failed']=={}
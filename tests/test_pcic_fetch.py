@@ -0,0 +1,90 @@
+import json
+import os
+import urllib.error
+import pytest
+import xarray as xr
+
+import PCIC_fetch
+from mock_pcic import Server
+
+
+@pytest.fixture
+def srv():
+    with Server() as s:
+        yield s
+
+def _reqs(srv,years=(2001,2002)):
+    return PCIC_fetch.plan_requests('pr','ssp245',list(years),chunk_years=1,
+                                    models=PCIC_fetch.mod_ls[:2],base_url=srv.url)
+
+def test_plan_requests_base_url(srv):
+    req_ls=_reqs(srv)
+    assert len(req_ls)==4
+    assert all(req['url'].startswith(srv.url) for req in req_ls)
+    assert PCIC_fetch.plan_requests('pr','ssp245',[2001],models=PCIC_fetch.mod_ls[:1])[0]['url'].startswith(PCIC_fetch.BASE_URL)
+
+def test_fetch_subset(srv,tmp_path):
+    req=_reqs(srv)[0]
+    fp=str(tmp_path/'a'/'pr.nc')
+    n_bytes=PCIC_fetch.fetch(req['url'],fp,backoff=0)
+    assert n_bytes==os.path.getsize(fp)
+    with xr.open_dataset(fp,decode_times=False) as ds:
+        assert ds['pr'].shape==(365,4,5)
+        assert int(ds['time'][0])==PCIC_fetch.time_index(req['mod'],2001)
+
+def test_fetch_retries_server_errors(srv,tmp_path):
+    srv.fail(503)
+    srv.fail('truncate')
+    fp=str(tmp_path/'pr.nc')
+    PCIC_fetch.fetch(_reqs(srv)[0]['url'],fp,backoff=0)
+    assert len(srv.requests)==3
+    with xr.open_dataset(fp,decode_times=False) as ds:
+        assert ds['pr'].shape==(365,4,5)
+    assert not os.path.exists(fp+'.part')
+
+def test_fetch_retries_timeouts(srv,tmp_path):
+    srv.fail('hang')
+    fp=str(tmp_path/'pr.nc')
+    PCIC_fetch.fetch(_reqs(srv)[0]['url'],fp,backoff=0,timeout=.5)
+    assert len(srv.requests)==2
+    assert os.path.isfile(fp)
+
+def test_fetch_no_retry_on_client_error(srv,tmp_path):
+    srv.fail(404)
+    fp=str(tmp_path/'pr.nc')
+    with pytest.raises(urllib.error.HTTPError):
+        PCIC_fetch.fetch(_reqs(srv)[0]['url'],fp,backoff=0)
+    assert len(srv.requests)==1
+    assert not os.path.exists(fp) and not os.path.exists(fp+'.part')
+
+def test_fetch_partial_never_replaces(srv,tmp_path):
+    #A download cut off on its last attempt leaves the old file alone
+    fp=str(tmp_path/'pr.nc')
+    with open(fp,'wb') as f:
+        f.write(b'old')
+    srv.fail('truncate',times=2)
+    with pytest.raises(Exception):
+        PCIC_fetch.fetch(_reqs(srv)[0]['url'],fp,retries=1,backoff=0)
+    with open(fp,'rb') as f:
+        assert f.read()==b'old'
+    assert not os.path.exists(fp+'.part')
+
+def test_download_all_resumes(srv,tmp_path):
+    req_ls=_reqs(srv)
+    bad=req_ls[1]
+    srv.fail(404,match=bad['url'][bad['url'].index('/data/'):])
+    cache_dir=str(tmp_path)
+    fp_dict,failed=PCIC_fetch.download_all(req_ls,cache_dir,n_threads=2,backoff=0)
+    assert failed==[bad['key']]
+    assert sorted(fp_dict)==sorted(req['key'] for req in req_ls if req is not bad)
+    with open(os.path.join(cache_dir,'manifest.json')) as f:
+        assert bad['key'] not in json.load(f)
+
+    #Rerun only asks for what's missing: the failed request and a file that
+    #was deleted since
+    os.remove(fp_dict[req_ls[0]['key']])
+    n_req=len(srv.requests)
+    fp_dict,failed=PCIC_fetch.download_all(req_ls,cache_dir,n_threads=2,backoff=0)
+    assert failed==[]
+    assert len(fp_dict)==4
+    assert sorted(srv.requests[n_req:])==sorted(r['url'][r['url'].index('/data/'):] for r in [req_ls[0],bad])
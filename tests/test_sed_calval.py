@@ -0,0 +1,64 @@
+import os
+import sys
+import threading
+import pandas as pd
+import pytest
+
+#SED_calval with the benchmark's stand-in for pysyncrosim
+import mock_syncrosim
+sys.modules['pysyncrosim']=mock_syncrosim
+import SED_calval
+
+
+@pytest.fixture
+def template(tmp_path):
+    fp=tmp_path/'NTS_template.ssim'
+    fp.write_bytes(b'')
+    work_root=tmp_path/'work'
+    work_root.mkdir()
+    return str(fp),str(work_root)
+
+def _worker_fp(_):
+    return SED_calval._worker_ssim_fp
+
+def _make_pool(ssim_fp,work_root,timeout=60):
+    #make_pool in a thread, so a pool stuck restarting workers fails the test
+    #instead of blocking it
+    res={}
+    def run():
+        try:
+            res['pool']=SED_calval.make_pool(2,ssim_fp,work_root)
+        except Exception as e:
+            res['error']=e
+    th=threading.Thread(target=run,daemon=True)
+    th.start()
+    th.join(timeout)
+    assert not th.is_alive(), "make_pool blocked"
+    return res
+
+def test_make_pool_shared_temp_dir(template,tmp_path,monkeypatch):
+    ssim_fp,work_root=template
+    class Library(mock_syncrosim.Library):
+        def __init__(self,name):
+            super().__init__(name)
+            self.info=pd.DataFrame({'Property':['Name:','Temporary files:'],
+                                    'Value':[os.path.basename(name),str(tmp_path/'shared.temp')]})
+    monkeypatch.setattr(mock_syncrosim,'library',lambda name,session=None,**kwargs:Library(name))
+    res=_make_pool(ssim_fp,work_root)
+    assert isinstance(res.get('error'),RuntimeError)
+    assert 'pool' not in res
+    assert os.listdir(work_root)==[]
+
+def test_make_pool_worker_copies(template):
+    ssim_fp,work_root=template
+    res=_make_pool(ssim_fp,work_root)
+    assert 'error' not in res
+    pool=res['pool']
+    try:
+        fp_ls=pool.map(_worker_fp,range(4))
+    finally:
+        pool.close()
+        pool.join()
+    assert all(os.path.dirname(fp).startswith(os.path.join(work_root,'bp3_worker_')) for fp in fp_ls)
+    #Library copies are removed when the workers exit
+    assert os.listdir(work_root)==[]
@@ -0,0 +1,144 @@
+#Fuel pixel counts per zone (NTS sheets, ignition buffers) from the national FBP
+#fuel layer in a single pass over the raster. The raster is read in windowed
+#blocks, the zone IDs for each block are rasterized and the fuel pixels are
+#counted per zone with bincount. Overlapping zones (the sheet buffers) are split
+#into layers of non-overlapping geometries so each layer is one zone ID raster.
+#Any number of geometry sets can be counted in the same pass. Used by
+#BP3Plus_igns.ipynb.
+
+import numpy as np
+import rasterio as rio
+from rasterio.features import rasterize
+from rasterio.windows import Window, bounds as win_bounds, transform as win_transform
+from shapely import STRtree
+import multiprocessing as mp
+
+#Set by _init_worker in each pool worker
+_worker_src=None
+_worker_args=None
+
+
+def overlap_layers(geoms):
+    """
+    Splits geometries into layers where no two geometries in a layer overlap
+    (greedy colouring of the intersection graph). Touching along an edge counts
+    as overlapping, which is harmless, it only adds a layer.
+
+    Parameters
+    ----------
+    geoms : array of shapely geometries
+
+    Returns
+    -------
+    layer : numpy array
+        Layer number for each geometry.
+    """
+    geoms=np.asarray(geoms)
+    tree=STRtree(geoms)
+    src,dst=tree.query(geoms,predicate='intersects')
+    order=np.argsort(src,kind='stable')
+    src,dst=src[order],dst[order]
+    split=np.searchsorted(src,np.arange(len(geoms)+1))
+    layer=np.full(len(geoms),-1,dtype=np.int32)
+    for i in range(len(geoms)):
+        used=set(layer[dst[split[i]:split[i+1]]])
+        k=0
+        while k in used:
+            k+=1
+        layer[i]=k
+    return layer
+
+def _prep_set(geoms,crs):
+    #Geometries in the raster CRS grouped by layer, with their bounds so each
+    #block only rasterizes the geometries that reach it
+    geoms=geoms.to_crs(crs)
+    geom_arr=np.asarray(geoms.geometry.values)
+    bnds=geoms.bounds.values
+    layer=overlap_layers(geom_arr)
+    layer_ls=[]
+    for k in range(layer.max()+1 if len(layer) else 0):
+        idx=np.flatnonzero(layer==k)
+        layer_ls.append((idx,geom_arr[idx],bnds[idx]))
+    return len(geom_arr),layer_ls
+
+def _is_fuel(vals,nodata,nonfuel):
+    fuel=(vals<nonfuel[0])|(vals>nonfuel[1])
+    if nodata!=None:
+        fuel&=vals!=nodata
+    return fuel
+
+def _count_block(src,window,set_dict,nonfuel):
+    #Fuel pixel counts for each zone set within one block
+    vals=src.read(1,window=window)
+    fuel=_is_fuel(vals,src.nodata,nonfuel)
+    counts={name:np.zeros(n,dtype=np.int64) for name,(n,layer_ls) in set_dict.items()}
+    if not fuel.any():
+        return counts
+    left,bottom,right,top=win_bounds(window,src.transform)
+    tf=win_transform(window,src.transform)
+    for name,(n,layer_ls) in set_dict.items():
+        for idx,geom_arr,bnds in layer_ls:
+            hit=np.flatnonzero((bnds[:,0]<right)&(bnds[:,2]>left)&(bnds[:,1]<top)&(bnds[:,3]>bottom))
+            if len(hit)==0:
+                continue
+            #Zone IDs are 1-based so 0 is outside all zones in this layer
+            zid=rasterize(zip(geom_arr[hit],range(1,len(hit)+1)),out_shape=vals.shape,
+                          transform=tf,fill=0,dtype='int32')
+            counts[name][idx[hit]]+=np.bincount(zid[fuel],minlength=len(hit)+1)[1:]
+    return counts
+
+def _blocks(width,height,block_size):
+    return [Window(c,r,min(block_size,width-c),min(block_size,height-r))
+            for r in range(0,height,block_size) for c in range(0,width,block_size)]
+
+def _init_worker(raster_fp,set_dict,nonfuel):
+    global _worker_src, _worker_args
+    _worker_src=rio.open(raster_fp)
+    _worker_args=(set_dict,nonfuel)
+
+def _block_worker(window):
+    return _count_block(_worker_src,window,*_worker_args)
+
+def zonal_fuel_counts(raster_fp,zone_sets,block_size=4096,n_workers=1,nonfuel=(100,150)):
+    """
+    Counts fuel pixels in each zone of one or more geometry sets, reading the
+    raster once. A pixel is in a zone if its centre is inside the geometry,
+    same as rio.clip.
+
+    Parameters
+    ----------
+    raster_fp : string
+        FBP fuel layer (or any single band raster of fuel codes).
+    zone_sets : dict
+        Name -> GeoDataFrame/GeoSeries of zones, in any CRS. Zones may
+        overlap, e.g. the buffered sheets.
+    block_size : integer, optional
+        Rows/columns per block read. The default is 4096.
+    n_workers : integer, optional
+        Number of processes reading blocks at the same time. The default is 1.
+    nonfuel : tuple, optional
+        Range of fuel codes (inclusive) that are not fuel, e.g. water and
+        non-fuel. Nodata pixels are never fuel. The default is (100,150).
+
+    Returns
+    -------
+    counts : dict
+        Name -> numpy array of fuel pixel counts, in the same order as the
+        rows of each zone set.
+    """
+    with rio.open(raster_fp) as src:
+        crs=src.crs.to_wkt()
+        block_ls=_blocks(src.width,src.height,block_size)
+        set_dict={name:_prep_set(geoms,crs) for name,geoms in zone_sets.items()}
+        counts={name:np.zeros(n,dtype=np.int64) for name,(n,layer_ls) in set_dict.items()}
+        if n_workers==1:
+            for window in block_ls:
+                for name,c in _count_block(src,window,set_dict,nonfuel).items():
+                    counts[name]+=c
+            return counts
+
+    with mp.Pool(n_workers,initializer=_init_worker,initargs=(raster_fp,set_dict,nonfuel)) as pool:
+        for block_counts in pool.imap_unordered(_block_worker,block_ls):
+            for name,c in block_counts.items():
+                counts[name]+=c
+    return counts
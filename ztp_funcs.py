@@ -0,0 +1,178 @@
+#Zero-truncated Poisson (ztp) distributions used for the SED and ign number
+#inputs of BP3+. Used by SED_calval.py and the SED/ign notebooks.
+
+import functools
+import os
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln, lambertw
+
+
+#Get probs for zero-truncated poisson dist dists
+def ztp(L,x):
+    return np.exp(ztp_logpmf(L,x))
+
+#Calc parameters to define ztp based on desired average. Will be fed into
+#fsolve, a numerical solver
+def ztp_mean(L,mu):
+    return (L*np.e**(L))/(np.e**(L)-1)-mu
+
+def ztp_logpmf(L,x):
+    """
+    Log probabilities of a ztp dist. Done in log space with gammaln so large
+    values of x don't overflow like math.factorial does.
+
+    Parameters
+    ----------
+    L : float or array
+        Lambda parameter(s).
+    x : int or array
+        Values (>=1). Broadcast against L.
+
+    Returns
+    -------
+    logp : float or array
+    """
+    L=np.asarray(L,dtype=np.float64)
+    x=np.asarray(x,dtype=np.float64)
+    return x*np.log(L)-L-gammaln(x+1)-np.log(-np.expm1(-L))
+
+def ztp_lambda(mu):
+    """
+    Solves ztp_mean(L,mu)=0 for an array of target means. The ztp mean
+    L/(1-exp(-L)) has the closed form inverse L = mu + W0(-mu*exp(-mu))
+    (W0 is the principal branch of the Lambert W function), which is
+    polished with a couple of Newton steps as W0 loses precision near its
+    branch point (mu close to 1).
+
+    Parameters
+    ----------
+    mu : float or array
+        Target means, must be >= 1.
+
+    Returns
+    -------
+    L : array
+        Lambda for each mean. 0 where mu is 1.
+    """
+    mu=np.atleast_1d(np.asarray(mu,dtype=np.float64))
+    assert np.all(mu>=1), "ztp mean must be at least 1"
+    L=mu+np.real(lambertw(-mu*np.exp(-mu)))
+    L=np.maximum(L,0)
+    pos=mu>1
+    for i in range(3):
+        Lp=np.maximum(L[pos],1e-12)
+        q=-np.expm1(-Lp) #1-exp(-L)
+        f=Lp/q-mu[pos]
+        df=(q-Lp*np.exp(-Lp))/q**2
+        L[pos]=np.maximum(Lp-f/df,1e-12)
+    L[~pos]=0
+    return L
+
+def ztp_dist_batch(mu,keys=None,name=None,key_name='NTS_SNRC',min_prob=.01):
+    """
+    Creates ztp dists for many target means at once. Values run from 1
+    until the probability drops to min_prob or below and the value is at
+    least the mean, same as ztp_dist. A mean of exactly 1 gives a single
+    value of 1. NaN means (e.g., sheets with no data) are skipped.
+
+    Parameters
+    ----------
+    mu : array
+        Target means, must be >= 1.
+    keys : array, optional
+        Label (e.g., NTS code) for each mean. The default is None, which uses
+        the position of the mean.
+    name : string, optional
+        Either SED or Igns. Added as a Name column if given.
+    key_name : string, optional
+        Name of the key column. The default is 'NTS_SNRC'.
+    min_prob : float, optional
+        Probability cutoff. The default is .01.
+
+    Returns
+    -------
+    ztp_df : pandas.DataFrame
+        Long table with key_name, 'Value' and 'RelativeFrequency' columns
+        (and 'Name' if given), one row per sheet and value.
+    """
+    if name!=None:
+        assert name in ['SED','Igns'], "Name must be either SED or Igns"
+    mu=np.atleast_1d(np.asarray(mu,dtype=np.float64))
+    if keys is None:
+        keys=np.arange(len(mu))
+    keys=np.asarray(keys)
+    keys,mu=keys[~np.isnan(mu)],mu[~np.isnan(mu)]
+    if len(mu)==0:
+        return pd.DataFrame(columns=[key_name,'Value','RelativeFrequency'])
+    L=ztp_lambda(mu)
+
+    #The pmf is below any sensible cutoff well within 10 sds of the mean
+    x_max=int(np.ceil(mu.max()+10*np.sqrt(mu.max())+10))
+    x=np.arange(1,x_max+1)
+    #L is 0 for a mean of 1, which is filled in below
+    with np.errstate(divide='ignore',invalid='ignore'):
+        prob=np.exp(ztp_logpmf(L[:,None],x[None,:]))
+    #Last value is the first one where prob<=min_prob and x>=mu
+    stop=(prob<=min_prob)&(x[None,:]>=mu[:,None])
+    n_val=np.argmax(stop,axis=1)+1
+    n_val[mu==1]=1
+    prob[mu==1,0]=1
+
+    keep=x[None,:]<=n_val[:,None]
+    ztp_df=pd.DataFrame({key_name:np.repeat(keys,n_val),
+                         'Value':np.broadcast_to(x,prob.shape)[keep],
+                         'RelativeFrequency':prob[keep]})
+    if name!=None:
+        ztp_df['Name']=name
+    return ztp_df
+
+@functools.lru_cache(maxsize=4096)
+def _ztp_vals(mu):
+    #Values and probs for a single mean, memoized as tuning and the notebooks
+    #ask for the same means over and over
+    tdf=ztp_dist_batch([mu])
+    return tuple(tdf['Value']),tuple(tdf['RelativeFrequency'])
+
+#Create ztp dist
+def ztp_dist(name,mu):
+    assert name in ['SED','Igns'], "Name must be either SED or Igns"
+    val_ls,rf_ls=_ztp_vals(float(mu))
+    ztp_df=pd.DataFrame({'Value':list(val_ls),'RelativeFrequency':list(rf_ls)})
+    ztp_df['Name']=name
+    return ztp_df
+
+def write_sheet_csvs(ztp_df,fp_fmt,val_col,key_name='NTS_SNRC'):
+    """
+    Writes a long table from ztp_dist_batch out as one BP3+ dist csv per
+    sheet, with the relative frequency as a percentage rounded to 2
+    decimals (same as the notebooks).
+
+    Parameters
+    ----------
+    ztp_df : pandas.DataFrame
+        Output of ztp_dist_batch.
+    fp_fmt : string
+        File path with a {} for the sheet key, e.g.
+        'C:\\BP3Inputs\\{0}\\sed_dist_{0}.csv'.
+    val_col : string
+        Name of the value column, 'sp_ev_days' for SEDs and 'ign_per_it' for
+        igns.
+    key_name : string, optional
+        Name of the key column. The default is 'NTS_SNRC'.
+
+    Returns
+    -------
+    fp_ls : list of string
+        Files written. Sheets whose folder doesn't exist are skipped.
+    """
+    out_df=pd.DataFrame({key_name:ztp_df[key_name],val_col:ztp_df['Value'],
+                         'pct':np.round(ztp_df['RelativeFrequency']*100,2)})
+    fp_ls=[]
+    for key,dt in out_df.groupby(key_name,sort=False):
+        fp=fp_fmt.format(key)
+        if not os.path.isdir(os.path.dirname(fp)):
+            continue
+        dt[[val_col,'pct']].to_csv(fp,index=False)
+        fp_ls.append(fp)
+    return fp_ls